@@ -0,0 +1 @@
+default_app_config = 'profile_api.apps.ProfileApiConfig'
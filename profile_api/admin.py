@@ -1,6 +1,209 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.admin.views.main import ChangeList
+from django.db import connections, transaction
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from profile_api import changes
+from profile_api import counters
 from profile_api import models
- 
-#  Registers model for django admin
-admin.site.register(models.UserProfile)
-admin.site.register(models.ProfileFeedItem)
\ No newline at end of file
+from profile_api import profiling
+from profile_api import search
+from profile_api.authentication import token_cache
+from profile_api.caching import profile_responses
+
+# Rows per query/transaction of the bulk actions
+CHUNK_SIZE = getattr(settings, 'PROFILE_API_ADMIN_CHUNK_SIZE', 500)
+
+# Query parameter holding the last id of the previous changelist page
+CURSOR_VAR = 'after'
+
+
+def iter_pk_chunks(queryset, chunk_size=None):
+    """Yield the primary keys of a queryset in ascending chunks (keyset, no OFFSET)"""
+    chunk_size = chunk_size or CHUNK_SIZE
+    last_pk = None
+    queryset = queryset.order_by('pk').values_list('pk', flat=True)
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        pks = list(chunk[:chunk_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+class KeysetChangeList(ChangeList):
+    """Changelist paged by ?after=<id> (newest first) instead of OFFSET & COUNT(*)
+
+    The total shown is the maintained row count (profile_api/counters.py)
+    when no filter or search is applied, otherwise none is shown.
+    """
+
+    def get_filters_params(self, params=None):
+        """Keep the cursor out of the admin's lookup filters"""
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        queryset = self.queryset.order_by('-pk')
+        after = request.GET.get(CURSOR_VAR)
+        if after is not None and after.isdigit():
+            queryset = queryset.filter(pk__lt=int(after))
+        rows = list(queryset[:self.list_per_page + 1])
+        # Date hierarchy selections are lookup params too
+        unfiltered = not self.get_filters_params() and not self.query
+        total = counters.get(self.model) if unfiltered else None
+
+        self.result_list = rows[:self.list_per_page]
+        self.has_next = len(rows) > self.list_per_page
+        # Links of the pagination block (admin/profile_api/keyset_change_list.html)
+        self.next_url = self.get_query_string({CURSOR_VAR: self.result_list[-1].pk}) if self.has_next else None
+        self.newest_url = self.get_query_string(remove=[CURSOR_VAR]) if after is not None else None
+        self.result_count = total if total is not None else len(self.result_list)
+        self.full_result_count = total
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = self.has_next or after is not None
+        self.paginator = None
+
+
+class KeysetModelAdmin(admin.ModelAdmin):
+    """ModelAdmin whose changelist never counts or offsets the whole table"""
+    change_list_template = 'admin/profile_api/keyset_change_list.html'
+    show_full_result_count = False
+    # Keyset pages follow the id order only
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+
+@admin.register(models.UserProfile)
+class UserProfileAdmin(KeysetModelAdmin):
+    """Profiles with an FTS backed search & chunked bulk actions"""
+    list_display = ('id', 'email', 'name', 'is_active', 'is_staff', 'updated_on')
+    # Also used by the feed item autocomplete
+    search_fields = ('name', 'email')
+    ordering = ('-id',)
+    actions = ('deactivate_users', 'purge_feed')
+
+    def get_search_results(self, request, queryset, search_term):
+        """Narrow the icontains search down with the FTS index when available"""
+        queryset, use_distinct = super().get_search_results(request, queryset, search_term)
+        terms = [term for term in search_term.split() if len(term) >= search.MIN_TERM_LENGTH]
+        if terms and search.is_available(connections[queryset.db]):
+            queryset = search.restrict_to_matches(queryset, search.match_expression(terms))
+        return queryset, use_distinct
+
+    def deactivate_users(self, request, queryset):
+        """Deactivate the selected users, in chunks
+
+        update() sends no post_save, so the tokens & cached responses the
+        signal receivers would have evicted are evicted here, once a chunk
+        commits. Both move generations shared by every worker
+        (SharedGenerations), no worker keeps serving the deactivated users.
+        """
+        updated = 0
+        for pks in iter_pk_chunks(queryset):
+            with transaction.atomic():
+                updated += models.UserProfile.objects.filter(pk__in=pks).update(
+                    is_active=False, updated_on=timezone.now(),
+                )
+                keys = list(Token.objects.filter(user_id__in=pks).values_list('key', flat=True))
+            token_cache.delete(*keys)
+            profile_responses.bump('list', *['obj:%s' % pk for pk in pks])
+        self.message_user(request, 'Deactivated %d users.' % updated, messages.SUCCESS)
+    deactivate_users.short_description = 'Deactivate selected users'
+
+    def purge_feed(self, request, queryset):
+        """Delete every feed item of the selected users, a chunk per transaction"""
+        deleted = 0
+        for user_pks in iter_pk_chunks(queryset):
+            items = models.ProfileFeedItem.objects.filter(user_profile_id__in=user_pks)
+            for pks in iter_pk_chunks(items):
+                # One DELETE & one tombstone INSERT per chunk, in a transaction
+                deleted += changes.delete_items(models.ProfileFeedItem.objects.filter(pk__in=pks))
+        self.message_user(request, 'Deleted %d feed items.' % deleted, messages.SUCCESS)
+    purge_feed.short_description = 'Purge the feed of selected users'
+
+
+@admin.register(models.ProfileFeedItem)
+class ProfileFeedItemAdmin(KeysetModelAdmin):
+    """Feed items with their author in the same query & an indexed date drill-down"""
+    list_display = ('id', 'user_profile', 'status_text', 'created_on')
+    list_select_related = ('user_profile',)
+    # Search through UserProfileAdmin instead of a <select> of every user
+    autocomplete_fields = ('user_profile',)
+    # Served by the (created_on, id) index
+    date_hierarchy = 'created_on'
+    ordering = ('-id',)
+
+    def delete_model(self, request, obj):
+        """Delete an item with its tombstone (feed items have no post_delete receiver)"""
+        changes.delete_items(models.ProfileFeedItem.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        """Delete the selected items with one DELETE & their tombstones with one INSERT"""
+        changes.delete_items(queryset)
+
+
+@staff_member_required
+def profiling_view(request):
+    """Admin page listing the stored request profiles, aggregating or diffing them
+
+    ?route=<route>[/<file>] shows the top functions of its profiles, with
+    ?other= too the functions whose time changed most between the two sets.
+    ?sort= (calls, tottime, cumulative) & ?limit= as in /api/profiling/.
+    """
+    store = profiling.get_store()
+    sort = request.GET.get('sort', 'cumulative')
+    if sort not in ('calls', 'tottime', 'cumulative'):
+        sort = 'cumulative'
+    limit = request.GET.get('limit', '30')
+    limit = int(limit) if limit.isdigit() else 30
+
+    routes = {}
+    for route_name, _, _, size, metadata in store.files():
+        summary = routes.setdefault(route_name, {'profiles': 0, 'bytes': 0, 'durations': []})
+        summary['profiles'] += 1
+        summary['bytes'] += size
+        summary['durations'].append(metadata['duration_ms'])
+
+    reference = request.GET.get('route', '')
+    other = request.GET.get('other', '')
+    paths = store.resolve(reference) if reference else []
+    other_paths = store.resolve(other) if other else []
+    functions = diff = None
+    if paths and other_paths:
+        diff = profiling.diff_functions(
+            (profiling.load_stats(paths), len(paths)),
+            (profiling.load_stats(other_paths), len(other_paths)),
+            sort, limit,
+        )
+    elif paths:
+        functions = profiling.top_functions(profiling.load_stats(paths), sort, limit)
+
+    context = dict(
+        admin.site.each_context(request),
+        title='Request profiles',
+        routes=[
+            (name, summary['profiles'], summary['bytes'], max(summary['durations']))
+            for name, summary in sorted(routes.items())
+        ],
+        reference=reference,
+        other=other,
+        not_found=[value for value, found in ((reference, paths), (other, other_paths)) if value and not found],
+        sort=sort,
+        sorts=('cumulative', 'tottime', 'calls'),
+        limit=limit,
+        profiles=(len(paths), len(other_paths)),
+        functions=functions,
+        diff=diff,
+    )
+    return TemplateResponse(request, 'admin/profile_api/profiling.html', context)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ProfileApiConfig(AppConfig):
     name = 'profile_api'
+
+    def ready(self):
+        # Register signal receivers (cache invalidation, etc)
+        from profile_api import signals  # noqa: F401
@@ -0,0 +1,127 @@
+# Hot/cold partitioning of the feed (app_name/archive.py)
+# Feed items older than the retention window are moved from the hot
+# ProfileFeedItem table to ArchivedFeedItem by the archive_feed command, so
+# feed queries, indexes & VACUUM only pay for recent rows. Reads reaching
+# past the window use FeedItemHistory, a UNION ALL view over both tables.
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from profile_api import counters
+from profile_api import models
+
+HOT_TABLE = 'profile_api_profilefeeditem'
+ARCHIVE_TABLE = 'profile_api_archivedfeeditem'
+HISTORY_VIEW = 'profile_api_feeditem_history'
+
+COLUMNS = 'id, user_profile_id, status_text, created_on, updated_on'
+
+
+def install(connection):
+    """Create the history view, returns False until both tables exist
+
+    Called after every migrate (profile_api/signals.py) rather than from a
+    migration, SQLite table rebuilds don't cope with views on the table.
+    """
+    tables = connection.introspection.table_names()
+    if HOT_TABLE not in tables or ARCHIVE_TABLE not in tables:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('DROP VIEW IF EXISTS %s' % HISTORY_VIEW)
+        cursor.execute(
+            'CREATE VIEW %s AS SELECT %s FROM %s UNION ALL SELECT %s FROM %s'
+            % (HISTORY_VIEW, COLUMNS, HOT_TABLE, COLUMNS, ARCHIVE_TABLE)
+        )
+    return True
+
+
+def uninstall(connection):
+    """Drop the history view (before migrations rebuild its tables)"""
+    if HISTORY_VIEW in connection.introspection.table_names(include_views=True):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP VIEW %s' % HISTORY_VIEW)
+
+
+def retention_cutoff():
+    """Return the datetime before which feed items are archived, None to keep all"""
+    days = getattr(settings, 'PROFILE_API_FEED_RETENTION_DAYS', 365)
+    if days is None:
+        return None
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_batch(cutoff, batch_size):
+    """Move the oldest batch_size hot items created before cutoff, returns the count
+
+    Runs in its own short transaction so writers only wait for one batch.
+    """
+    using = router.db_for_write(models.ProfileFeedItem)
+    with transaction.atomic(using=using):
+        # Oldest first, served by the (created_on, id) index
+        rows = list(
+            models.ProfileFeedItem.objects.using(using)
+            .filter(created_on__lt=cutoff)
+            .order_by('created_on', 'id')
+            .values_list('id', 'user_profile_id', 'status_text', 'created_on', 'updated_on')[:batch_size]
+        )
+        if not rows:
+            return 0
+        models.ArchivedFeedItem.objects.using(using).bulk_create([
+            models.ArchivedFeedItem(
+                id=id, user_profile_id=user_profile_id, status_text=status_text,
+                created_on=created_on, updated_on=updated_on,
+            )
+            for id, user_profile_id, status_text, created_on, updated_on in rows
+        ])
+        # Delete up to the last copied row (keyset bound, no id list to send).
+        # A single DELETE without post_delete signals: the rows moved, they
+        # weren't deleted, and nothing references feed items.
+        last_id, _, _, last_created_on, _ = rows[-1]
+        models.ProfileFeedItem.objects.using(using).filter(
+            Q(created_on__lt=last_created_on) | Q(created_on=last_created_on, id__lte=last_id),
+        )._raw_delete(using)
+        # Counts hot rows, _raw_delete sends no post_delete
+        counters.add(models.ProfileFeedItem, -len(rows))
+    return len(rows)
+
+
+def table_bytes(connection, table):
+    """Return the bytes used by a table & its indexes, None if unknown
+
+    Uses SQLite's dbstat virtual table when it's compiled in.
+    """
+    if connection.vendor != 'sqlite':
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT SUM(pgsize) FROM dbstat WHERE name IN '
+                '(SELECT name FROM sqlite_master WHERE tbl_name = %s)',
+                [table],
+            )
+            return cursor.fetchone()[0] or 0
+    except DatabaseError:
+        # No dbstat in this SQLite build
+        return None
+
+
+def database_bytes(connection):
+    """Return (file bytes, free bytes) of an SQLite database, None elsewhere"""
+    if connection.vendor != 'sqlite':
+        return None
+    values = []
+    with connection.cursor() as cursor:
+        for pragma in ('page_size', 'page_count', 'freelist_count'):
+            cursor.execute('PRAGMA %s' % pragma)
+            values.append(cursor.fetchone()[0])
+    page_size, page_count, free_pages = values
+    return page_count * page_size, free_pages * page_size
+
+
+def get_connection():
+    """Return the connection archival writes go to"""
+    return connections[router.db_for_write(models.ProfileFeedItem)]
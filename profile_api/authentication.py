@@ -0,0 +1,152 @@
+# Authentication classes used by the ViewSets (app_name/authentication.py)
+
+import os
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+from profile_api.caching import LRUCache, SharedGenerations
+
+# Defaults, override with PROFILE_API_TOKEN_CACHE in settings.py
+TOKEN_CACHE_DEFAULTS = {
+    # Max number of tokens kept in each worker process
+    'MAX_ENTRIES': 10000,
+    # Seconds a cached token is trusted before it is looked up again
+    'TTL': 300,
+    # Optional alias from settings.CACHES shared by all workers (None = disabled)
+    'SHARED_CACHE': None,
+    # Shared file of the generations checked on every hit, so a token
+    # evicted by one worker is dropped by all of them, & its number of rows
+    'GENERATIONS_PATH': os.path.join(
+        getattr(settings, 'PROFILE_API_SHM_DIRECTORY', '/tmp/profile_api'), 'token_generations',
+    ),
+    'GENERATION_ROWS': 4096,
+}
+
+
+class TokenCache:
+    """Two tier (in-process LRU + optional shared Django cache) map of token key -> (user, token)
+
+    Every entry carries the generation of its key (SharedGenerations) read
+    before the token was looked up; delete() moves the generation, so a
+    token evicted in one worker misses in every worker on its next use.
+    """
+
+    key_prefix = 'profile_api:token:'
+
+    def __init__(self, max_entries, ttl, generations, shared_cache=None):
+        self.ttl = ttl
+        self.local = LRUCache(max_entries=max_entries, ttl=ttl)
+        self.generations = generations
+        self.shared_cache = shared_cache
+        self.shared_hits = 0
+        self.stale = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        """Return the shared cache backend or None if not configured"""
+        if self.shared_cache is None:
+            return None
+        return caches[self.shared_cache]
+
+    def generation(self, key):
+        """Return the current generation of a token key, read it before the lookup"""
+        return self.generations.get(key)
+
+    def get(self, key):
+        """Return the cached (user, token) pair for key or None"""
+        generation = self.generation(key)
+        entry = self.local.get(key)
+        if entry is not None:
+            if entry[2] == generation:
+                return entry[:2]
+            # Evicted by another worker
+            self.local.delete(key)
+            with self._lock:
+                self.stale += 1
+        shared = self.shared
+        if shared is not None:
+            entry = shared.get(self.key_prefix + key)
+            if entry is not None and entry[2] == generation:
+                # Promote to the local tier
+                self.local.set(key, entry)
+                with self._lock:
+                    self.shared_hits += 1
+                return entry[:2]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, entry, generation):
+        """Store a (user, token) pair in every tier, loaded at `generation`"""
+        entry = tuple(entry) + (generation,)
+        self.local.set(key, entry)
+        shared = self.shared
+        if shared is not None:
+            shared.set(self.key_prefix + key, entry, self.ttl)
+
+    def delete(self, *keys):
+        """Evict token keys from every tier & every worker"""
+        if not keys:
+            return
+        self.generations.bump(*keys)
+        for key in keys:
+            self.local.delete(key)
+        shared = self.shared
+        if shared is not None:
+            shared.delete_many([self.key_prefix + key for key in keys])
+
+    def clear(self):
+        """Drop every locally cached token"""
+        self.local.clear()
+
+    def stats(self):
+        """Return hit/miss counters for both tiers"""
+        return {
+            'local_hits': self.local.hits,
+            'shared_hits': self.shared_hits,
+            'stale': self.stale,
+            'misses': self.misses,
+            'entries': len(self.local),
+            'max_entries': self.local.max_entries,
+        }
+
+
+def _build_token_cache():
+    """Create the process wide token cache from settings"""
+    config = dict(TOKEN_CACHE_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_TOKEN_CACHE', {}))
+    return TokenCache(
+        max_entries=config['MAX_ENTRIES'],
+        ttl=config['TTL'],
+        generations=SharedGenerations(config['GENERATIONS_PATH'], config['GENERATION_ROWS']),
+        shared_cache=config['SHARED_CACHE'],
+    )
+
+
+token_cache = _build_token_cache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Drop-in TokenAuthentication that skips the Token/User query on cache hits
+
+    Entries are evicted in every worker by signals (profile_api/signals.py)
+    once a token is deleted or re-issued and once the owning user is saved
+    or deleted, and by the admin's bulk actions.
+    """
+
+    def authenticate_credentials(self, key):
+        """Return (user, token) for key, hitting the database only on a miss"""
+        entry = token_cache.get(key)
+        if entry is not None:
+            return entry
+        # Before the lookup: an eviction committed meanwhile makes it stale
+        generation = token_cache.generation(key)
+        # Performs the Token lookup (joined to the user) & is_active check
+        entry = super().authenticate_credentials(key)
+        token_cache.set(key, entry, generation)
+        return entry
@@ -0,0 +1,320 @@
+# In-process load benchmark of every API route (app_name/benchmark.py)
+# Requests go through the real WSGI application (middleware, auth,
+# serializers, rendering), only the network is left out.
+# Run with `python manage.py benchmark_api`.
+
+import io
+import itertools
+import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.contrib.auth.hashers import make_password
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from profile_api import compression
+from profile_api import models
+from profile_api import renderers
+
+PASSWORD = 'bench-password'
+EMAIL = 'bench-user-%d@example.com'
+
+
+class Dataset:
+    """Synthetic users (with tokens) & feed items the scenarios work on"""
+
+    def __init__(self, users, items_per_user):
+        self.users = users
+        self.items_per_user = items_per_user
+        self.user_ids = []
+        self.tokens = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def unique(self):
+        """Return a process wide unique number (emails, status texts, ...)"""
+        with self._lock:
+            return next(self._counter)
+
+    def load(self):
+        """Insert the users, tokens & feed items"""
+        # Hash once, every synthetic user shares the password
+        password = make_password(PASSWORD)
+        models.UserProfile.objects.bulk_create(
+            models.UserProfile(email=EMAIL % index, name='Bench User %d' % index, password=password)
+            for index in range(self.users)
+        )
+        self.user_ids = list(
+            models.UserProfile.objects.filter(email__startswith='bench-user-')
+            .order_by('pk').values_list('pk', flat=True)
+        )
+        Token.objects.bulk_create(
+            Token(user_id=user_id, key=Token().generate_key()) for user_id in self.user_ids
+        )
+        self.tokens = dict(Token.objects.filter(user_id__in=self.user_ids).values_list('user_id', 'key'))
+        models.ProfileFeedItem.objects.bulk_create(
+            models.ProfileFeedItem(user_profile_id=user_id, status_text='Status %d of %d' % (index, user_id))
+            for user_id in self.user_ids
+            for index in range(self.items_per_user)
+        )
+        return self
+
+    def owner(self, number):
+        """Return (user id, token key) of a user picked round robin"""
+        user_id = self.user_ids[number % len(self.user_ids)]
+        return user_id, self.tokens[user_id]
+
+    def create_user(self):
+        """Create a throwaway user with a token, returns (user id, token key)"""
+        user = models.UserProfile.objects.create_user(
+            'bench-extra-%d@example.com' % self.unique(), 'Bench Extra', None,
+        )
+        return user.pk, Token.objects.create(user=user).key
+
+    def create_item(self, user_id):
+        """Create a throwaway feed item, returns its id"""
+        return models.ProfileFeedItem.objects.create(user_profile_id=user_id, status_text='Bench item').pk
+
+
+class Scenario:
+    """One route/method; build(dataset, number) returns the request to send
+
+    prepare(dataset, count) runs before timing and returns the per-request
+    fixtures (e.g. rows to delete), passed to build as `fixture`.
+    """
+
+    def __init__(self, name, method, build, prepare=None, expected=(200,)):
+        self.name = name
+        self.method = method
+        self.build = build
+        self.prepare = prepare
+        self.expected = expected
+
+
+def _json(data):
+    return json.dumps(data).encode('utf-8')
+
+
+def _request(path, token=None, body=None):
+    """Return a request tuple (path, token, JSON body)"""
+    return path, token, body
+
+
+def _own_items(dataset, count):
+    """Feed items owned by the round robin owner of each request number"""
+    return [dataset.create_item(dataset.owner(number)[0]) for number in range(count)]
+
+
+def _throwaway_users(dataset, count):
+    """Users with tokens each request can delete"""
+    return [dataset.create_user() for _ in range(count)]
+
+
+SCENARIOS = [
+    Scenario('hello-view GET', 'GET', lambda ds, n, f: _request('/api/hello-view/')),
+    Scenario('hello-view POST', 'POST', lambda ds, n, f: _request('/api/hello-view/', body={'name': 'Bench'})),
+    Scenario('login POST', 'POST', lambda ds, n, f: _request(
+        '/api/login/', body={'username': EMAIL % (n % ds.users), 'password': PASSWORD},
+    )),
+    Scenario('profile-list GET', 'GET', lambda ds, n, f: _request('/api/profile/')),
+    Scenario('profile-list search', 'GET', lambda ds, n, f: _request(
+        '/api/profile/?search=User%%20%d' % (n % ds.users),
+    )),
+    Scenario('profile-list POST', 'POST', lambda ds, n, f: _request('/api/profile/', body={
+        'email': 'bench-new-%d@example.com' % ds.unique(), 'name': 'Bench New', 'password': PASSWORD,
+    }), expected=(201,)),
+    Scenario('profile-detail GET', 'GET', lambda ds, n, f: _request(
+        '/api/profile/%d/' % ds.owner(n)[0],
+    )),
+    Scenario('profile-detail PATCH', 'PATCH', lambda ds, n, f: _request(
+        '/api/profile/%d/' % ds.owner(n)[0], ds.owner(n)[1], {'name': 'Renamed %d' % n},
+    )),
+    Scenario('profile-detail DELETE', 'DELETE', lambda ds, n, f: _request(
+        '/api/profile/%d/' % f[0], f[1],
+    ), prepare=_throwaway_users, expected=(204,)),
+    Scenario('feed-list GET', 'GET', lambda ds, n, f: _request('/api/feed/', ds.owner(n)[1])),
+    Scenario('feed-list POST', 'POST', lambda ds, n, f: _request(
+        '/api/feed/', ds.owner(n)[1], {'status_text': 'Bench status %d' % n},
+    ), expected=(201,)),
+    Scenario('feed-detail GET', 'GET', lambda ds, n, f: _request('/api/feed/%d/' % f, ds.owner(n)[1]),
+             prepare=_own_items),
+    Scenario('feed-detail PATCH', 'PATCH', lambda ds, n, f: _request(
+        '/api/feed/%d/' % f, ds.owner(n)[1], {'status_text': 'Edited %d' % n},
+    ), prepare=_own_items),
+    Scenario('feed-detail DELETE', 'DELETE', lambda ds, n, f: _request(
+        '/api/feed/%d/' % f, ds.owner(n)[1],
+    ), prepare=_own_items, expected=(204,)),
+]
+
+
+# List pages the encoding comparison renders
+ENCODING_ROUTES = ('/api/profile/?page_size=200', '/api/feed/?page_size=200')
+
+
+def call_wsgi(application, method, path, token=None, body=None, extra=None):
+    """Send one request through the WSGI app, returns (status, headers, body)
+
+    extra: additional WSGI environ keys.
+    """
+    path, _, query = path.partition('?')
+    payload = _json(body) if body is not None else b''
+    environ = {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': '127.0.0.1',
+        'HTTP_HOST': '127.0.0.1',
+        'HTTP_ACCEPT': 'application/json',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(payload)),
+        'wsgi.input': io.BytesIO(payload),
+    }
+    if token:
+        environ['HTTP_AUTHORIZATION'] = 'Token ' + token
+    environ.update(extra or {})
+    setup_testing_defaults(environ)
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = int(status.split(' ', 1)[0])
+        captured['headers'] = dict(headers)
+
+    result = application(environ, start_response)
+    try:
+        content = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return captured['status'], captured['headers'], content
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(int(math.ceil(percent / 100.0 * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+def run_scenario(application, dataset, scenario, requests, concurrency):
+    """Send `requests` requests with `concurrency` threads, returns the summary"""
+    fixtures = scenario.prepare(dataset, requests) if scenario.prepare else [None] * requests
+
+    def send(number):
+        path, token, body = scenario.build(dataset, number, fixtures[number])
+        started = time.perf_counter()
+        status, headers, _ = call_wsgi(application, scenario.method, path, token, body)
+        return time.perf_counter() - started, status, int(headers.get('X-DB-Queries', 0))
+
+    started = time.perf_counter()
+    if concurrency == 1:
+        # Same thread (and DB connection) as the caller, works inside a test transaction
+        samples = [send(number) for number in range(requests)]
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(send, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [sample[0] for sample in samples]
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': sum(1 for sample in samples if sample[1] not in scenario.expected),
+        'rps': requests / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'queries_per_request': sum(sample[2] for sample in samples) / requests,
+    }
+
+
+def run(dataset, requests=100, concurrency=(1,), routes=None, application=None, progress=None):
+    """Run every scenario (or those whose name contains one of `routes`)"""
+    application = application or get_wsgi_application()
+    results = {}
+    # The middleware reports the query count of each request in a header
+    # No rate limits or concurrency caps, the benchmark is one client
+    with override_settings(
+        PROFILE_API_QUERY_HEADERS=True,
+        PROFILE_API_THROTTLE_RATES={},
+        PROFILE_API_CONCURRENCY_LIMITS={},
+    ):
+        for scenario in SCENARIOS:
+            if routes and not any(route in scenario.name for route in routes):
+                continue
+            for level in concurrency:
+                key = '%s @%d' % (scenario.name, level)
+                results[key] = run_scenario(application, dataset, scenario, requests, level)
+                if progress:
+                    progress(key, results[key])
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    """Return a list of regressions of results against a baseline
+
+    A regression is a p95 latency more than `threshold` (fraction) above the
+    baseline, a throughput more than `threshold` below it, more queries per
+    request or new errors.
+    """
+    regressions = []
+    for key, current in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        if previous['p95_ms'] and current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append('%s: p95 %.1fms -> %.1fms' % (key, previous['p95_ms'], current['p95_ms']))
+        if previous['rps'] and current['rps'] < previous['rps'] * (1 - threshold):
+            regressions.append('%s: %.1f -> %.1f requests/s' % (key, previous['rps'], current['rps']))
+        if current['queries_per_request'] > previous['queries_per_request']:
+            regressions.append('%s: %.2f -> %.2f queries/request' % (
+                key, previous['queries_per_request'], current['queries_per_request'],
+            ))
+        if current['errors'] > previous['errors']:
+            regressions.append('%s: %d -> %d errors' % (key, previous['errors'], current['errors']))
+    return regressions
+
+
+def _time_encoding(render, data, encoding, repeat):
+    """Return (bytes, mean ms) of rendering data & compressing it with encoding"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        content = render(data)
+        if encoding is not None:
+            content = compression.compress(content, encoding)
+    return len(content), (time.perf_counter() - started) / repeat * 1000
+
+
+def compare_encodings(dataset, repeat=20, application=None):
+    """Bytes on the wire & encode time of each renderer x compression of the list pages
+
+    The page data is fetched once through the app, then rendered (and
+    compressed) `repeat` times per combination, keyed '<path> <renderer>+<encoding>'.
+    """
+    application = application or get_wsgi_application()
+    encoders = (
+        ('json', JSONRenderer().render),
+        ('columnar', renderers.ColumnarRenderer().render),
+    )
+    results = {}
+    with override_settings(PROFILE_API_QUERY_HEADERS=True):
+        for path in ENCODING_ROUTES:
+            _, token = dataset.owner(0)
+            status, _, content = call_wsgi(application, 'GET', path, token)
+            if status != 200:
+                raise RuntimeError('%s answered %d' % (path, status))
+            data = json.loads(content.decode('utf-8'))
+            for name, render in encoders:
+                for encoding in (None,) + compression.ENCODINGS:
+                    size, encode_ms = _time_encoding(render, data, encoding, repeat)
+                    results['%s %s+%s' % (path, name, encoding or 'identity')] = {
+                        'bytes': size, 'encode_ms': encode_ms,
+                    }
+    return results
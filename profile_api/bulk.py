@@ -0,0 +1,160 @@
+# Batched bulk write helpers used by the ViewSet bulk actions (app_name/bulk.py)
+
+import logging
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ParseError, ValidationError
+
+from profile_api import caching
+from profile_api import changes
+from profile_api import counters
+from profile_api import hashing
+from profile_api import models
+from profile_api import serializers
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_EMAIL_ERRORS = {'email': ['user profile with this email already exists.']}
+
+
+def get_batch_size(request, setting, default, max_setting, max_default):
+    """Return the batch size from ?batch_size=, capped by settings"""
+    batch_size = getattr(settings, setting, default)
+    max_batch_size = getattr(settings, max_setting, max_default)
+    value = request.query_params.get('batch_size')
+    if value is not None:
+        if not value.isdigit() or int(value) < 1:
+            raise ValidationError({'batch_size': 'A positive integer is required.'})
+        batch_size = int(value)
+    return min(batch_size, max_batch_size)
+
+
+def iter_batches(rows, batch_size):
+    """Yield lists of up to batch_size (row number, row) pairs"""
+    rows = enumerate(rows, start=1)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def existing_emails(emails):
+    """Return which of the emails already have a profile, in one query"""
+    return set(models.UserProfile.objects.filter(email__in=emails).values_list('email', flat=True))
+
+
+def insert_profiles(profiles):
+    """bulk_create the profiles, returns the list of those inserted
+
+    If a concurrent request created one of the emails since they were
+    checked, the batch fails on the unique index: the rows are then
+    inserted one by one (a savepoint each) to keep all the others.
+    """
+    try:
+        with transaction.atomic():
+            models.UserProfile.objects.bulk_create(profiles)
+        return profiles
+    except IntegrityError:
+        pass
+    inserted = []
+    for profile in profiles:
+        try:
+            with transaction.atomic():
+                models.UserProfile.objects.bulk_create([profile])
+        except IntegrityError:
+            continue
+        inserted.append(profile)
+    return inserted
+
+
+def create_profiles(batch, seen_emails):
+    """Validate, hash & insert a batch of profiles, returns per-row results
+
+    seen_emails holds the emails created by earlier batches of the same
+    request so duplicates inside one upload are reported too.
+    """
+    results = {}
+    candidates = []
+
+    # Validate every row in one pass
+    for row_number, row in batch:
+        if isinstance(row, ParseError):
+            results[row_number] = {'row': row_number, 'errors': {'non_field_errors': [row.detail]}}
+            continue
+        serializer = serializers.UserProfileBulkSerializer(data=row)
+        if not serializer.is_valid():
+            results[row_number] = {'row': row_number, 'errors': serializer.errors}
+            continue
+        data = serializer.validated_data
+        email = models.UserProfile.objects.normalize_email(data['email'])
+        candidates.append((row_number, email, data))
+
+    # One query for the whole batch instead of a UniqueValidator per row
+    existing = existing_emails([email for _, email, _ in candidates])
+    to_create = []
+    for row_number, email, data in candidates:
+        if email in existing or email in seen_emails:
+            results[row_number] = {'row': row_number, 'errors': DUPLICATE_EMAIL_ERRORS}
+            continue
+        seen_emails.add(email)
+        to_create.append((row_number, email, data))
+
+    if to_create:
+        # Hash every password of the batch in parallel in the hashing pool
+        passwords = hashing.make_passwords([data['password'] for _, _, data in to_create])
+        profiles = [
+            models.UserProfile(email=email, name=data['name'], password=password)
+            for (_, email, data), password in zip(to_create, passwords)
+        ]
+        inserted = {profile.email for profile in insert_profiles(profiles)}
+        # bulk_create sends no post_save, invalidate cached list pages (on
+        # commit) & count the rows here
+        caching.profile_responses.bump_on_commit('list')
+        counters.add(models.UserProfile, len(inserted))
+        # bulk_create doesn't return ids on every backend, read them back in one query
+        ids = dict(
+            models.UserProfile.objects
+            .filter(email__in=inserted)
+            .values_list('email', 'id')
+        )
+        for row_number, email, data in to_create:
+            if email not in inserted:
+                # Created by a concurrent request since the check
+                results[row_number] = {'row': row_number, 'errors': DUPLICATE_EMAIL_ERRORS}
+                continue
+            results[row_number] = {
+                'row': row_number,
+                'id': ids[email],
+                'email': email,
+                'name': data['name'],
+            }
+
+    return [results[row_number] for row_number, _ in batch]
+
+
+def create_feed_items(batch, user_profile):
+    """Validate & insert a batch of feed items, returns (created, errors)
+
+    created_on is still set by the field's auto_now_add when bulk_create
+    saves each object, exactly as with a single save().
+    """
+    errors = []
+    items = []
+    for row_number, row in batch:
+        if isinstance(row, ParseError):
+            errors.append({'line': row_number, 'errors': {'non_field_errors': [row.detail]}})
+            continue
+        serializer = serializers.ProfileFeedItemSerializer(data=row)
+        if not serializer.is_valid():
+            errors.append({'line': row_number, 'errors': serializer.errors})
+            continue
+        items.append(models.ProfileFeedItem(user_profile=user_profile, **serializer.validated_data))
+    if items:
+        models.ProfileFeedItem.objects.bulk_create(items)
+        # No post_save from bulk_create
+        counters.add(models.ProfileFeedItem, len(items))
+        changes.notifier.notify_on_commit()
+    return len(items), errors
@@ -0,0 +1,299 @@
+# In-process caching helpers shared by the API (app_name/caching.py)
+
+import hashlib
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from profile_api import shm
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU map where every entry has a time-to-live
+
+    Bounded by entry count and, when max_bytes is set, by the total of the
+    sizes passed to set().
+    """
+
+    def __init__(self, max_entries=1000, ttl=300, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing/expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires, size = entry
+                if expires > time.monotonic():
+                    # Mark as most recently used
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.bytes -= size
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None, size=0):
+        """Store value under key, evicting the least recently used entries"""
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            self._data[key] = (value, expires, size)
+            self.bytes += size
+            while len(self._data) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            ):
+                self.bytes -= self._data.popitem(last=False)[1][2]
+
+    def delete(self, key):
+        """Remove key from the cache if present"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[2]
+
+    def clear(self):
+        """Remove every entry (counters are kept)"""
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+class SharedGenerations:
+    """Generation numbers of cache scopes, shared by every worker (profile_api/shm.py)
+
+    Cached entries remember the generation of their scope when they were
+    loaded and are only used while it hasn't moved, so a bump in one worker
+    invalidates the entries of all of them. Scopes are hashed into `rows`
+    counters: scopes sharing one are invalidated together, which costs a
+    miss, never a stale hit.
+    """
+
+    def __init__(self, path, rows=4096):
+        self.rows = rows
+        # Half full at most, probes stay short & the table never fills up
+        self.table = shm.SharedTable(path, slots=rows * 2, width=1)
+
+    def _key(self, scope):
+        return 'gen:%d' % (zlib.crc32(str(scope).encode('utf-8')) % self.rows)
+
+    def get(self, scope):
+        """Return the current generation of a scope"""
+        row = self.table.get(self._key(scope))
+        return int(row[0]) if row else 0
+
+    def bump(self, *scopes):
+        """Move the generation of every scope (each counter once)"""
+        keys = {self._key(scope) for scope in scopes}
+        if not keys:
+            return
+        with self.table.locked():
+            for key in keys:
+                self.table.add_locked(key, (1,))
+
+
+# Defaults, override with PROFILE_API_RESPONSE_CACHE in settings.py
+RESPONSE_CACHE_DEFAULTS = {
+    'ENABLED': True,
+    # CACHES alias of the shared tier (rendered responses & locks)
+    'CACHE': 'default',
+    # Shared file of the scope generations & its number of rows, every
+    # worker sees a bump even when CACHE is a per-process LocMemCache
+    'GENERATIONS_PATH': os.path.join(
+        getattr(settings, 'PROFILE_API_SHM_DIRECTORY', '/tmp/profile_api'), 'response_generations',
+    ),
+    'GENERATION_ROWS': 4096,
+    # Seconds a rendered response is kept
+    'TTL': 60,
+    # Bounds of the in-process tier in front of the shared cache
+    'LOCAL_MAX_ENTRIES': 1000,
+    'LOCAL_MAX_BYTES': 16 * 1024 * 1024,
+    # Seconds other requests wait for the one rendering a missing response
+    'LOCK_TIMEOUT': 5,
+}
+
+
+class ResponseCache:
+    """Rendered response store with generation-versioned keys & single-flight misses
+
+    Keys embed the current generation of a scope (e.g. 'list' or 'obj:42'),
+    kept in SharedGenerations; bumping it invalidates every response of that
+    scope at once, in every worker.
+    A miss is rendered by one request at a time: other threads of the worker
+    wait for it, other workers wait on a lock key in the shared cache.
+    """
+
+    def __init__(self, namespace, config):
+        self.namespace = namespace
+        self.cache_alias = config['CACHE']
+        self.ttl = config['TTL']
+        self.lock_timeout = config['LOCK_TIMEOUT']
+        self.generations = SharedGenerations(config['GENERATIONS_PATH'], config['GENERATION_ROWS'])
+        self.local = LRUCache(
+            max_entries=config['LOCAL_MAX_ENTRIES'],
+            ttl=config['TTL'],
+            max_bytes=config['LOCAL_MAX_BYTES'],
+        )
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    @property
+    def enabled(self):
+        """Read from settings on every call so tests can switch the cache off"""
+        return _response_cache_config()['ENABLED']
+
+    @property
+    def shared(self):
+        """Return the shared cache backend"""
+        return caches[self.cache_alias]
+
+    def generation(self, scope):
+        """Return the current generation of a scope"""
+        return self.generations.get('%s:%s' % (self.namespace, scope))
+
+    def bump(self, *scopes):
+        """Invalidate every response cached under these scopes, in every worker"""
+        self.generations.bump(*['%s:%s' % (self.namespace, scope) for scope in scopes])
+
+    def bump_on_commit(self, *scopes, using=None):
+        """bump() once the current transaction commits (at once outside one)
+
+        Bumped earlier, another worker could render the still committed old
+        row & cache it under the new generation for the whole TTL.
+        """
+        transaction.on_commit(lambda: self.bump(*scopes), using=using)
+
+    def make_key(self, scope, *parts):
+        """Return the cache key of a response in a scope"""
+        digest = hashlib.md5('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+        return 'profile_api:%s:%s:%s:%s' % (self.namespace, scope, self.generation(scope), digest)
+
+    def get_or_render(self, key, render):
+        """Return the cached entry for key, calling render() (once) on a miss
+
+        render() returns the entry to cache and whether it is cacheable, as
+        (entry, cacheable).
+        """
+        entry = self._get(key)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            event = self._in_flight.get(key)
+            leader = event is None
+            if leader:
+                event = self._in_flight[key] = threading.Event()
+        if not leader:
+            # Another thread of this worker is rendering it
+            event.wait(self.lock_timeout)
+            entry = self.local.get(key)
+            if entry is not None:
+                with self._lock:
+                    self.coalesced += 1
+                return entry
+            return render()[0]
+
+        try:
+            return self._render_once(key, render)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            event.set()
+
+    def _get(self, key):
+        """Look a key up in the local, then the shared tier"""
+        entry = self.local.get(key)
+        if entry is not None:
+            return entry
+        entry = self.shared.get(key)
+        if entry is not None:
+            self.local.set(key, entry, size=len(entry[0]))
+            with self._lock:
+                self.shared_hits += 1
+        return entry
+
+    def _render_once(self, key, render):
+        """Render a missing entry unless another worker already is"""
+        lock_key = key + ':lock'
+        if not self.shared.add(lock_key, 1, self.lock_timeout):
+            # Another worker renders it, wait for its result (up to LOCK_TIMEOUT)
+            deadline = time.monotonic() + self.lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.02)
+                entry = self.shared.get(key)
+                if entry is not None:
+                    self.local.set(key, entry, size=len(entry[0]))
+                    with self._lock:
+                        self.coalesced += 1
+                    return entry
+            lock_key = None
+        with self._lock:
+            self.misses += 1
+        try:
+            entry, cacheable = render()
+            if cacheable:
+                self.local.set(key, entry, size=len(entry[0]))
+                self.shared.set(key, entry, self.ttl)
+            return entry
+        finally:
+            if lock_key:
+                self.shared.delete(lock_key)
+
+    def stats(self):
+        """Return hit/miss counters & the hit ratio"""
+        hits = self.local.hits + self.shared_hits + self.coalesced
+        lookups = hits + self.misses
+        return {
+            'local_hits': self.local.hits,
+            'shared_hits': self.shared_hits,
+            'coalesced': self.coalesced,
+            'misses': self.misses,
+            'hit_ratio': hits / lookups if lookups else 0.0,
+            'local': self.local.stats(),
+        }
+
+
+def _response_cache_config():
+    """Return the response cache settings merged over the defaults"""
+    config = dict(RESPONSE_CACHE_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_RESPONSE_CACHE', {}))
+    return config
+
+
+# Public profile reads (UserProfileViewSet list & retrieve)
+profile_responses = ResponseCache('profiles', _response_cache_config())
@@ -0,0 +1,192 @@
+# Delta sync of the feed (app_name/changes.py)
+# GET /api/feed/changes/?sync_token= returns the feed items created & the ids
+# deleted since the token, instead of clients re-fetching the whole feed.
+# Deletions are FeedItemTombstone rows, written in one INSERT by the code
+# deleting items (delete_items(), record_deletions()) so deletes & cascades
+# keep Django's single DELETE path.
+# Long polls (?wait=) sleep on a sequence number in a SharedTable
+# (profile_api/shm.py) that every commit touching the feed bumps, plus a
+# Condition waking the waiters of the committing worker right away, so
+# waiting runs no database queries.
+
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from profile_api import counters
+from profile_api import db
+from profile_api import models
+from profile_api import shm
+
+# Defaults, override with PROFILE_API_FEED_CHANGES in settings.py
+CHANGES_DEFAULTS = {
+    # Shared file holding the feed's change sequence number
+    'PATH': os.path.join(getattr(settings, 'PROFILE_API_SHM_DIRECTORY', '/tmp/profile_api'), 'changes'),
+    # Longest ?wait= (seconds) of a long poll
+    'MAX_WAIT': 30,
+    # Seconds between checks of the shared sequence for other workers' commits
+    'POLL_INTERVAL': 0.25,
+    # Most items & deletions per response, `more` tells there are others
+    'PAGE_SIZE': 200,
+    # Tombstones are pruned (archive_feed) after this many days, older
+    # sync tokens get a 410 and the client reloads the feed
+    'TOMBSTONE_DAYS': 30,
+}
+
+SEQUENCE_KEY = 'feed'
+
+
+def get_config():
+    """Return the changes settings merged over the defaults"""
+    config = dict(CHANGES_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_FEED_CHANGES', {}))
+    return config
+
+
+class SyncToken(namedtuple('SyncToken', 'item_id tombstone_id issued')):
+    """Last item & tombstone ids a client has seen, and when the token was issued
+
+    Feed item & tombstone ids only grow (AUTOINCREMENT, SQLite commits one
+    writer at a time), so everything newer than the token has a larger id.
+    """
+
+    def __str__(self):
+        return '%d-%d-%d' % self
+
+    @classmethod
+    def parse(cls, value):
+        """Return the token of a ?sync_token= value, None if malformed"""
+        parts = value.split('-')
+        if len(parts) != 3 or not all(part.isdigit() for part in parts):
+            return None
+        return cls(*(int(part) for part in parts))
+
+    def is_expired(self):
+        """Return True if tombstones newer than the token may have been pruned"""
+        return self.issued < time.time() - get_config()['TOMBSTONE_DAYS'] * 86400
+
+
+def current_token():
+    """Return a token positioned after every existing item & tombstone"""
+    item_id = models.ProfileFeedItem.objects.aggregate(last=Max('id'))['last'] or 0
+    tombstone_id = models.FeedItemTombstone.objects.aggregate(last=Max('id'))['last'] or 0
+    return SyncToken(item_id, tombstone_id, int(time.time()))
+
+
+def get_changes(queryset, token, page_size, user_id=None):
+    """Return the items of queryset & the deletions newer than token
+
+    Returns (items, deleted item ids, next token, more).
+    """
+    items = list(queryset.filter(id__gt=token.item_id).order_by('id')[:page_size + 1])
+    tombstones = models.FeedItemTombstone.objects.filter(id__gt=token.tombstone_id)
+    if user_id is not None:
+        tombstones = tombstones.filter(user_id=user_id)
+    tombstones = list(tombstones.order_by('id').values_list('id', 'item_id')[:page_size + 1])
+    more = len(items) > page_size or len(tombstones) > page_size
+    items, tombstones = items[:page_size], tombstones[:page_size]
+    next_token = SyncToken(
+        items[-1].id if items else token.item_id,
+        tombstones[-1][0] if tombstones else token.tombstone_id,
+        int(time.time()),
+    )
+    return items, [item_id for _, item_id in tombstones], next_token, more
+
+
+def prune_tombstones(days=None):
+    """Delete the tombstones older than TOMBSTONE_DAYS, returns how many"""
+    days = get_config()['TOMBSTONE_DAYS'] if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    # Nothing cascades from tombstones, this is a single DELETE
+    return models.FeedItemTombstone.objects.filter(deleted_on__lt=cutoff).delete()[0]
+
+
+def record_deletions(rows, using):
+    """Write the tombstones of deleted feed items with one INSERT & count them
+
+    rows are (item id, author id) pairs, read before the items were deleted.
+    Call it in the deleting transaction.
+    """
+    if not rows:
+        return
+    models.FeedItemTombstone.objects.using(using).bulk_create(
+        [models.FeedItemTombstone(item_id=item_id, user_id=user_id) for item_id, user_id in rows]
+    )
+    counters.add(models.ProfileFeedItem, -len(rows))
+    notifier.notify_on_commit(using)
+
+
+def delete_items(queryset):
+    """Delete feed items with one DELETE & their tombstones with one INSERT
+
+    Use it instead of queryset.delete(): feed items have no post_delete
+    receiver, it would make Django load & signal them one by one.
+    Returns how many items were deleted.
+    """
+    using = queryset.db
+    with transaction.atomic(using=using):
+        rows = list(queryset.values_list('pk', 'user_profile_id'))
+        if rows:
+            # Nothing cascades from feed items, this is a single DELETE
+            models.ProfileFeedItem.objects.using(using).filter(pk__in=[pk for pk, _ in rows]).delete()
+            record_deletions(rows, using)
+    return len(rows)
+
+
+class ChangeNotifier:
+    """Feed change sequence number shared by the host's workers
+
+    notify() bumps it & wakes this worker's waiters at once, waiters of
+    other workers see the new number within POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, path, poll_interval):
+        self.table = shm.SharedTable(path, slots=16, width=1)
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+
+    def sequence(self):
+        """Return the current sequence number"""
+        row = self.table.get(SEQUENCE_KEY)
+        return row[0] if row else 0
+
+    def notify(self):
+        """Record a change to the feed"""
+        self.table.add(SEQUENCE_KEY, 1)
+        with self.condition:
+            self.condition.notify_all()
+
+    def notify_on_commit(self, using=None):
+        """Record a change once the current transaction commits (once per transaction)"""
+        using = using or router.db_for_write(models.ProfileFeedItem)
+        if db.on_commit_batch('feed_changes', using, lambda batch: self.notify()) is None:
+            self.notify()
+
+    def wait(self, sequence, timeout):
+        """Block until the sequence moves past `sequence` or timeout, returns the current one"""
+        deadline = time.monotonic() + timeout
+        current = self.sequence()
+        while current == sequence:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self.condition:
+                self.condition.wait(min(remaining, self.poll_interval))
+            current = self.sequence()
+        return current
+
+
+def _build_notifier():
+    """Create the process wide notifier from settings"""
+    config = get_config()
+    return ChangeNotifier(config['PATH'], config['POLL_INTERVAL'])
+
+
+notifier = _build_notifier()
@@ -0,0 +1,142 @@
+# Response compression negotiated by Accept-Encoding (app_name/compression.py)
+# gzip or deflate, whichever the client prefers (q-values), for regular &
+# streaming responses. Streams (e.g. the NDJSON exports) are compressed
+# incrementally and flushed every FLUSH_BYTES of input, so clients receive
+# rows as they are produced instead of once zlib's buffer fills up.
+
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.cache import patch_vary_headers
+
+# Defaults, override with PROFILE_API_COMPRESSION in settings.py
+COMPRESSION_DEFAULTS = {
+    'ENABLED': True,
+    # zlib level, 1 (fastest) to 9 (smallest)
+    'LEVEL': 6,
+    # Smaller (non streaming) responses are sent as they are
+    'MIN_LENGTH': 200,
+    # Input bytes after which a stream is flushed to the client
+    'FLUSH_BYTES': 16 * 1024,
+    # Content types compressed. No HTML: the browsable API pages carry the
+    # CSRF token, compressing them next to reflected input allows BREACH
+    'CONTENT_TYPES': (
+        'application/json',
+        'application/vnd.profiles.columnar+json',
+        'application/x-ndjson',
+        'text/plain',
+    ),
+}
+
+# Preferred first when the client accepts both equally
+ENCODINGS = ('gzip', 'deflate')
+
+# zlib window bits of each encoding: gzip framing, zlib framing (HTTP "deflate")
+WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def _compression_config():
+    """Return the compression settings merged over the defaults"""
+    config = dict(COMPRESSION_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_COMPRESSION', {}))
+    return config
+
+
+def choose_encoding(accept_encoding):
+    """Return the encoding to use for an Accept-Encoding header, None for identity"""
+    qualities = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            qualities[name] = quality
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressor(encoding, level=6):
+    """Return a zlib compressor producing an encoding's framing"""
+    return zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+
+
+def compress(content, encoding, level=6):
+    """Compress a whole body"""
+    engine = compressor(encoding, level)
+    return engine.compress(content) + engine.flush()
+
+
+def compress_stream(chunks, encoding, level=6, flush_bytes=16 * 1024):
+    """Compress an iterable of byte chunks, yielding output as it's flushed"""
+    engine = compressor(encoding, level)
+    pending = 0
+    for chunk in chunks:
+        output = engine.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_bytes:
+            output += engine.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if output:
+            yield output
+    yield engine.flush()
+
+
+class CompressionMiddleware:
+    """Compresses responses with gzip or deflate as negotiated by Accept-Encoding
+
+    Replaces django.middleware.gzip.GZipMiddleware: honours q-values, also
+    speaks deflate and flushes streams as they go. Strong ETags are made
+    weak, the compressed body isn't byte identical to the representation.
+    """
+
+    def __init__(self, get_response):
+        config = _compression_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.level = config['LEVEL']
+        self.min_length = config['MIN_LENGTH']
+        self.flush_bytes = config['FLUSH_BYTES']
+        self.content_types = tuple(config['CONTENT_TYPES'])
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        content_type = response.get('Content-Type', '').partition(';')[0].strip()
+        if content_type not in self.content_types or response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < self.min_length:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(
+                response.streaming_content, encoding, self.level, self.flush_bytes,
+            )
+            # Unknown until the stream ends
+            del response['Content-Length']
+        else:
+            content = compress(response.content, encoding, self.level)
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
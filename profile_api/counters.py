@@ -0,0 +1,69 @@
+# Maintained row counts (app_name/counters.py)
+# COUNT(*) reads the whole table, so listings read the row count of a model
+# from its RowCount row instead. Signal receivers (profile_api/signals.py) &
+# the code deleting or bulk inserting rows adjust it; changes made inside a
+# transaction are summed and written once, when it commits. Feed items have
+# no post_delete receiver: it would stop their deletes (& the cascade from a
+# profile) from being a single DELETE.
+
+from django.db import router, transaction
+from django.db.models import F
+
+from profile_api import db
+from profile_api import models
+
+# Models whose rows are counted
+COUNTED_MODELS = (models.UserProfile, models.ProfileFeedItem)
+
+
+def get(model, using=None):
+    """Return the maintained row count of a model, None if it isn't counted"""
+    using = using or router.db_for_read(models.RowCount)
+    return (
+        models.RowCount.objects.using(using)
+        .filter(name=model._meta.label_lower)
+        .values_list('rows', flat=True)
+        .first()
+    )
+
+
+def _apply(using, deltas):
+    """Write summed row count changes, one UPDATE per model"""
+    for name, delta in deltas.items():
+        if delta:
+            models.RowCount.objects.using(using).filter(name=name).update(rows=F('rows') + delta)
+    deltas.clear()
+
+
+def add(model, delta):
+    """Adjust a model's row count by delta once the current transaction commits
+
+    Outside a transaction the counter is updated right away. Inside one, the
+    deltas are summed and applied by a single on_commit callback, nothing is
+    written on rollback.
+    """
+    using = router.db_for_write(model)
+    name = model._meta.label_lower
+    deltas = db.on_commit_batch('row_counts', using, lambda deltas: _apply(using, deltas))
+    if deltas is None:
+        _apply(using, {name: delta})
+    else:
+        deltas[name] = deltas.get(name, 0) + delta
+
+
+def reconcile(using=None):
+    """Reset every counter to an exact count, returns {name: (counted, actual)}"""
+    using = using or router.db_for_write(models.RowCount)
+    drift = {}
+    for model in COUNTED_MODELS:
+        name = model._meta.label_lower
+        with transaction.atomic(using=using):
+            actual = model.objects.using(using).count()
+            counter, created = models.RowCount.objects.using(using).select_for_update().get_or_create(
+                name=name, defaults={'rows': actual},
+            )
+            drift[name] = (None if created else counter.rows, actual)
+            if counter.rows != actual:
+                counter.rows = actual
+                counter.save(update_fields=['rows'])
+    return drift
@@ -0,0 +1,208 @@
+# Database routing & connection setup (app_name/db.py)
+# Safe-method API requests read from a read alias, everything else uses the
+# primary ('default'). On SQLite the read alias is a second connection to
+# the same file: in WAL mode readers don't block the writer (or each other).
+# Recent writers are remembered in a SharedTable (profile_api/shm.py), so a
+# client keeps reading its writes whichever worker serves the next request.
+
+import functools
+import os
+import threading
+import time
+import weakref
+import zlib
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from rest_framework import permissions
+
+from profile_api import shm
+
+# Defaults, override with PROFILE_API_DB_ROUTING in settings.py
+DB_ROUTING_DEFAULTS = {
+    # DATABASES alias reads are sent to (ignored if not configured)
+    'READ_ALIAS': 'replica',
+    # Seconds a client keeps reading from the primary after a write
+    'STICKY_SECONDS': 5,
+    # Shared file remembering recent writers & how many clients it tells
+    # apart (clients sharing a bucket read from the primary together)
+    'STICKY_PATH': os.path.join(getattr(settings, 'PROFILE_API_SHM_DIRECTORY', '/tmp/profile_api'), 'db_pins'),
+    'STICKY_BUCKETS': 4096,
+}
+
+# PRAGMAs run on every new SQLite connection, override with PROFILE_API_SQLITE_PRAGMAS
+SQLITE_PRAGMAS_DEFAULTS = {
+    # Readers & the writer don't block each other
+    'journal_mode': 'WAL',
+    # Safe with WAL, fsync at checkpoints instead of every commit
+    'synchronous': 'NORMAL',
+    # Milliseconds to wait for the write lock instead of failing with
+    # "database is locked". Only taken at BEGIN IMMEDIATE (begin_immediate)
+    # or by a single statement: a deferred transaction that read first and
+    # finds the file changed on its first write fails at once (no waiting)
+    'busy_timeout': 5000,
+}
+
+_state = threading.local()
+
+# Per-thread {(name, alias): weak reference to a pending on_commit callback}
+_batches = threading.local()
+
+
+def get_routing_config():
+    """Return the routing settings merged over the defaults"""
+    config = dict(DB_ROUTING_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_DB_ROUTING', {}))
+    return config
+
+
+class ReadWriteRouter:
+    """Routes reads of safe-method requests to the read alias, writes to the primary"""
+
+    def db_for_read(self, model, **hints):
+        """Use the read alias only inside a replica-eligible request"""
+        if not getattr(_state, 'use_replica', False):
+            return None
+        alias = get_routing_config()['READ_ALIAS']
+        if alias not in settings.DATABASES:
+            return None
+        # Reads inside a write transaction must see its uncommitted rows
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        """Always write to the primary, even objects read from the read alias"""
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Both aliases hold the same data"""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Only migrate the primary"""
+        return db != get_routing_config()['READ_ALIAS']
+
+
+def _client_identity(request):
+    """Identify the client for read-your-writes stickiness"""
+    return (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        or request.META.get('HTTP_X_REAL_IP')
+        or request.META.get('REMOTE_ADDR', '')
+    )
+
+
+class RecentWriters:
+    """Until when each client reads from the primary, shared by the host's workers
+
+    Clients are hashed into `buckets` rows holding the time their pin ends,
+    so the table never fills up.
+    """
+
+    def __init__(self, path, buckets):
+        self.table = shm.SharedTable(path, slots=buckets * 2, width=1)
+        self.buckets = buckets
+
+    def key(self, identity):
+        """Return the row of a client"""
+        return 'pin:%d' % (zlib.crc32(identity.encode('utf-8')) % self.buckets)
+
+    def pin(self, identity, seconds):
+        """Send the client's reads to the primary for the next `seconds`"""
+        key = self.key(identity)
+        until = time.time() + seconds
+        with self.table.locked():
+            row = self.table.get_locked(key)
+            if row is None or row[0] < until:
+                self.table.set_locked(key, (until,))
+
+    def is_pinned(self, identity):
+        """Return True if the client wrote within its sticky period"""
+        row = self.table.get(self.key(identity))
+        return row is not None and row[0] > time.time()
+
+
+def _build_recent_writers():
+    """Create the process wide recent writers table from settings"""
+    config = get_routing_config()
+    return RecentWriters(config['STICKY_PATH'], config['STICKY_BUCKETS'])
+
+
+recent_writers = _build_recent_writers()
+
+
+class ReadWriteRoutingMiddleware:
+    """Lets ReadWriteRouter send a request's reads to the read alias
+
+    Only safe-method requests are eligible, and not within STICKY_SECONDS of
+    the same client's last successful write, so clients read their writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        identity = _client_identity(request)
+        safe = request.method in permissions.SAFE_METHODS
+        _state.use_replica = safe and not recent_writers.is_pinned(identity)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.use_replica = False
+        if not safe and response.status_code < 400:
+            recent_writers.pin(identity, get_routing_config()['STICKY_SECONDS'])
+        return response
+
+
+def on_commit_batch(name, using, flush):
+    """Return the dict gathering `name` changes of the current transaction
+
+    The first call within a transaction registers flush(batch) with
+    transaction.on_commit(), later calls return the same dict, so a
+    transaction's changes are written once. Only a weak reference to the
+    callback is kept: a rollback discards it, and the batch with it.
+    Outside a transaction returns None, the caller applies the change itself.
+    """
+    if not connections[using].in_atomic_block:
+        return None
+    pending = _batches.__dict__.setdefault('pending', {})
+    key = (name, using)
+    callback = pending[key]() if key in pending else None
+    if callback is None:
+        batch = {}
+
+        def callback():
+            pending.pop(key, None)
+            flush(batch)
+
+        callback.batch = batch
+        pending[key] = weakref.ref(callback)
+        transaction.on_commit(callback, using=using)
+    return callback.batch
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver applying the SQLite PRAGMAs"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(SQLITE_PRAGMAS_DEFAULTS)
+    pragmas.update(getattr(settings, 'PROFILE_API_SQLITE_PRAGMAS', {}))
+    # On the DB-API connection, past the execute wrappers: setting up a
+    # connection isn't one of the queries a request (QueryRecorder) runs
+    for name, value in pragmas.items():
+        connection.connection.execute('PRAGMA %s = %s' % (name, value))
+    if connection.alias != get_routing_config()['READ_ALIAS']:
+        # Transactions (atomic) on the primary start with BEGIN IMMEDIATE
+        connection._start_transaction_under_autocommit = functools.partial(begin_immediate, connection)
+
+
+def begin_immediate(connection):
+    """Start a transaction holding the write lock, waiting busy_timeout for it
+
+    Django's BEGIN is deferred: the first write of a transaction that read
+    (the delete collector's SELECTs, pre_delete receivers) fails with
+    "database is locked" if another connection committed in between.
+    """
+    connection.cursor().execute('BEGIN IMMEDIATE')
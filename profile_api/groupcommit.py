@@ -0,0 +1,164 @@
+# Group commit of concurrent model saves (app_name/groupcommit.py)
+# SQLite has a single writer and every transaction ends with an fsync, so
+# concurrent POSTs each committing on their own queue up on the write lock
+# ("database is locked"). In group-commit mode the saves of a worker's
+# request threads are queued and written by one of them in one transaction.
+
+import threading
+
+from django.conf import settings
+from django.db import router, transaction
+
+# Defaults, override with PROFILE_API_GROUP_COMMIT in settings.py
+GROUP_COMMIT_DEFAULTS = {
+    # Off: every save commits on its own like serializer.save()
+    'ENABLED': False,
+    # Milliseconds the first save of a group waits for others to join
+    'WINDOW_MS': 5,
+    # Saves flushed at most per transaction (a full group is flushed at once)
+    'MAX_ITEMS': 100,
+}
+
+
+class _PendingSave:
+    """One queued save, `done` is set once it is written (or failed)"""
+
+    __slots__ = ('instance', 'error', 'done', 'lead')
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.error = None
+        self.done = threading.Event()
+        # Set instead of the result when this request must flush the next group
+        self.lead = False
+
+
+class GroupCommitter:
+    """Coalesces the saves of concurrent request threads into one transaction
+
+    The first thread to queue a save becomes the leader: it waits up to
+    window seconds (or until max_items saves are queued) and saves the whole
+    group in one transaction, each save in its own savepoint so a failing
+    row doesn't take the others with it. Threads that queued while a group
+    was being written wait for the leader to hand leadership to them.
+    Every caller gets its own instance back with its id & defaults set.
+    """
+
+    def __init__(self, window, max_items):
+        self.window = window
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._pending = []
+        self._flushing = False
+        self._full = threading.Event()
+        self.flushes = 0
+        self.saved = 0
+        self.failed = 0
+        self.max_group = 0
+
+    @property
+    def enabled(self):
+        """Read from settings on every call so tests can switch the mode on"""
+        return _group_commit_config()['ENABLED']
+
+    def save(self, instance):
+        """Save instance as part of the next group, raises what save() raised"""
+        entry = _PendingSave(instance)
+        with self._lock:
+            self._pending.append(entry)
+            leader = not self._flushing
+            if leader:
+                self._flushing = True
+            if len(self._pending) >= self.max_items:
+                self._full.set()
+        if leader:
+            # Give concurrent requests a chance to join this group
+            self._full.wait(self.window)
+            self._lead()
+        else:
+            entry.done.wait()
+            if entry.lead:
+                # The previous group is written, this one has been waiting already
+                self._lead()
+        if entry.error is not None:
+            raise entry.error
+        return instance
+
+    def _lead(self):
+        """Write queued groups until the queue is empty or leadership is handed over
+
+        The leader's own save is always in the first group it writes.
+        """
+        with self._lock:
+            group = self._pending[:self.max_items]
+            del self._pending[:self.max_items]
+            self._full.clear()
+        try:
+            self._write(group)
+        finally:
+            with self._lock:
+                if self._pending:
+                    # Hand over to the oldest waiting request
+                    successor = self._pending[0]
+                    successor.lead = True
+                    successor.done.set()
+                else:
+                    self._flushing = False
+            for entry in group:
+                entry.done.set()
+
+    def _write(self, group):
+        """Save a group in one transaction, one savepoint per instance"""
+        using = router.db_for_write(type(group[0].instance))
+        failed = 0
+        try:
+            with transaction.atomic(using=using):
+                for entry in group:
+                    try:
+                        with transaction.atomic(using=using):
+                            entry.instance.save(using=using)
+                    except Exception as error:
+                        entry.error = error
+                        failed += 1
+        except Exception as error:
+            # The commit itself failed, nothing of the group was written
+            for entry in group:
+                entry.error = entry.error or error
+            failed = len(group)
+        with self._lock:
+            self.flushes += 1
+            self.saved += len(group) - failed
+            self.failed += failed
+            self.max_group = max(self.max_group, len(group))
+
+    def stats(self):
+        """Return group sizes & outcome counters"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'window': self.window,
+                'max_items': self.max_items,
+                'queued': len(self._pending),
+                'flushes': self.flushes,
+                'saved': self.saved,
+                'failed': self.failed,
+                'max_group': self.max_group,
+                'mean_group': (self.saved + self.failed) / self.flushes if self.flushes else 0.0,
+            }
+
+
+def _group_commit_config():
+    """Return the group commit settings merged over the defaults"""
+    config = dict(GROUP_COMMIT_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_GROUP_COMMIT', {}))
+    return config
+
+
+def _build_committer():
+    """Create the process wide committer from settings"""
+    config = _group_commit_config()
+    return GroupCommitter(window=config['WINDOW_MS'] / 1000.0, max_items=config['MAX_ITEMS'])
+
+
+# Feed item creates (UserProfileFeedViewSet.perform_create)
+feed_commits = _build_committer()
@@ -0,0 +1,313 @@
+# Password hashing offloaded to a bounded process pool (app_name/hashing.py)
+# PBKDF2 is CPU bound, running it in the request thread blocks the worker for
+# every login/signup, so hashing & verification run in a separate pool that is
+# sized independently of the request workers and sheds load when saturated.
+# Only API views shed load (a 503), elsewhere (admin login, createsuperuser)
+# a saturated pool hashes in the calling thread.
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Defaults, override with PROFILE_API_HASHING_POOL in settings.py
+HASHING_POOL_DEFAULTS = {
+    # Number of hashing processes per worker (0 = hash inline in the request thread)
+    'WORKERS': 2,
+    # Max number of hashes waiting for a free process before shedding load
+    'MAX_QUEUE': 16,
+    # Seconds a request waits for a queue slot before it gets a 503
+    'ACQUIRE_TIMEOUT': 0.1,
+    # Seconds a request waits for its job to finish before it gets a 503
+    # (other callers then run the job inline)
+    'RESULT_TIMEOUT': 10,
+    # Value of the Retry-After header sent with the 503
+    'RETRY_AFTER': 1,
+}
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# The pool is started from a request thread of a (possibly threaded) worker:
+# forking there copies locks other threads hold, so processes start from a
+# clean interpreter instead
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+_state = threading.local()
+
+
+class HashingPoolSaturated(APIException):
+    """Raised when the hashing queue is full, rendered by DRF as a 503"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Server is busy, please retry shortly.'
+    default_code = 'hashing_pool_saturated'
+
+    def __init__(self, wait=None):
+        super().__init__()
+        # DRF sets the Retry-After header from `wait`
+        self.wait = wait
+
+
+@contextmanager
+def shedding_load():
+    """Within the block a saturated pool raises HashingPoolSaturated instead of hashing inline
+
+    Entered by the DRF views hashing passwords (mixins.HashingLoadSheddingMixin),
+    DRF renders the exception as a 503.
+    """
+    previous = getattr(_state, 'shed_load', False)
+    _state.shed_load = True
+    try:
+        yield
+    finally:
+        _state.shed_load = previous
+
+
+def _init_worker(settings_module):
+    """Make sure Django settings are available in the pool process"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+def _make_password(raw_password):
+    """Hash a password (runs in the pool)"""
+    return hashers.make_password(raw_password)
+
+
+def _verify_password(raw_password, encoded):
+    """Return (is_correct, must_update) for a password (runs in the pool)
+
+    Mirrors django.contrib.auth.hashers.check_password, the setter (a DB write)
+    is left to the caller.
+    """
+    if raw_password is None or not hashers.is_password_usable(encoded):
+        return False, False
+    preferred = hashers.get_hasher('default')
+    try:
+        hasher = hashers.identify_hasher(encoded)
+    except ValueError:
+        return False, False
+    hasher_changed = hasher.algorithm != preferred.algorithm
+    must_update = hasher_changed or preferred.must_update(encoded)
+    is_correct = hasher.verify(raw_password, encoded)
+    # Same timing hardening as Django when the iteration count changed
+    if not is_correct and not hasher_changed and must_update:
+        hasher.harden_runtime(raw_password, encoded)
+    return is_correct, must_update
+
+
+class HashingPool:
+    """Size-limited process pool with a bounded queue and latency metrics"""
+
+    def __init__(self, workers, max_queue, acquire_timeout, retry_after, result_timeout=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.acquire_timeout = acquire_timeout
+        self.result_timeout = result_timeout
+        self.retry_after = retry_after
+        # One slot per running or queued job
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + max_queue)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.inline = 0
+        self.restarts = 0
+        self.timeouts = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def _get_executor(self):
+        """Return the process pool, created lazily in each (forked) worker process"""
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context(START_METHOD),
+                        initializer=_init_worker,
+                        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'profiles_project.settings'),),
+                    )
+                    self._executor_pid = pid
+        return self._executor
+
+    def _reset_executor(self, executor):
+        """Drop a broken process pool (a process died), the next job starts a new one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        executor.shutdown(wait=False)
+
+    def _call(self, call):
+        """Return call(executor), retried once on a new pool if the pool broke"""
+        executor = self._get_executor()
+        try:
+            return call(executor)
+        except BrokenProcessPool:
+            # Hashing is idempotent, running the job again is safe
+            self._reset_executor(executor)
+            return call(self._get_executor())
+
+    def _result(self, future):
+        """Return the result of a submitted job, waiting at most result_timeout"""
+        try:
+            return future.result(timeout=self.result_timeout)
+        except FutureTimeout:
+            # Still queued behind other jobs: nobody waits for it anymore
+            future.cancel()
+            raise
+
+    def _timed_out(self):
+        """Count a job the pool didn't finish in time, raises HashingPoolSaturated within shedding_load()"""
+        with self._lock:
+            self.timeouts += 1
+        if getattr(_state, 'shed_load', False):
+            raise HashingPoolSaturated(wait=self.retry_after)
+
+    def _acquire(self):
+        """Reserve a queue slot, returns False if the caller must run the job inline
+
+        When the queue is full, callers within shedding_load() (API views)
+        get HashingPoolSaturated, a 503; others run the job themselves.
+        """
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            if getattr(_state, 'shed_load', False):
+                with self._lock:
+                    self.rejected += 1
+                raise HashingPoolSaturated(wait=self.retry_after)
+            with self._lock:
+                self.inline += 1
+            return False
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return True
+
+    def _release(self, started):
+        """Free a queue slot & record how long the job took (queueing included)"""
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self.latency_sum += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    break
+            else:
+                index = len(LATENCY_BUCKETS)
+            self.latency_buckets[index] += 1
+        self._slots.release()
+
+    def run(self, func, *args):
+        """Run func(*args) in the pool and wait for the result"""
+        if not self._acquire():
+            return func(*args)
+        started = time.monotonic()
+        try:
+            if not self.workers:
+                return func(*args)
+            try:
+                return self._call(lambda executor: self._result(executor.submit(func, *args)))
+            except FutureTimeout:
+                self._timed_out()
+                return func(*args)
+        finally:
+            self._release(started)
+
+    def map(self, func, *iterables):
+        """Run func over iterables in parallel, holding a single queue slot"""
+        if not self._acquire():
+            return list(map(func, *iterables))
+        started = time.monotonic()
+        try:
+            if not self.workers:
+                return list(map(func, *iterables))
+            iterables = [list(iterable) for iterable in iterables]
+            # Hand each process a few large chunks to keep IPC overhead low
+            chunksize = max(1, len(iterables[0]) // (self.workers * 4)) if iterables else 1
+            try:
+                return self._call(lambda executor: list(executor.map(
+                    func, *iterables, timeout=self.result_timeout, chunksize=chunksize,
+                )))
+            except FutureTimeout:
+                # executor.map cancels the chunks that didn't start
+                self._timed_out()
+                return list(map(func, *iterables))
+        finally:
+            self._release(started)
+
+    def stats(self):
+        """Return queue depth & latency metrics"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'inline': self.inline,
+                'restarts': self.restarts,
+                'timeouts': self.timeouts,
+                'latency_sum': self.latency_sum,
+                'latency_max': self.latency_max,
+                'latency_buckets': dict(zip(
+                    [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                    self.latency_buckets,
+                )),
+            }
+
+
+def _build_pool():
+    """Create the process wide hashing pool from settings"""
+    config = dict(HASHING_POOL_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_HASHING_POOL', {}))
+    return HashingPool(
+        workers=config['WORKERS'],
+        max_queue=config['MAX_QUEUE'],
+        acquire_timeout=config['ACQUIRE_TIMEOUT'],
+        retry_after=config['RETRY_AFTER'],
+        result_timeout=config['RESULT_TIMEOUT'],
+    )
+
+
+pool = _build_pool()
+
+
+def make_password(raw_password):
+    """Hash a password in the pool"""
+    if raw_password is None:
+        # Unusable password, nothing to hash
+        return hashers.make_password(None)
+    return pool.run(_make_password, raw_password)
+
+
+def make_passwords(raw_passwords):
+    """Hash a list of passwords in parallel"""
+    return pool.map(_make_password, raw_passwords)
+
+
+def check_password(raw_password, encoded, setter=None):
+    """Verify a password in the pool, calls setter if the hash must be upgraded"""
+    if raw_password is None or not hashers.is_password_usable(encoded):
+        return False
+    is_correct, must_update = pool.run(_verify_password, raw_password, encoded)
+    if setter and is_correct and must_update:
+        setter(raw_password)
+    return is_correct
@@ -0,0 +1,101 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from profile_api import archive
+from profile_api import changes
+
+
+def format_bytes(value):
+    """Return a byte count as a human readable string"""
+    if value is None:
+        return 'n/a'
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(value) < 1024:
+            return '%.1f %s' % (value, unit) if unit != 'B' else '%d B' % value
+        value /= 1024.0
+    return '%.1f GiB' % value
+
+
+class Command(BaseCommand):
+    """Move feed items older than the retention window to the archive table"""
+    help = (
+        'Move feed items older than PROFILE_API_FEED_RETENTION_DAYS from the hot feed '
+        'table to the archive, in short batches, and report the space reclaimed. '
+        'Also prunes the tombstones of deleted items older than the delta sync window.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help='Retention window in days (default: PROFILE_API_FEED_RETENTION_DAYS).',
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=getattr(settings, 'PROFILE_API_ARCHIVE_BATCH_SIZE', 1000),
+            help='Rows moved per transaction.',
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0.05,
+            help='Seconds to sleep between batches, lets other writers take the lock.',
+        )
+        parser.add_argument(
+            '--vacuum', action='store_true',
+            help='VACUUM afterwards to return the freed pages to the filesystem (SQLite).',
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+        else:
+            cutoff = archive.retention_cutoff()
+        if cutoff is None:
+            raise CommandError('PROFILE_API_FEED_RETENTION_DAYS is None, nothing is archived.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        connection = archive.get_connection()
+        hot_before = archive.table_bytes(connection, archive.HOT_TABLE)
+        archived = batches = 0
+        started = time.monotonic()
+        while True:
+            moved = archive.archive_batch(cutoff, options['batch_size'])
+            if not moved:
+                break
+            archived += moved
+            batches += 1
+            if options['verbosity'] > 1:
+                self.stdout.write('Batch %d: %d rows' % (batches, moved))
+            time.sleep(options['pause'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write('Archived %d feed items created before %s in %d batches (%.2fs).' % (
+            archived, cutoff.isoformat(), batches, elapsed,
+        ))
+        pruned = changes.prune_tombstones()
+        self.stdout.write('Pruned %d tombstones of deleted feed items.' % pruned)
+        hot_after = archive.table_bytes(connection, archive.HOT_TABLE)
+        if hot_before is not None and hot_after is not None:
+            self.stdout.write('Hot table & indexes: %s -> %s (%s reclaimed).' % (
+                format_bytes(hot_before), format_bytes(hot_after), format_bytes(hot_before - hot_after),
+            ))
+
+        sizes = archive.database_bytes(connection)
+        if sizes is None:
+            return
+        file_bytes, free_bytes = sizes
+        if options['vacuum']:
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            vacuumed_bytes, free_bytes = archive.database_bytes(connection)
+            self.stdout.write('VACUUM: database file %s -> %s (%s returned to the filesystem).' % (
+                format_bytes(file_bytes), format_bytes(vacuumed_bytes), format_bytes(file_bytes - vacuumed_bytes),
+            ))
+        else:
+            self.stdout.write('Database file %s, %s free for reuse (run with --vacuum to shrink it).' % (
+                format_bytes(file_bytes), format_bytes(free_bytes),
+            ))
+        self.stdout.write(self.style.SUCCESS('Done.'))
@@ -0,0 +1,125 @@
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import get_runner
+
+from profile_api import benchmark
+from profile_api import shm
+
+
+def _levels(value):
+    """Parse a comma separated list of concurrency levels"""
+    try:
+        levels = [int(level) for level in value.split(',') if level]
+    except ValueError:
+        levels = []
+    if not levels or min(levels) < 1:
+        raise CommandError('--concurrency expects positive integers, e.g. 1,4,8')
+    return levels
+
+
+class Command(BaseCommand):
+    """Benchmark every API route in-process against a synthetic dataset"""
+    help = (
+        'Load N users with M feed items each into a throwaway database, drive '
+        'every API route through the WSGI app and report latency percentiles, '
+        'requests/s and queries/request, compared against a baseline JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Synthetic users to create.')
+        parser.add_argument('--items', type=int, default=10, help='Feed items per user.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per route and concurrency level.')
+        parser.add_argument('--concurrency', type=_levels, default=[1, 4, 8],
+                            help='Comma separated concurrency levels (default 1,4,8).')
+        parser.add_argument('--route', action='append', dest='routes',
+                            help='Only run scenarios whose name contains this (repeatable).')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'),
+                            help='Baseline JSON to compare with.')
+        parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed slowdown as a fraction before flagging a regression (default 0.2).')
+        parser.add_argument('--output', help='Also write the results to this JSON file.')
+        parser.add_argument('--encodings', action='store_true',
+                            help='Instead compare bytes & encode time of the JSON and columnar '
+                                 'renderers, uncompressed, gzip & deflate, on the list routes.')
+
+    def handle(self, *args, **options):
+        # Throwaway on-disk SQLite database (in-memory ones can't be shared by threads)
+        directory = tempfile.mkdtemp(prefix='profiles-bench-')
+        # And throwaway shared tables, the running server's metrics & limits stay as they are
+        shm.relocate(settings.PROFILE_API_SHM_DIRECTORY, os.path.join(directory, 'shm'))
+        default = settings.DATABASES['default']
+        if default['ENGINE'] == 'django.db.backends.sqlite3':
+            default.setdefault('TEST', {})['NAME'] = os.path.join(directory, 'bench.sqlite3')
+        runner = get_runner(settings)(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            self.stdout.write('Loading %d users x %d feed items...' % (options['users'], options['items']))
+            dataset = benchmark.Dataset(options['users'], options['items']).load()
+            if options['encodings']:
+                self.report_encodings(benchmark.compare_encodings(dataset))
+                return
+            results = benchmark.run(
+                dataset,
+                requests=options['requests'],
+                concurrency=options['concurrency'],
+                routes=options['routes'],
+                progress=self.report,
+            )
+        finally:
+            connections.close_all()
+            runner.teardown_databases(old_config)
+
+        if options['output']:
+            self.write_json(options['output'], results)
+        self.check_baseline(results, options)
+
+    def report(self, key, result):
+        """Print one scenario's results"""
+        self.stdout.write(
+            '%-32s %8.1f req/s  p50 %7.1fms  p95 %7.1fms  p99 %7.1fms  %5.2f queries  %d errors' % (
+                key, result['rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                result['queries_per_request'], result['errors'],
+            )
+        )
+
+    def report_encodings(self, results):
+        """Print each encoding's size & time, relative to the route's plain JSON"""
+        for key, result in results.items():
+            path = key.split(' ', 1)[0]
+            plain = results['%s json+identity' % path]['bytes']
+            self.stdout.write('%-52s %9d bytes (%5.1f%%)  %7.2fms to encode' % (
+                key, result['bytes'], result['bytes'] * 100.0 / plain, result['encode_ms'],
+            ))
+
+    def write_json(self, path, results):
+        """Write results to a JSON file"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+
+    def check_baseline(self, results, options):
+        """Compare with (or store) the baseline, fails on regressions"""
+        path = options['baseline']
+        if options['save_baseline']:
+            self.write_json(path, results)
+            self.stdout.write(self.style.SUCCESS('Baseline saved to %s' % path))
+            return
+        if not os.path.exists(path):
+            self.stdout.write('No baseline at %s, run with --save-baseline to store one.' % path)
+            return
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = benchmark.compare(results, baseline, options['threshold'])
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(self.style.ERROR('REGRESSION ' + regression))
+            raise CommandError('%d regression(s) against %s' % (len(regressions), path))
+        self.stdout.write(self.style.SUCCESS('No regressions against %s' % path))
@@ -0,0 +1,79 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter: load the WSGI module & warm up as under uWSGI
+# (unless PROFILE_API_WARMUP=0), then GET every route twice
+CHILD_SCRIPT = '''
+import json, os, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+started = time.perf_counter()
+from profiles_project import wsgi
+from profile_api import warmup
+warmup.warm_up(wsgi.application, force=True)
+startup_ms = (time.perf_counter() - started) * 1000
+paths = warmup.route_paths()
+first = warmup.request_routes(wsgi.application, paths)
+second = warmup.request_routes(wsgi.application, paths)
+print(json.dumps({'startup_ms': startup_ms, 'first': first, 'second': second}))
+'''
+
+
+class Command(BaseCommand):
+    """Compare first-request latency of a cold & a pre-warmed WSGI application"""
+    help = (
+        'Start the WSGI application in fresh processes with the pre-fork warmup off '
+        '(cold) and on (warm), and report the startup time and the latency of the '
+        'first and second GET of every route (median of --runs).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='Processes started per mode.')
+        parser.add_argument('--routes', action='store_true', help='Also print every route.')
+
+    def run_child(self, warm):
+        """Start one process, returns its measurements"""
+        env = dict(os.environ, PROFILE_API_WARMUP='1' if warm else '0')
+        result = subprocess.run(
+            [sys.executable, '-c', CHILD_SCRIPT],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.decode('utf-8', 'replace'))
+        return json.loads(result.stdout.decode('utf-8').strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be at least 1.')
+        summary = {}
+        for mode in ('cold', 'warm'):
+            runs = [self.run_child(mode == 'warm') for _ in range(options['runs'])]
+            routes = sorted(runs[0]['first'])
+            summary[mode] = {
+                'startup_ms': statistics.median(run['startup_ms'] for run in runs),
+                'first': {route: statistics.median(run['first'][route][1] for run in runs) for route in routes},
+                'second': {route: statistics.median(run['second'][route][1] for run in runs) for route in routes},
+            }
+
+        cold, warm = summary['cold'], summary['warm']
+        self.stdout.write('%-24s %10s %10s' % ('', 'cold', 'warm'))
+        self.stdout.write('%-24s %8.1fms %8.1fms' % ('startup', cold['startup_ms'], warm['startup_ms']))
+        for request in ('first', 'second'):
+            self.stdout.write('%-24s %8.1fms %8.1fms' % (
+                '%s requests (total)' % request, sum(cold[request].values()), sum(warm[request].values()),
+            ))
+            self.stdout.write('%-24s %8.1fms %8.1fms' % (
+                '%s request (slowest)' % request, max(cold[request].values()), max(warm[request].values()),
+            ))
+        if options['routes']:
+            self.stdout.write('')
+            self.stdout.write('%-24s %10s %10s %10s' % ('first request', 'cold', 'warm', 'steady'))
+            for route in sorted(cold['first']):
+                self.stdout.write('%-24s %8.1fms %8.1fms %8.1fms' % (
+                    route, cold['first'][route], warm['first'][route], warm['second'][route],
+                ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from profile_api import search
+
+
+class Command(BaseCommand):
+    """Rebuild the FTS5 profile search index"""
+    help = 'Create (if needed) and rebuild the FTS5 index used by profile search.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help='Database alias to rebuild the index on.',
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if not search.install(connection):
+            raise CommandError(
+                'Full text search is not supported on this database, '
+                'profile search uses the default SearchFilter.'
+            )
+        search.rebuild(connection)
+        self.stdout.write(self.style.SUCCESS('Profile search index rebuilt.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from profile_api import counters
+
+
+class Command(BaseCommand):
+    """Reset the maintained row counters to exact counts"""
+    help = (
+        'Count the rows of every counted model (profiles, feed items) and correct '
+        'the counters listings read their totals from.'
+    )
+
+    def handle(self, *args, **options):
+        for name, (counted, actual) in counters.reconcile().items():
+            if counted is None:
+                self.stdout.write('%s: created at %d' % (name, actual))
+            elif counted != actual:
+                self.stdout.write(self.style.WARNING('%s: %d -> %d (drift %+d)' % (
+                    name, counted, actual, actual - counted,
+                )))
+            else:
+                self.stdout.write('%s: %d, up to date' % (name, actual))
+        self.stdout.write(self.style.SUCCESS('Row counters reconciled.'))
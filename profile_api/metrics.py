@@ -0,0 +1,183 @@
+# Prometheus metrics shared by every worker process (app_name/metrics.py)
+# MetricsMiddleware records each request in a SharedTable (profile_api/shm.py),
+# an mmap'd file all workers of the host write to, so /api/metrics reports
+# totals across workers whichever worker answers the scrape.
+
+import os
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from profile_api import shm
+from profile_api.middleware import get_url_name, is_warmup
+
+# Defaults, override with PROFILE_API_METRICS in settings.py
+METRICS_DEFAULTS = {
+    'ENABLED': True,
+    # Shared file & number of distinct series it can hold
+    'PATH': os.path.join(getattr(settings, 'PROFILE_API_SHM_DIRECTORY', '/tmp/profile_api'), 'metrics'),
+    'SLOTS': 4096,
+    # Upper bounds (seconds) of the request latency histogram buckets
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+}
+
+
+def _metrics_config():
+    """Return the metrics settings merged over the defaults"""
+    config = dict(METRICS_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_METRICS', {}))
+    return config
+
+
+class Metrics:
+    """Request counters, latency histograms & time sums in a shared table
+
+    Every row has one value per histogram bucket (+Inf included) followed by
+    a sum & a count; counters & sums only use the last two.
+    Row keys: '<metric>|<label value>|...'.
+    """
+
+    def __init__(self, path, slots, buckets):
+        self.buckets = tuple(buckets)
+        self.sum_index = len(self.buckets) + 1
+        self.count_index = self.sum_index + 1
+        self.table = shm.SharedTable(path, slots=slots, width=self.count_index + 1)
+
+    def bucket_index(self, seconds):
+        """Return the index of the histogram bucket of a duration"""
+        for index, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                return index
+        return len(self.buckets)
+
+    def record(self, route, method, status_code, duration, queries=None, db_time=None, view_time=None,
+               render_time=None):
+        """Record one request (one lock round trip)"""
+        try:
+            with self.table.locked():
+                self.table.add_locked('requests|%s|%s|%d' % (route, method, status_code), {self.count_index: 1})
+                self.table.add_locked('request_duration|%s|%s' % (route, method), {
+                    self.bucket_index(duration): 1, self.sum_index: duration, self.count_index: 1,
+                })
+                for name, seconds, count in (
+                    ('db', db_time, queries),
+                    ('view', view_time, 1),
+                    ('render', render_time, 1),
+                ):
+                    if seconds is not None:
+                        self.table.add_locked('%s|%s' % (name, route), {self.sum_index: seconds, self.count_index: count})
+        except shm.TableFull:
+            # Too many distinct routes/status codes, drop rather than fail the request
+            pass
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        families = {
+            'requests': [], 'request_duration': [], 'db': [], 'view': [], 'render': [],
+        }
+        for key, values in sorted(self.table.items()):
+            name, *labels = key.split('|')
+            if name in families:
+                families[name].append((labels, values))
+
+        lines = []
+
+        def family(metric, kind, help_text):
+            lines.append('# HELP %s %s' % (metric, help_text))
+            lines.append('# TYPE %s %s' % (metric, kind))
+
+        family('profile_api_requests_total', 'counter', 'Requests by route, method & status code.')
+        for (route, method, status_code), values in families['requests']:
+            lines.append('profile_api_requests_total{route="%s",method="%s",status="%s"} %d' % (
+                route, method, status_code, values[self.count_index]))
+
+        family('profile_api_request_duration_seconds', 'histogram', 'Request latency by route & method.')
+        for (route, method), values in families['request_duration']:
+            labels = 'route="%s",method="%s"' % (route, method)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), values):
+                cumulative += count
+                lines.append('profile_api_request_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bound, cumulative))
+            lines.append('profile_api_request_duration_seconds_sum{%s} %r' % (labels, values[self.sum_index]))
+            lines.append('profile_api_request_duration_seconds_count{%s} %d' % (labels, values[self.count_index]))
+
+        family('profile_api_db_queries_total', 'counter', 'Database queries by route.')
+        for (route,), values in families['db']:
+            lines.append('profile_api_db_queries_total{route="%s"} %d' % (route, values[self.count_index]))
+        family('profile_api_db_query_seconds_total', 'counter', 'Time spent in database queries by route.')
+        for (route,), values in families['db']:
+            lines.append('profile_api_db_query_seconds_total{route="%s"} %r' % (route, values[self.sum_index]))
+
+        for name, help_text in (
+            ('view', 'Time spent in the view (queries & serialization) by route.'),
+            ('render', 'Time spent rendering responses by route.'),
+        ):
+            metric = 'profile_api_%s_seconds' % name
+            family(metric, 'summary', help_text)
+            for (route,), values in families[name]:
+                lines.append('%s_sum{route="%s"} %r' % (metric, route, values[self.sum_index]))
+                lines.append('%s_count{route="%s"} %d' % (metric, route, values[self.count_index]))
+        return '\n'.join(lines) + '\n'
+
+
+def _build_metrics():
+    """Create the process wide metrics from settings"""
+    config = _metrics_config()
+    return Metrics(config['PATH'], config['SLOTS'], config['BUCKETS'])
+
+
+metrics = _build_metrics()
+
+
+class MetricsMiddleware:
+    """Records latency, status, DB, view & render time of every request
+
+    Must come before QueryCountMiddleware (it reads request.query_recorder).
+    Render time is measured between process_template_response() and the
+    response's post-render callback, view time from process_view() until then.
+    """
+
+    def __init__(self, get_response):
+        if not _metrics_config()['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        finished = time.perf_counter()
+        if is_warmup(request):
+            return response
+        timings = getattr(request, '_metrics_timings', {})
+        if 'view_started' in timings and 'view' not in timings:
+            # Not a template response (HttpResponse, cached, 304)
+            timings['view'] = finished - timings['view_started']
+        recorder = getattr(request, 'query_recorder', None)
+        metrics.record(
+            get_url_name(request),
+            request.method,
+            response.status_code,
+            finished - started,
+            queries=recorder.count if recorder else None,
+            db_time=recorder.duration if recorder else None,
+            view_time=timings.get('view'),
+            render_time=timings.get('render'),
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_timings = {'view_started': time.perf_counter()}
+
+    def process_template_response(self, request, response):
+        timings = getattr(request, '_metrics_timings', None)
+        if timings is None:
+            return response
+        render_started = time.perf_counter()
+        timings['view'] = render_started - timings['view_started']
+
+        def rendered(response):
+            timings['render'] = time.perf_counter() - render_started
+
+        response.add_post_render_callback(rendered)
+        return response
@@ -0,0 +1,134 @@
+# Request middleware (app_name/middleware.py)
+
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+class QueryRecorder:
+    """Database execute wrapper counting queries, time & repeated SQL"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        """Number of queries that repeated an earlier query (same SQL & params)"""
+        return sum(count - 1 for count in self.statements.values())
+
+    @property
+    def similar(self):
+        """Number of queries that repeated earlier SQL with other params (N+1 pattern)"""
+        per_sql = Counter()
+        for sql, _ in self.statements:
+            per_sql[sql] += 1
+        return sum(count - 1 for count in per_sql.values())
+
+    def record(self):
+        """Return a context manager recording every query on every connection"""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+class RollingQueryStats:
+    """Keeps the last `window` samples of query stats per URL name"""
+
+    def __init__(self, window=500):
+        self.window = window
+        self._samples = defaultdict(lambda: deque(maxlen=self.window))
+        self._lock = threading.Lock()
+
+    def add(self, url_name, recorder):
+        """Record a request's query stats"""
+        sample = (recorder.count, recorder.duration, recorder.duplicates, recorder.similar)
+        with self._lock:
+            self._samples[url_name].append(sample)
+
+    def clear(self):
+        """Forget every sample"""
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        """Return per URL name averages & maximums over the window"""
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+        summary = {}
+        for name, values in sorted(samples.items()):
+            requests = len(values)
+            summary[name] = {
+                'requests': requests,
+                'queries_avg': sum(value[0] for value in values) / requests,
+                'queries_max': max(value[0] for value in values),
+                'db_time_ms_avg': 1000 * sum(value[1] for value in values) / requests,
+                'db_time_ms_max': 1000 * max(value[1] for value in values),
+                'duplicate_queries_max': max(value[2] for value in values),
+                'similar_queries_max': max(value[3] for value in values),
+            }
+        return summary
+
+
+query_stats = RollingQueryStats(getattr(settings, 'PROFILE_API_QUERY_STATS_WINDOW', 500))
+
+
+# WSGI environ key of the requests sent by the pre-fork warmup & the startup
+# measurement (profile_api/warmup.py), left out of stats & metrics
+WARMUP_ENVIRON_KEY = 'profile_api.warmup'
+
+
+def is_warmup(request):
+    """Return True for a warmup/startup measurement request"""
+    return bool(request.META.get(WARMUP_ENVIRON_KEY))
+
+
+def get_url_name(request):
+    """Return the URL name of the resolved view ('feed-list', 'login', ...)"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.url_name or match.view_name or 'unnamed'
+
+
+class QueryCountMiddleware:
+    """Records queries, DB time & repeated SQL per request, keyed by URL name
+
+    Adds X-DB-* headers to the response when DEBUG or
+    PROFILE_API_QUERY_HEADERS is enabled. Queries run while a streaming
+    response is consumed happen after this middleware and aren't counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = self.get_response(request)
+        # Made available to other middleware (metrics)
+        request.query_recorder = recorder
+        if not is_warmup(request):
+            query_stats.add(get_url_name(request), recorder)
+
+        if settings.DEBUG or getattr(settings, 'PROFILE_API_QUERY_HEADERS', False):
+            response['X-DB-Queries'] = str(recorder.count)
+            response['X-DB-Time-Ms'] = '%.2f' % (recorder.duration * 1000)
+            response['X-DB-Duplicate-Queries'] = str(recorder.duplicates)
+            response['X-DB-Similar-Queries'] = str(recorder.similar)
+        return response
@@ -0,0 +1,21 @@
+# Generated by Django 2.2 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profile_api', '0003_auto_20210414_2244'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profilefeeditem',
+            index=models.Index(fields=['user_profile', 'created_on', 'id'], name='feeditem_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profilefeeditem',
+            index=models.Index(fields=['created_on', 'id'], name='feeditem_created_idx'),
+        ),
+    ]
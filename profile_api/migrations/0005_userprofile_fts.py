@@ -0,0 +1,67 @@
+from django.db import OperationalError, migrations
+
+# The SQL of profile_api/search.py as of this migration, copied so later
+# changes to that module don't change what this migration does
+
+# Trigram tokenizer: case-insensitive substring matching, like icontains
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS profile_api_userprofile_fts USING fts5("
+    "name, email, content='profile_api_userprofile', content_rowid='id', tokenize='trigram')"
+)
+CREATE_TRIGGERS_SQL = (
+    "CREATE TRIGGER IF NOT EXISTS profile_api_userprofile_fts_ai AFTER INSERT ON profile_api_userprofile BEGIN "
+    "INSERT INTO profile_api_userprofile_fts(rowid, name, email) VALUES (new.id, new.name, new.email); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS profile_api_userprofile_fts_ad AFTER DELETE ON profile_api_userprofile BEGIN "
+    "INSERT INTO profile_api_userprofile_fts(profile_api_userprofile_fts, rowid, name, email) "
+    "VALUES ('delete', old.id, old.name, old.email); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS profile_api_userprofile_fts_au AFTER UPDATE OF name, email "
+    "ON profile_api_userprofile BEGIN "
+    "INSERT INTO profile_api_userprofile_fts(profile_api_userprofile_fts, rowid, name, email) "
+    "VALUES ('delete', old.id, old.name, old.email); "
+    "INSERT INTO profile_api_userprofile_fts(rowid, name, email) VALUES (new.id, new.name, new.email); "
+    "END",
+)
+REBUILD_SQL = "INSERT INTO profile_api_userprofile_fts(profile_api_userprofile_fts) VALUES ('rebuild')"
+DROP_SQL = (
+    "DROP TRIGGER IF EXISTS profile_api_userprofile_fts_ai",
+    "DROP TRIGGER IF EXISTS profile_api_userprofile_fts_ad",
+    "DROP TRIGGER IF EXISTS profile_api_userprofile_fts_au",
+    "DROP TABLE IF EXISTS profile_api_userprofile_fts",
+)
+
+
+def create_fts(apps, schema_editor):
+    """Create the FTS5 index over user profile name/email (SQLite only)"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(CREATE_TABLE_SQL)
+        except OperationalError:
+            # SQLite built without FTS5 or the trigram tokenizer (< 3.34)
+            return
+        for statement in CREATE_TRIGGERS_SQL:
+            cursor.execute(statement)
+        cursor.execute(REBUILD_SQL)
+
+
+def drop_fts(apps, schema_editor):
+    """Drop the FTS5 index"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profile_api', '0004_feed_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts, drop_fts),
+    ]
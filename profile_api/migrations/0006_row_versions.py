@@ -0,0 +1,23 @@
+# Generated by Django 2.2 on 2026-10-18 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profile_api', '0005_userprofile_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profilefeeditem',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
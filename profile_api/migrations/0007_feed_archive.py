@@ -0,0 +1,47 @@
+# Generated by Django 2.2 on 2026-10-18 19:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profile_api', '0006_row_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedItemHistory',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('status_text', models.CharField(max_length=255)),
+                ('created_on', models.DateTimeField()),
+                ('updated_on', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'profile_api_feeditem_history',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedFeedItem',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('status_text', models.CharField(max_length=255)),
+                ('created_on', models.DateTimeField()),
+                ('updated_on', models.DateTimeField()),
+                ('archived_on', models.DateTimeField(auto_now_add=True)),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedfeeditem',
+            index=models.Index(fields=['user_profile', 'created_on', 'id'], name='archiveditem_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedfeeditem',
+            index=models.Index(fields=['created_on', 'id'], name='archiveditem_created_idx'),
+        ),
+    ]
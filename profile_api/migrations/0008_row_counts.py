@@ -0,0 +1,40 @@
+# Generated by Django 2.2 on 2026-10-18 19:19
+
+from django.db import migrations, models
+
+# Counted models (profile_api.counters.COUNTED_MODELS)
+COUNTED_MODELS = ('userprofile', 'profilefeeditem')
+
+
+def count_rows(apps, schema_editor):
+    """Start the counters at the current row counts"""
+    RowCount = apps.get_model('profile_api', 'RowCount')
+    using = schema_editor.connection.alias
+    for model_name in COUNTED_MODELS:
+        model = apps.get_model('profile_api', model_name)
+        RowCount.objects.using(using).update_or_create(
+            name='profile_api.%s' % model_name,
+            defaults={'rows': model.objects.using(using).count()},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profile_api', '0007_feed_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RowCount',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('rows', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['updated_on'], name='userprofile_updated_idx'),
+        ),
+        migrations.RunPython(count_rows, migrations.RunPython.noop),
+    ]
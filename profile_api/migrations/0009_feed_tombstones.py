@@ -0,0 +1,26 @@
+# Generated by Django 2.2 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profile_api', '0008_row_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedItemTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_id', models.IntegerField()),
+                ('user_id', models.IntegerField()),
+                ('deleted_on', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='feeditemtombstone',
+            index=models.Index(fields=['user_id', 'id'], name='tombstone_user_idx'),
+        ),
+    ]
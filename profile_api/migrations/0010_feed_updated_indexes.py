@@ -0,0 +1,21 @@
+# Generated by Django 2.2 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profile_api', '0009_feed_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='profilefeeditem',
+            index=models.Index(fields=['updated_on'], name='feeditem_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profilefeeditem',
+            index=models.Index(fields=['user_profile', 'updated_on'], name='feeditem_user_updated_idx'),
+        ),
+    ]
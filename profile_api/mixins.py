@@ -0,0 +1,425 @@
+# ViewSet mixins shared by the profile & feed ViewSets (app_name/mixins.py)
+
+import hashlib
+
+from django.conf import settings
+from django.db.models import Subquery
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.response import Response
+
+from profile_api import caching
+from profile_api import hashing
+from profile_api import readers
+from profile_api import renderers
+
+
+def parse_since(value):
+    """Parse a ?since= datetime (or date), naive values use the current timezone"""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is not None:
+            parsed = timezone.datetime(date.year, date.month, date.day)
+    if parsed is None:
+        raise ValidationError({'since': 'Expected an ISO 8601 date or datetime.'})
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+class HashingLoadSheddingMixin:
+    """Answers with a 503 + Retry-After when the password hashing pool is saturated
+
+    HashingPoolSaturated is a DRF exception, only raised within these views;
+    elsewhere (admin login, createsuperuser) a saturated pool hashes inline.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with hashing.shedding_load():
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ExportMixin:
+    """Adds an `export` action streaming every row of the queryset
+
+    Rows are read with QuerySet.iterator() and serialized one at a time, so
+    memory stays constant no matter how many rows are exported.
+    """
+    # Model field ?since= filters on (rows where field >= since), None to disable
+    export_since_field = None
+
+    def get_export_queryset(self):
+        """Return the filtered queryset to export, oldest rows first"""
+        queryset = self.filter_queryset(self.get_queryset())
+        since = self.request.query_params.get('since')
+        if since is not None:
+            if self.export_since_field is None:
+                raise ValidationError({'since': 'Not supported for this export.'})
+            queryset = queryset.filter(**{self.export_since_field + '__gte': parse_since(since)})
+        return queryset.order_by('pk')
+
+    def iter_export_rows(self, queryset):
+        """Yield the serialized representation of every row"""
+        serializer = self.get_serializer()
+        chunk_size = getattr(settings, 'PROFILE_API_EXPORT_CHUNK_SIZE', 2000)
+        for instance in queryset.iterator(chunk_size=chunk_size):
+            yield serializer.to_representation(instance)
+
+    def iter_export_content(self, rows, media_type):
+        """Encode rows as NDJSON lines or as one JSON array, a chunk per row"""
+        if media_type == renderers.NDJSONRenderer.media_type:
+            for row in rows:
+                yield (renderers.dumps(row) + '\n').encode('utf-8')
+            return
+        separator = b'['
+        for row in rows:
+            yield separator + renderers.dumps(row).encode('utf-8')
+            separator = b','
+        yield b'[]' if separator == b'[' else b']'
+
+    @action(detail=False, methods=['get'], renderer_classes=(renderers.NDJSONRenderer, JSONRenderer))
+    def export(self, request):
+        """Stream every row as NDJSON (default) or a JSON array (Accept: application/json)
+
+        Supports the list filters plus ?since=<ISO 8601 datetime>.
+        """
+        queryset = self.get_export_queryset()
+        media_type = request.accepted_renderer.media_type
+        response = StreamingHttpResponse(
+            self.iter_export_content(self.iter_export_rows(queryset), media_type),
+            content_type=media_type,
+        )
+        response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+            self.basename, request.accepted_renderer.format,
+        )
+        return response
+
+
+class SparseFieldsMixin:
+    """?fields= (sparse fieldsets) & ?expand= (embedded relations) on list & retrieve
+
+    ?fields=id,status_text keeps those fields in the output and the query
+    loads only their columns (QuerySet.only()), plus the pk, version field &
+    pagination ordering fields the other mixins read. ?expand=user_profile
+    embeds the serializer's expandable_fields serializer in place of the pk,
+    fetched by the same query (select_related()) rather than one GET per row.
+    """
+
+    def get_sparse_params(self):
+        """Return the validated (fields or None, expand) of this request"""
+        if getattr(self, '_sparse_params', None) is not None:
+            return self._sparse_params
+        fields, expand = None, ()
+        params = self.request.query_params
+        if self.action in ('list', 'retrieve') and ('fields' in params or 'expand' in params):
+            serializer_class = self.get_serializer_class()
+            readable = [name for name, field in serializer_class().fields.items() if not field.write_only]
+            if 'fields' in params:
+                fields = [name for name in params['fields'].split(',') if name]
+                unknown = [name for name in fields if name not in readable]
+                if unknown or not fields:
+                    raise ValidationError({'fields': 'Expected a comma separated list of: %s.' % ', '.join(readable)})
+            expandable = getattr(serializer_class, 'expandable_fields', {})
+            expand = tuple(name for name in params.get('expand', '').split(',') if name)
+            if any(name not in expandable for name in expand):
+                if not expandable:
+                    raise ValidationError({'expand': 'No field can be expanded.'})
+                raise ValidationError({'expand': 'Expected a comma separated list of: %s.' % ', '.join(expandable)})
+            # Expanding a field that isn't output would only join for nothing
+            expand = tuple(name for name in expand if fields is None or name in fields)
+        self._sparse_params = (fields, expand)
+        return self._sparse_params
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        fields, expand = self.get_sparse_params()
+        context.update(fields=fields, expand=expand)
+        return context
+
+    def get_sparse_columns(self, queryset, fields, expand):
+        """Return the only() columns of the requested fields, None to load every column"""
+        model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+        if fields is None:
+            columns = [field.name for field in queryset.model._meta.concrete_fields]
+        else:
+            serializer_fields = self.get_serializer_class()().fields
+            columns = [serializer_fields[name].source for name in fields]
+            if any(column not in model_fields for column in columns):
+                # A computed or dotted source, let it load what it needs
+                return None
+            columns.append(queryset.model._meta.pk.name)
+            columns.append(getattr(self, 'version_field', None))
+            columns += [name.lstrip('-') for name in getattr(self.paginator, 'ordering', None) or ()]
+        expandable = self.get_serializer_class().expandable_fields
+        for name in expand:
+            columns += ['%s__%s' % (name, related) for related in expandable[name].Meta.fields]
+            # The conditional GET validators include the related row's version
+            if getattr(self, 'version_field', None):
+                columns.append('%s__%s' % (name, self.version_field))
+        return [column for column in dict.fromkeys(columns) if column]
+
+    def filter_queryset(self, queryset):
+        """Load only the requested columns & join the expanded relations"""
+        queryset = super().filter_queryset(queryset)
+        fields, expand = self.get_sparse_params()
+        if fields is None and not expand:
+            return queryset
+        if expand:
+            queryset = queryset.select_related(*expand)
+        columns = self.get_sparse_columns(queryset, fields, expand)
+        if columns is not None:
+            queryset = queryset.only(*columns)
+        return queryset
+
+
+class CachedResponseMixin:
+    """Serves list & retrieve GETs from rendered responses in a ResponseCache
+
+    Keys are versioned by the 'list' scope (every list page) or 'obj:<pk>'
+    (one object) generation, which signal receivers bump when a row changes
+    (profile_api/signals.py). Only 200 responses of the non-browsable
+    renderers are cached, they don't differ per user. Must come before
+    ConditionalGetMixin so hits can be answered with a 304 too.
+    """
+    response_cache = caching.profile_responses
+
+    def use_response_cache(self):
+        """Return True if this request may be answered from the cache"""
+        return (
+            self.response_cache.enabled
+            and self.request.method == 'GET'
+            and not isinstance(self.request.accepted_renderer, BrowsableAPIRenderer)
+        )
+
+    def cached_response(self, scope, view):
+        """Return the cached response of this request or render it with view()"""
+        request = self.request
+        key = self.response_cache.make_key(scope, request.build_absolute_uri(), request.accepted_media_type)
+        rendered = []
+
+        def render():
+            response = view()
+            if isinstance(response, Response):
+                response = self.finalize_response(request, response)
+                response.render()
+            rendered.append(response)
+            entry = (
+                response.content,
+                response['Content-Type'],
+                response.get('ETag'),
+                response.get('Last-Modified'),
+            )
+            return entry, response.status_code == 200
+
+        entry = self.response_cache.get_or_render(key, render)
+        if rendered:
+            return rendered[0]
+        content, content_type, etag, last_modified = entry
+        response = get_conditional_response(
+            request, etag=etag, last_modified=parse_http_date_safe(last_modified) if last_modified else None,
+        ) or HttpResponse(content, content_type=content_type)
+        if etag:
+            response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = last_modified
+        return response
+
+    def list(self, request, *args, **kwargs):
+        """List rows from the cache (scope 'list')"""
+        if not self.use_response_cache():
+            return super().list(request, *args, **kwargs)
+        return self.cached_response('list', lambda: super(CachedResponseMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve a row from the cache (scope 'obj:<pk>')"""
+        try:
+            # /api/profile/01/ is row 1 too, its scope must be the one bumped
+            pk = int(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        except ValueError:
+            pk = None
+        if pk is None or not self.use_response_cache():
+            return super().retrieve(request, *args, **kwargs)
+        scope = 'obj:%d' % pk
+        return self.cached_response(scope, lambda: super(CachedResponseMixin, self).retrieve(request, *args, **kwargs))
+
+
+class ConditionalGetMixin:
+    """Answers If-None-Match/If-Modified-Since with a 304 before serializing
+
+    retrieve: the validators come from the row's version field, read by the
+    get_object() query the view runs anyway (ETag + Last-Modified).
+    list: the row count, max id & max version field of the filtered
+    queryset give the ETag (get_list_validators). Lists don't send Last-Modified
+    since deleting a row doesn't move the max version back.
+    Relations embedded by ?expand= (SparseFieldsMixin) change the response
+    too: their version field is part of the validators.
+    """
+    # auto_now model field bumped on every save
+    version_field = 'updated_on'
+
+    def make_etag(self, *parts):
+        """Return a strong ETag for this URL, representation & validator parts"""
+        request = self.request
+        # Browsable API pages differ per user, other representations don't
+        user = request.user.pk if isinstance(request.accepted_renderer, BrowsableAPIRenderer) else None
+        key = '|'.join(str(part) for part in (
+            request.get_full_path(),
+            request.accepted_renderer.media_type,
+            user,
+        ) + parts)
+        return '"%s"' % hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def get_object(self):
+        """Fetch the object once per request (validators & response share it)"""
+        if getattr(self, '_object', None) is None:
+            self._object = super().get_object()
+        return self._object
+
+    def not_modified(self, etag, last_modified=None):
+        """Return a 304 response if the client's copy is current, else None"""
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(self.request, etag=etag, last_modified=timestamp)
+        if response is not None:
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    def set_validators(self, response, etag, last_modified=None):
+        """Add the ETag/Last-Modified headers to a response"""
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
+
+    def get_expanded_relations(self):
+        """Return the relations embedded in this response (?expand=)"""
+        get_sparse_params = getattr(self, 'get_sparse_params', None)
+        return get_sparse_params()[1] if get_sparse_params is not None else ()
+
+    def get_list_validators(self, queryset):
+        """Return the (row count, last id, last version, last version of each expanded relation) of a list
+
+        Each maximum is an ORDER BY ... DESC LIMIT 1 subquery, an index
+        lookup (SQLite only turns a MAX() into one when it's alone in its
+        query), all in one statement. Unfiltered lists read the maintained
+        row count (profile_api/counters.py), filtered ones count up to the
+        paginator's cap, never COUNT(*) over every row.
+        """
+        queryset = queryset.order_by()
+        fields = ['pk', self.version_field] + [
+            '%s__%s' % (name, self.version_field) for name in self.get_expanded_relations()
+        ]
+        latest = {
+            'latest_%d' % index: Subquery(queryset.order_by('-' + field).values(field)[:1])
+            for index, field in enumerate(fields)
+        }
+        rows = list(
+            queryset.model._default_manager.using(queryset.db)
+            .order_by().annotate(**latest).values(*latest)[:1]
+        )
+        # No row at all: the list is empty
+        validators = tuple(rows[0][name] for name in latest) if rows else (None,) * len(fields)
+        count = None
+        get_row_count = getattr(self.paginator, 'get_row_count', None)
+        if get_row_count is not None:
+            count = get_row_count(queryset, self.request)
+        if count is None:
+            # Filtered: the paginator's capped count, never a COUNT of every match
+            get_capped_count = getattr(self.paginator, 'get_capped_count', None)
+            count = get_capped_count(queryset) if get_capped_count is not None else queryset.values('pk').count()
+        return (count,) + validators
+
+    def list(self, request, *args, **kwargs):
+        """List rows unless the client's ETag is still current"""
+        etag = self.make_etag(*self.get_list_validators(self.filter_queryset(self.get_queryset())))
+        response = self.not_modified(etag)
+        if response is not None:
+            return response
+        return self.set_validators(super().list(request, *args, **kwargs), etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve a row unless the client's copy is still current"""
+        instance = self.get_object()
+        versions = [getattr(instance, self.version_field)]
+        for name in self.get_expanded_relations():
+            # Joined by get_object() (select_related), no extra query
+            related = getattr(instance, name)
+            if related is not None:
+                versions.append(getattr(related, self.version_field))
+        last_modified = max(versions)
+        etag = self.make_etag(instance.pk, *[version.isoformat() for version in versions])
+        response = self.not_modified(etag, last_modified)
+        if response is not None:
+            return response
+        return self.set_validators(super().retrieve(request, *args, **kwargs), etag, last_modified)
+
+
+class FastReadMixin:
+    """Opt-in (PROFILE_API_FAST_READS) values_list() read path for list & retrieve
+
+    Rows are fetched as tuples of exactly the serializer's readable fields and
+    converted column by column (profile_api/readers.py), skipping model
+    instances & DRF field objects. Output is identical to the serializer's.
+    """
+
+    def get_fast_reader(self):
+        """Return a FastReader for this request or None to use the serializer"""
+        if not getattr(settings, 'PROFILE_API_FAST_READS', False):
+            return None
+        if self.action not in ('list', 'retrieve'):
+            return None
+        if getattr(self, '_fast_reader', None) is None:
+            self._fast_reader = readers.get_fast_reader(self.get_serializer()) or False
+        return self._fast_reader or None
+
+    def get_fast_queryset(self, reader):
+        """Return the filtered queryset as named rows
+
+        Besides the serializer's sources, rows carry the pk, the version
+        field and the pagination ordering fields the other mixins read.
+        """
+        extra = ['pk', getattr(self, 'version_field', None)]
+        extra += [name.lstrip('-') for name in getattr(self.paginator, 'ordering', None) or ()]
+        fields = list(reader.sources)
+        for name in extra:
+            if name and name not in fields:
+                fields.append(name)
+        return self.filter_queryset(self.get_queryset()).values_list(*fields, named=True)
+
+    def get_object(self):
+        """Return a named row instead of a model instance on fast retrieves"""
+        reader = self.get_fast_reader()
+        if reader is None or self.action != 'retrieve':
+            return super().get_object()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(
+            self.get_fast_queryset(reader),
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        self.check_object_permissions(self.request, row)
+        return row
+
+    def list(self, request, *args, **kwargs):
+        """List rows through the fast reader when enabled"""
+        reader = self.get_fast_reader()
+        if reader is None:
+            return super().list(request, *args, **kwargs)
+        rows = self.get_fast_queryset(reader)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(reader.convert(page))
+        return Response(reader.convert(rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        """Retrieve a row through the fast reader when enabled"""
+        reader = self.get_fast_reader()
+        if reader is None:
+            return super().retrieve(request, *args, **kwargs)
+        return Response(reader.convert_one(self.get_object()))
@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 # Used to receive settings from project_name/settings.py
 from django.conf import settings
+# Password hashing runs in a bounded process pool (app_name/hashing.py)
+from profile_api import hashing
 
 class UserProfileManager(BaseUserManager):
     """Manager for user profiles"""
@@ -41,6 +43,8 @@ class UserProfile(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Row version for conditional GET (ETag/Last-Modified) & exports
+    updated_on = models.DateTimeField(auto_now=True)
 
     # User Profiles is managed by the UserProfileManager class
     objects = UserProfileManager()
@@ -49,7 +53,25 @@ class UserProfile(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name']
 
+    class Meta:
+        # MAX(updated_on) of the profile list's ETag without a table scan
+        indexes = [models.Index(fields=['updated_on'], name='userprofile_updated_idx')]
+
     # Define Model methods 
+    def set_password(self, raw_password):
+        """Hash the password in the hashing pool instead of the request thread"""
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """Verify the password in the hashing pool, upgrading the hash if needed"""
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes
+            self._password = None
+            self.save(update_fields=['password'])
+        return hashing.check_password(raw_password, self.password, setter)
+
     def get_full_name(self):
         """Retrieve full name of user"""
         return self.name
@@ -74,10 +96,110 @@ class ProfileFeedItem(models.Model):
     )
     status_text = models.CharField(max_length = 255)
     created_on = models.DateTimeField(auto_now_add=True)
+    # Row version for conditional GET (ETag/Last-Modified)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Composite indexes backing keyset pagination of the feed
+        # (feed list ordered by created_on/id, optionally filtered by user)
+        indexes = [
+            models.Index(
+                fields=['user_profile', 'created_on', 'id'],
+                name='feeditem_user_created_idx',
+            ),
+            models.Index(fields=['created_on', 'id'], name='feeditem_created_idx'),
+            # Latest updated_on of the list's ETag (ConditionalGetMixin)
+            # without a table scan, of the whole feed & of a user's items
+            models.Index(fields=['updated_on'], name='feeditem_updated_idx'),
+            models.Index(fields=['user_profile', 'updated_on'], name='feeditem_user_updated_idx'),
+        ]
     
     def __str__(self):
         """Return the model as string"""
         return self.status_text
-    
-    
-    
\ No newline at end of file
+
+
+class ArchivedFeedItem(models.Model):
+    """Profile status update moved out of the hot feed table (archive_feed command)"""
+    # Same id as the ProfileFeedItem it was moved from
+    id = models.IntegerField(primary_key=True)
+    user_profile = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    status_text = models.CharField(max_length=255)
+    created_on = models.DateTimeField()
+    updated_on = models.DateTimeField()
+    archived_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user_profile', 'created_on', 'id'],
+                name='archiveditem_user_created_idx',
+            ),
+            models.Index(fields=['created_on', 'id'], name='archiveditem_created_idx'),
+        ]
+
+    def __str__(self):
+        """Return the model as string"""
+        return self.status_text
+
+
+class FeedItemHistory(models.Model):
+    """Read-only view over hot & archived feed items (UNION ALL, profile_api/archive.py)
+
+    Used by feed reads reaching past the retention window.
+    """
+    id = models.IntegerField(primary_key=True)
+    # No constraint, it's a view
+    user_profile = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+    status_text = models.CharField(max_length=255)
+    created_on = models.DateTimeField()
+    updated_on = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = 'profile_api_feeditem_history'
+
+    def __str__(self):
+        """Return the model as string"""
+        return self.status_text
+
+
+class RowCount(models.Model):
+    """Maintained row count of a model's table (profile_api/counters.py)
+
+    Kept up to date by signals & the bulk paths so listings don't need a
+    COUNT(*), `manage.py reconcile_row_counts` corrects any drift.
+    """
+    # Model label, e.g. 'profile_api.userprofile'
+    name = models.CharField(max_length=100, primary_key=True)
+    rows = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        """Return the model as string"""
+        return '%s: %d' % (self.name, self.rows)
+
+
+class FeedItemTombstone(models.Model):
+    """Deleted feed item, reported by the feed's changes action (profile_api/changes.py)
+
+    Written in bulk by the code deleting feed items (changes.delete_items,
+    changes.record_deletions), archived items aren't deleted items and leave
+    none. Pruned after PROFILE_API_FEED_CHANGES['TOMBSTONE_DAYS'].
+    """
+    # Plain ids, the item (and maybe its author) no longer exist
+    item_id = models.IntegerField()
+    user_id = models.IntegerField()
+    deleted_on = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        # Deletions after a sync token, optionally of one user (?user=)
+        indexes = [models.Index(fields=['user_id', 'id'], name='tombstone_user_idx')]
+
+    def __str__(self):
+        """Return the model as string"""
+        return 'Feed item %d' % self.item_id
@@ -0,0 +1,134 @@
+# Pagination classes used by the ViewSets (app_name/pagination.py)
+
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from profile_api import counters
+
+
+class RowCountMixin:
+    """Row count of a list: the maintained counter when nothing filters it,
+    else a count capped at count_cap + 1 rows
+    """
+
+    # Query parameters that select a page or a representation, never rows
+    unfiltered_params = ('format', 'fields', 'expand')
+    count_cap = getattr(settings, 'PROFILE_API_COUNT_ESTIMATE_CAP', 1000)
+
+    def is_filtered(self, request):
+        """Return True if query parameters other than paging/representation ones may filter the list"""
+        paging = {
+            getattr(self, name) for name in ('page_query_param', 'cursor_query_param', 'page_size_query_param')
+            if getattr(self, name, None)
+        }
+        return bool(set(request.query_params) - paging - set(self.unfiltered_params))
+
+    def get_row_count(self, queryset, request):
+        """Return the maintained row count of an unfiltered list, else None
+
+        Read once per request (the conditional GET's ETag uses it too).
+        """
+        if self.is_filtered(request):
+            return None
+        if not hasattr(self, '_row_count'):
+            self._row_count = counters.get(queryset.model)
+        return self._row_count
+
+    def get_capped_count(self, queryset):
+        """Return the rows of queryset, counting count_cap + 1 at most
+
+        Counted once per request (the conditional GET's ETag uses it too),
+        over the primary keys only: annotations such as the search rank
+        aren't computed for every row.
+        """
+        if not hasattr(self, '_capped_count'):
+            self._capped_count = queryset.order_by().values('pk')[:self.count_cap + 1].count()
+        return self._capped_count
+
+
+class FeedCursorPagination(RowCountMixin, CursorPagination):
+    """Keyset pagination for profile feed items, newest first
+
+    DRF's cursor holds the created_on of the page boundary (ordering[0]
+    only) plus an offset among the rows sharing that timestamp. Each page is
+    a range scan of the (created_on, id) index from the boundary, the offset
+    only skips rows with the same created_on (a handful at most) instead of
+    every row of the previous pages. id orders those ties so they are never
+    repeated or skipped.
+    """
+
+    ordering = ('-created_on', '-id')
+    page_size = getattr(settings, 'PROFILE_API_FEED_PAGE_SIZE', 50)
+    # Allow clients to ask for smaller/larger pages (?page_size=) up to the cap
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'PROFILE_API_FEED_MAX_PAGE_SIZE', 200)
+
+
+class CountFreePagination(RowCountMixin, PageNumberPagination):
+    """Page number pagination that never runs an exact COUNT(*)
+
+    Pages fetch one extra row to tell whether there's a next page. `count`
+    is the maintained row count (profile_api/counters.py) for unfiltered
+    lists, otherwise a count capped at count_cap rows, returned as
+    '<count_cap>+' (e.g. "1000+") when there are more.
+    """
+    page_size = getattr(settings, 'PROFILE_API_PROFILE_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'PROFILE_API_PROFILE_MAX_PAGE_SIZE', 200)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        page_number = request.query_params.get(self.page_query_param, '1')
+        if not page_number.isdigit() or int(page_number) < 1:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message='Invalid page.'))
+        self.request = request
+        self.page_number = int(page_number)
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        if not rows and self.page_number > 1:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message='That page contains no results'))
+        self.count = self.get_count(queryset, request, offset + len(rows))
+        return rows[:page_size]
+
+    def get_count(self, queryset, request, seen):
+        """Return the total (maintained or capped), `seen` rows are known to exist"""
+        if not self.has_next:
+            # Last page, the total is exact
+            return seen
+        count = self.get_row_count(queryset, request)
+        if count is not None:
+            # The counter may lag a concurrent write, never report less than we saw
+            return max(count, seen)
+        capped = self.get_capped_count(queryset)
+        return '%d+' % self.count_cap if capped > self.count_cap else capped
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.page_number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
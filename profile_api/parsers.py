@@ -0,0 +1,50 @@
+# Request body parsers (app_name/parsers.py)
+
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """Parses newline delimited JSON lazily, one line at a time
+
+    Returns a generator so the body is never buffered as a whole. Each item
+    is the decoded line, or a ParseError (with the line number) for lines
+    that are not valid JSON or longer than PROFILE_API_NDJSON_MAX_LINE_BYTES,
+    so callers can report per-line errors.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """Return a generator over the decoded lines of the stream"""
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        max_bytes = getattr(settings, 'PROFILE_API_NDJSON_MAX_LINE_BYTES', 1024 * 1024)
+        return self._iter_lines(stream, encoding, max_bytes)
+
+    def _iter_lines(self, stream, encoding, max_bytes):
+        """Yield the decoded value (or a ParseError) of every non-blank line"""
+        if stream is None:
+            return
+        line_number = 0
+        while True:
+            # Never read more than max_bytes (+ the newline) of a line at once
+            line = stream.readline(max_bytes + 1)
+            if not line:
+                return
+            line_number += 1
+            if len(line) > max_bytes and not line.endswith(b'\n'):
+                # Skip the rest of the line
+                while line and not line.endswith(b'\n'):
+                    line = stream.readline(max_bytes + 1)
+                yield ParseError('Line %d: longer than %d bytes' % (line_number, max_bytes))
+                continue
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line.decode(encoding))
+            except ValueError as exc:
+                yield ParseError('Line %d: JSON parse error - %s' % (line_number, exc))
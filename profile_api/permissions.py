@@ -22,4 +22,5 @@ class UpdateOwnStatus(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
         # Return true if status object belongs to requesting user
-        return obj.user_profile.id == request.user.id
\ No newline at end of file
+        # (compare the FK column, obj.user_profile would fetch the user)
+        return obj.user_profile_id == request.user.id
\ No newline at end of file
@@ -0,0 +1,267 @@
+# Sampling request profiler (app_name/profiling.py)
+# ProfilingMiddleware runs cProfile on a sample of requests (or on requests
+# carrying a signed X-Profile header) and stores one pstats file per request
+# under <DIRECTORY>/<URL name>/. The directory is capped in size, the oldest
+# profiles are removed first. Staff can list, aggregate & diff the profiles
+# through /api/profiling/ (profile_api/views.py).
+
+import cProfile
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+
+from profile_api.middleware import get_url_name, is_warmup
+
+# Defaults, override with PROFILE_API_PROFILING in settings.py
+PROFILING_DEFAULTS = {
+    # Off: the middleware removes itself at startup
+    'ENABLED': False,
+    # Fraction of requests profiled (0.0 - 1.0)
+    'SAMPLE_RATE': 0.0,
+    # Where the pstats files go & the total size kept
+    'DIRECTORY': os.path.join(settings.BASE_DIR, 'var', 'profiles'),
+    'MAX_BYTES': 50 * 1024 * 1024,
+    # Saves between two scans of the directory (other workers write to it
+    # too), in between a worker only adds up the sizes of its own profiles
+    'ROTATE_EVERY': 100,
+    # Seconds a signed X-Profile header value stays valid
+    'HEADER_MAX_AGE': 3600,
+}
+
+HEADER = 'HTTP_X_PROFILE'
+SIGNING_SALT = 'profile_api.profiling'
+
+# <epoch ms>-<pid>-<duration ms>ms-<status>.prof
+FILE_NAME = re.compile(r'^(?P<time>\d+)-(?P<pid>\d+)-(?P<duration>\d+)ms-(?P<status>\d+)\.prof$')
+# No dots: '.' & '..' would name the store or its parent directory
+ROUTE_NAME = re.compile(r'^[\w-]+$')
+
+
+def get_config():
+    """Return the profiling settings merged over the defaults"""
+    config = dict(PROFILING_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_PROFILING', {}))
+    return config
+
+
+def make_header_value():
+    """Return a signed X-Profile header value forcing a profile of the request"""
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign('profile')
+
+
+def check_header_value(value, max_age):
+    """Return True if value is a valid, unexpired X-Profile header value"""
+    try:
+        return signing.TimestampSigner(salt=SIGNING_SALT).unsign(value, max_age=max_age) == 'profile'
+    except signing.BadSignature:
+        return False
+
+
+class ProfileStore:
+    """Directory of pstats files per URL name, capped to max_bytes in total
+
+    The directory is scanned on the first save, then every rotate_every
+    saves or once the sizes of the profiles saved since (by this process)
+    take the last total over max_bytes, not on every save.
+    """
+
+    def __init__(self, directory, max_bytes, rotate_every=100):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.rotate_every = rotate_every
+        # Bytes stored at the last scan plus those saved by this process since
+        self._bytes = None
+        self._saves = 0
+        self._lock = threading.Lock()
+
+    def save(self, route, profiler, duration, status_code):
+        """Write a profile & drop the oldest ones when over the size cap"""
+        if not ROUTE_NAME.match(route):
+            route = 'unnamed'
+        directory = os.path.join(self.directory, route)
+        os.makedirs(directory, exist_ok=True)
+        name = '%d-%d-%dms-%d.prof' % (time.time() * 1000, os.getpid(), duration * 1000, status_code)
+        path = os.path.join(directory, name)
+        profiler.dump_stats(path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._saves += 1
+            scan = self._bytes is None or self._saves % self.rotate_every == 0
+            if not scan:
+                self._bytes += size
+                scan = self._bytes > self.max_bytes
+        if scan:
+            self.rotate()
+        return path
+
+    def files(self, route=None):
+        """Return (route, name, path, size, metadata) of the stored profiles, oldest first"""
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        routes = [route] if route else sorted(os.listdir(self.directory))
+        for route_name in routes:
+            directory = os.path.join(self.directory, route_name)
+            if not ROUTE_NAME.match(route_name) or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                match = FILE_NAME.match(name)
+                if match is None:
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    # Rotated away by another worker
+                    continue
+                found.append((route_name, name, path, size, {
+                    'time': int(match.group('time')) / 1000.0,
+                    'pid': int(match.group('pid')),
+                    'duration_ms': int(match.group('duration')),
+                    'status': int(match.group('status')),
+                }))
+        found.sort(key=lambda entry: entry[4]['time'])
+        return found
+
+    def rotate(self):
+        """Remove the oldest profiles until the directory fits in max_bytes"""
+        with self._lock:
+            files = self.files()
+            total = sum(entry[3] for entry in files)
+            for _, _, path, size, _ in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+            self._bytes = total
+
+    def resolve(self, reference):
+        """Return the paths a reference names: '<route>' or '<route>/<file name>'"""
+        route, _, name = reference.partition('/')
+        if not ROUTE_NAME.match(route):
+            return []
+        paths = [entry[2] for entry in self.files(route)]
+        if name:
+            paths = [path for path in paths if os.path.basename(path) == name]
+        return paths
+
+
+def load_stats(paths):
+    """Merge pstats files into {function: (calls, total s, cumulative s)}"""
+    if not paths:
+        return {}
+    stats = pstats.Stats(paths[0])
+    for path in paths[1:]:
+        stats.add(path)
+    merged = {}
+    for (filename, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+        merged[format_function(filename, line, function)] = (calls, total, cumulative)
+    return merged
+
+
+def format_function(filename, line, function):
+    """Return a short 'path:line(function)' label"""
+    for prefix in (settings.BASE_DIR, os.path.dirname(os.__file__)):
+        if filename.startswith(prefix + os.sep):
+            filename = filename[len(prefix) + 1:]
+            break
+    if filename == '~':
+        # Built-ins
+        return function
+    return '%s:%d(%s)' % (filename, line, function)
+
+
+def top_functions(stats, sort='cumulative', limit=30):
+    """Return the top functions of merged stats as dicts"""
+    index = {'calls': 0, 'tottime': 1, 'cumulative': 2}[sort]
+    rows = sorted(stats.items(), key=lambda item: item[1][index], reverse=True)[:limit]
+    return [
+        {'function': name, 'calls': calls, 'tottime_ms': total * 1000, 'cumulative_ms': cumulative * 1000}
+        for name, (calls, total, cumulative) in rows
+    ]
+
+
+def diff_functions(base, other, sort='cumulative', limit=30):
+    """Return the functions whose time changed most between two merged stats
+
+    Times are per profile (averaged), so sets of different sizes compare.
+    """
+    index = {'calls': 0, 'tottime': 1, 'cumulative': 2}[sort]
+    base_stats, base_count = base
+    other_stats, other_count = other
+    rows = []
+    for name in set(base_stats) | set(other_stats):
+        before = base_stats.get(name, (0, 0.0, 0.0))
+        after = other_stats.get(name, (0, 0.0, 0.0))
+        before = [value / base_count for value in before]
+        after = [value / other_count for value in after]
+        rows.append({
+            'function': name,
+            'calls': [before[0], after[0]],
+            'tottime_ms': [before[1] * 1000, after[1] * 1000],
+            'cumulative_ms': [before[2] * 1000, after[2] * 1000],
+            'delta_ms': (after[index] - before[index]) * (1 if index == 0 else 1000),
+        })
+    rows.sort(key=lambda row: abs(row['delta_ms']), reverse=True)
+    return rows[:limit]
+
+
+def get_store():
+    """Return the profile store configured in settings"""
+    config = get_config()
+    return ProfileStore(config['DIRECTORY'], config['MAX_BYTES'], config['ROTATE_EVERY'])
+
+
+class ProfilingMiddleware:
+    """Profiles SAMPLE_RATE of requests & any request with a signed X-Profile header
+
+    Unsampled requests cost one random() call and a header lookup. Disabled
+    (PROFILE_API_PROFILING['ENABLED'] off) the middleware isn't loaded.
+    """
+
+    def __init__(self, get_response):
+        config = get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = config['SAMPLE_RATE']
+        self.header_max_age = config['HEADER_MAX_AGE']
+        self.store = get_store()
+
+    def should_profile(self, request):
+        """Return True if this request is sampled or asks for a profile"""
+        if is_warmup(request):
+            return False
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        value = request.META.get(HEADER)
+        return value is not None and check_header_value(value, self.header_max_age)
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active in this thread
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - started
+        path = self.store.save(get_url_name(request), profiler, duration, response.status_code)
+        response['X-Profile-Id'] = '/'.join(path.split(os.sep)[-2:])
+        return response
@@ -0,0 +1,125 @@
+# Fast read path for ModelSerializers (app_name/readers.py)
+# Builds list/retrieve output straight from values_list() rows instead of
+# model instances walked through every DRF field. The output is the same as
+# serializer.data, fields that can't be reproduced exactly disable it.
+
+from rest_framework import serializers
+from rest_framework.settings import ISO_8601, api_settings
+
+# Compiled (names, sources) per serializer class & field set
+_plans = {}
+
+
+def _identity_column(values):
+    """Values DRF outputs unchanged"""
+    return values
+
+
+def _str_column(values):
+    """CharField/EmailField output"""
+    return [None if value is None else str(value) for value in values]
+
+
+def _int_column(values):
+    """IntegerField output"""
+    return [None if value is None else int(value) for value in values]
+
+
+def _bool_column(values):
+    """BooleanField output"""
+    return [None if value is None else bool(value) for value in values]
+
+
+def _datetime_column(field):
+    """Return a column converter matching DateTimeField.to_representation
+
+    The output format & timezone are resolved once per request instead of
+    once per value.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None:
+        return _identity_column
+    field_timezone = getattr(field, 'timezone', field.default_timezone())
+    iso_8601 = output_format.lower() == ISO_8601
+
+    def convert(values):
+        converted = []
+        for value in values:
+            if value is None:
+                converted.append(None)
+            elif field_timezone is None or value.tzinfo is None or isinstance(value, str):
+                # Naive datetimes & strings, rare, let DRF handle them
+                converted.append(field.to_representation(value))
+            elif iso_8601:
+                value = value.astimezone(field_timezone).isoformat()
+                if value.endswith('+00:00'):
+                    value = value[:-6] + 'Z'
+                converted.append(value)
+            else:
+                converted.append(value.astimezone(field_timezone).strftime(output_format))
+        return converted
+    return convert
+
+
+def _column_converter(field):
+    """Return the column converter for a serializer field, None if unsupported"""
+    field_type = type(field)
+    if field_type is serializers.PrimaryKeyRelatedField and field.pk_field is None:
+        # values_list() already returns the related object's pk
+        return _identity_column
+    if field_type is serializers.IntegerField:
+        return _int_column
+    if field_type in (serializers.CharField, serializers.EmailField):
+        return _str_column
+    if field_type is serializers.BooleanField:
+        return _bool_column
+    if field_type is serializers.DateTimeField:
+        return _datetime_column(field)
+    return None
+
+
+class FastReader:
+    """Converts values_list(named=True) rows into serializer output"""
+
+    def __init__(self, names, sources, converters):
+        self.names = names
+        self.sources = sources
+        self.converters = converters
+
+    def convert(self, rows):
+        """Return the serialized representation of a list of rows"""
+        rows = list(rows)
+        # Convert column by column, then zip the columns back into rows
+        columns = [
+            converter([getattr(row, source) for row in rows])
+            for source, converter in zip(self.sources, self.converters)
+        ]
+        names = self.names
+        return [dict(zip(names, values)) for values in zip(*columns)] if columns else [{} for _ in rows]
+
+    def convert_one(self, row):
+        """Return the serialized representation of a single row"""
+        return self.convert([row])[0]
+
+
+def get_fast_reader(serializer):
+    """Return a FastReader for the serializer's readable fields or None if unsupported"""
+    fields = [field for field in serializer.fields.values() if not field.write_only]
+    # Field types too: an expanded relation keeps its name (?expand=)
+    key = (type(serializer), tuple((field.field_name, type(field)) for field in fields))
+    plan = _plans.get(key)
+    if plan is None:
+        supported = all(
+            '.' not in field.source and field.source != '*' and _column_converter(field) is not None
+            for field in fields
+        )
+        plan = (
+            tuple(field.field_name for field in fields),
+            tuple(field.source for field in fields),
+        ) if supported else False
+        _plans[key] = plan
+    if not plan:
+        return None
+    names, sources = plan
+    # Converters are built per call, they capture the request's timezone
+    return FastReader(names, sources, [_column_converter(field) for field in fields])
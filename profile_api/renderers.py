@@ -0,0 +1,76 @@
+# Response renderers (app_name/renderers.py)
+
+import json
+
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+
+def dumps(data):
+    """Encode data the same way DRF's JSONRenderer does (compact, unicode)"""
+    return json.dumps(
+        data,
+        cls=encoders.JSONEncoder,
+        ensure_ascii=False,
+        separators=(',', ':'),
+    )
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """Renders newline delimited JSON, one object per line"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render a list as one line per item, anything else as a single line"""
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(dumps(row) + '\n' for row in rows).encode('utf-8')
+
+
+class PrometheusRenderer(renderers.BaseRenderer):
+    """Renders the Prometheus text exposition format (data is already text)"""
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Return the text as bytes, errors (dicts) as plain key: value lines"""
+        if isinstance(data, dict):
+            data = ''.join('%s: %s\n' % item for item in data.items())
+        return data.encode(self.charset)
+
+
+def to_columnar(rows):
+    """Return {"fields": [...], "rows": [[...], ...]} of a list of dicts
+
+    The keys are those of the first row, rows missing one get null.
+    """
+    if not rows or not isinstance(rows[0], dict):
+        return {'fields': [], 'rows': rows}
+    fields = list(rows[0])
+    return {'fields': fields, 'rows': [[row.get(field) for field in fields] for row in rows]}
+
+
+class ColumnarRenderer(renderers.BaseRenderer):
+    """Renders lists as one key list followed by one value array per row
+
+    List pages keep their count/next/previous, `results` becomes
+    {"fields": [...], "rows": [[...], ...]}. Single objects & errors are
+    rendered as plain JSON.
+    """
+    media_type = 'application/vnd.profiles.columnar+json'
+    format = 'columnar'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render data as UTF-8 JSON, lists in columnar form"""
+        if data is None:
+            return b''
+        if isinstance(data, list):
+            data = to_columnar(data)
+        elif isinstance(data, dict) and isinstance(data.get('results'), list):
+            data = dict(data, results=to_columnar(data['results']))
+        return dumps(data).encode('utf-8')
@@ -0,0 +1,171 @@
+# Full text search backend for user profiles (app_name/search.py)
+# On SQLite an FTS5 trigram index over name/email narrows down the rows a
+# search has to look at, other databases use DRF's SearchFilter unchanged.
+
+from django.conf import settings
+from django.db import OperationalError, connections
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+FTS_TABLE = 'profile_api_userprofile_fts'
+CONTENT_TABLE = 'profile_api_userprofile'
+FTS_COLUMNS = ('name', 'email')
+
+# Trigram tokenizer: case-insensitive substring (and so prefix) matching,
+# the same semantics as the icontains lookups SearchFilter generates
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+    "name, email, content='{content}', content_rowid='id', tokenize='trigram')"
+)
+CREATE_TRIGGERS_SQL = (
+    "CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {content} BEGIN "
+    "INSERT INTO {fts}(rowid, name, email) VALUES (new.id, new.name, new.email); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {content} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, name, email) VALUES ('delete', old.id, old.name, old.email); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF name, email ON {content} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, name, email) VALUES ('delete', old.id, old.name, old.email); "
+    "INSERT INTO {fts}(rowid, name, email) VALUES (new.id, new.name, new.email); "
+    "END",
+)
+TRIGGER_NAMES = ('{fts}_ai', '{fts}_ad', '{fts}_au')
+
+# Trigrams can't match terms shorter than 3 characters
+MIN_TERM_LENGTH = 3
+
+# Connection aliases known to have the FTS index, reset after migrate
+_available = {}
+
+
+def _sql(statement):
+    """Fill in the table names of an SQL template"""
+    return statement.format(fts=FTS_TABLE, content=CONTENT_TABLE)
+
+
+def _existing(cursor, kind, names):
+    """Return which of names exist in sqlite_master as kind (table/trigger)"""
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = %s AND name IN (%s)"
+        % ('%s', ', '.join(['%s'] * len(names))),
+        [kind] + list(names),
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def install(connection):
+    """Create the FTS table & sync triggers if missing, returns False if unsupported
+
+    Rebuilds the index whenever a trigger was missing, e.g. after a migration
+    remade the profile table (SQLite drops the triggers with the old table).
+    """
+    _available.pop(connection.alias, None)
+    if connection.vendor != 'sqlite':
+        return False
+    trigger_names = [_sql(name) for name in TRIGGER_NAMES]
+    with connection.cursor() as cursor:
+        if not _existing(cursor, 'table', [CONTENT_TABLE]):
+            return False
+        try:
+            cursor.execute(_sql(CREATE_TABLE_SQL))
+        except OperationalError:
+            # SQLite built without FTS5 or the trigram tokenizer (< 3.34)
+            return False
+        missing = set(trigger_names) - _existing(cursor, 'trigger', trigger_names)
+        for statement in CREATE_TRIGGERS_SQL:
+            cursor.execute(_sql(statement))
+        if missing:
+            rebuild(connection)
+    return True
+
+
+def uninstall(connection):
+    """Drop the FTS table & its triggers"""
+    _available.pop(connection.alias, None)
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name in TRIGGER_NAMES:
+            cursor.execute('DROP TRIGGER IF EXISTS %s' % _sql(name))
+        cursor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+
+
+def rebuild(connection):
+    """Rebuild the FTS index from the profile table"""
+    with connection.cursor() as cursor:
+        cursor.execute(_sql("INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+
+def is_available(connection):
+    """Return True if the FTS index exists on this connection"""
+    if connection.alias not in _available:
+        available = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                available = bool(_existing(cursor, 'table', [FTS_TABLE]))
+        _available[connection.alias] = available
+    return _available[connection.alias]
+
+
+def match_expression(terms):
+    """Build an FTS5 query requiring every term (as a quoted substring)"""
+    return ' AND '.join('"%s"' % term.replace('"', '""') for term in terms)
+
+
+class MatchingRows(RawSQL):
+    """RawSQL subquery for the right-hand side of __in
+
+    RawSQL wraps itself in parentheses and __in adds a second pair, which
+    SQLite reads as a one value list.
+    """
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
+
+
+def restrict_to_matches(queryset, match):
+    """Restrict a profile queryset to the rows the FTS index matches"""
+    # A lookup rather than extra(): its column follows the table's alias
+    # when the queryset is used as a subquery
+    return queryset.filter(pk__in=MatchingRows(
+        'SELECT rowid FROM {fts} WHERE {fts} MATCH %s'.format(fts=FTS_TABLE), [match],
+    ))
+
+
+class ProfileSearchFilter(filters.SearchFilter):
+    """SearchFilter that uses the FTS5 index on SQLite
+
+    Results are the same rows as SearchFilter's (the icontains filter is
+    still applied, the index only narrows the candidates down), ordered by
+    relevance (bm25) when PROFILE_API_SEARCH_RANKED is enabled. Falls back
+    to plain SearchFilter when the index isn't available, the search fields
+    aren't indexed or every term is too short for trigrams.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        """Filter the queryset by the ?search= terms"""
+        filtered = super().filter_queryset(request, queryset, view)
+        search_terms = [
+            term for term in self.get_search_terms(request)
+            if len(term) >= MIN_TERM_LENGTH
+        ]
+        search_fields = getattr(view, 'search_fields', None) or ()
+        if (
+            not search_terms
+            or queryset.model._meta.db_table != CONTENT_TABLE
+            # Prefixed fields ('^', '=', '@', '$') use other lookups than icontains
+            or not set(search_fields) <= set(FTS_COLUMNS)
+            or not is_available(connections[queryset.db])
+        ):
+            return filtered
+
+        match = match_expression(search_terms)
+        filtered = restrict_to_matches(filtered, match)
+        if getattr(settings, 'PROFILE_API_SEARCH_RANKED', True):
+            filtered = filtered.annotate(search_rank=RawSQL(
+                'SELECT bm25({fts}) FROM {fts} WHERE {fts} MATCH %s AND rowid = {content}.id'.format(
+                    fts=FTS_TABLE, content=CONTENT_TABLE,
+                ),
+                [match],
+            )).order_by('search_rank', 'pk')
+        return filtered
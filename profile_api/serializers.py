@@ -9,7 +9,26 @@ class HelloSerializer(serializers.Serializer):
     # Define fields to accept & validate
     name = serializers.CharField(max_length=10)
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class SparseFieldsSerializerMixin:
+    """Keeps only the requested fields & embeds the expanded relations
+
+    The view passes the ?fields= names & ?expand= relations through the
+    serializer context (mixins.SparseFieldsMixin).
+    """
+    # Relation field name -> serializer embedded in place of the pk on ?expand=
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        for name in self.context.get('expand', ()):
+            if name in self.fields:
+                self.fields[name] = self.expandable_fields[name](read_only=True)
+
+class UserProfileSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     """Serializes a user profile object"""
 
     # Config to point to model in project
@@ -47,8 +66,29 @@ class UserProfileSerializer(serializers.ModelSerializer):
         
         return super().update(instance, validated_data)
 
-class ProfileFeedItemSerializer(serializers.ModelSerializer):
+class UserProfileBulkSerializer(UserProfileSerializer):
+    """Validates user profiles for bulk creation
+
+    Email uniqueness is checked once per batch by the view instead of one
+    query per row by the field's UniqueValidator.
+    """
+
+    class Meta(UserProfileSerializer.Meta):
+        extra_kwargs = dict(
+            UserProfileSerializer.Meta.extra_kwargs,
+            email={'validators': []},
+        )
+
+class ProfileAuthorSerializer(serializers.ModelSerializer):
+    """Serializes the author of a feed item (?expand=user_profile)"""
+
+    class Meta:
+        model = models.UserProfile
+        fields = ('id', 'name', 'email')
+
+class ProfileFeedItemSerializer(SparseFieldsSerializerMixin, serializers.ModelSerializer):
     """Serializes profile feed items"""
+    expandable_fields = {'user_profile': ProfileAuthorSerializer}
 
     class Meta:
         # Define model for this serializer
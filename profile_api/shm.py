@@ -0,0 +1,186 @@
+# Shared-memory tables visible to every worker process (app_name/shm.py)
+# A SharedTable is a fixed-size open-addressing hash table of string keys to
+# rows of float64 values, stored in an mmap'd file. uWSGI/gunicorn workers
+# map the same file, so a value written by one worker is read by all of
+# them without a network service. Writers hold an flock() on the file
+# (plus a thread lock, flock doesn't exclude threads sharing a descriptor).
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import weakref
+import zlib
+from contextlib import contextmanager
+
+MAGIC = b'PAPISHM1'
+# magic, number of slots, values per slot
+HEADER = struct.Struct('<8sII')
+KEY_BYTES = 96
+
+# (directory, directory its tables were moved to) once relocate() ran
+_relocation = None
+# Every table of the process, for relocate()
+_tables = weakref.WeakSet()
+
+
+class TableFull(Exception):
+    """Raised when a new key doesn't fit in the table"""
+
+
+class SharedTable:
+    """Fixed-size hash table of str -> tuple of `width` floats in a shared file
+
+    Read & write it inside `with table.locked():`, the methods ending in
+    _locked expect the lock to be held. Files are created on first use and
+    (re)opened after a fork, so each process has its own descriptor.
+    """
+
+    def __init__(self, path, slots=4096, width=1):
+        self.path = _relocated(path)
+        self.slots = slots
+        self.width = width
+        self.row = struct.Struct('<%ds%dd' % (KEY_BYTES, width))
+        self._thread_lock = threading.RLock()
+        self._pid = None
+        self._file = None
+        self._map = None
+        _tables.add(self)
+
+    def _open(self):
+        """Map the file, creating it (zero filled) if needed"""
+        if self._pid == os.getpid():
+            return
+        if self._file is not None:
+            # Inherited from the parent process, which keeps its own
+            self._map.close()
+            os.close(self._file)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        size = HEADER.size + self.slots * self.row.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(fd, HEADER.size, 0)
+            if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, self.slots, self.width):
+                # New file or a different layout: start over
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, HEADER.pack(MAGIC, self.slots, self.width), 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._file = fd
+        self._map = mmap.mmap(fd, size)
+        self._pid = os.getpid()
+
+    def _move(self, path):
+        """Use the file at path from now on (it's opened on next use)"""
+        with self._thread_lock:
+            if self._file is not None:
+                self._map.close()
+                os.close(self._file)
+            self.path = path
+            self._pid = self._file = self._map = None
+
+    @contextmanager
+    def locked(self):
+        """Hold the table's lock across processes & threads"""
+        with self._thread_lock:
+            self._open()
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _find_locked(self, key, insert):
+        """Return the offset of key's slot, None if absent (and not inserted)"""
+        encoded = key.encode('utf-8')
+        if len(encoded) > KEY_BYTES or b'\0' in encoded:
+            raise ValueError('Invalid shared table key %r' % key)
+        padded = encoded.ljust(KEY_BYTES, b'\0')
+        start = zlib.crc32(encoded) % self.slots
+        for probe in range(self.slots):
+            offset = HEADER.size + ((start + probe) % self.slots) * self.row.size
+            stored = self._map[offset:offset + KEY_BYTES]
+            if stored == padded:
+                return offset
+            if stored[0] == 0:
+                if not insert:
+                    return None
+                self._map[offset:offset + KEY_BYTES] = padded
+                return offset
+        if insert:
+            raise TableFull(self.path)
+        return None
+
+    def get_locked(self, key):
+        """Return key's values, None if the key was never written"""
+        offset = self._find_locked(key, insert=False)
+        if offset is None:
+            return None
+        return self.row.unpack_from(self._map, offset)[1:]
+
+    def set_locked(self, key, values):
+        """Store the values of key"""
+        offset = self._find_locked(key, insert=True)
+        self.row.pack_into(self._map, offset, key.encode('utf-8'), *values)
+
+    def add_locked(self, key, deltas):
+        """Add deltas to key's values (missing keys start at zero)
+
+        deltas is a sequence (from the first value on) or {index: delta}.
+        """
+        offset = self._find_locked(key, insert=True)
+        row = self.row.unpack_from(self._map, offset)
+        values = list(row[1:])
+        for index, delta in (deltas.items() if isinstance(deltas, dict) else enumerate(deltas)):
+            values[index] += delta
+        self.row.pack_into(self._map, offset, row[0], *values)
+
+    def add(self, key, *deltas):
+        """Add deltas to key's values under the lock"""
+        with self.locked():
+            self.add_locked(key, deltas)
+
+    def get(self, key):
+        """Return key's values under the lock"""
+        with self.locked():
+            return self.get_locked(key)
+
+    def items(self):
+        """Return every (key, values) of the table"""
+        items = []
+        with self.locked():
+            for slot in range(self.slots):
+                row = self.row.unpack_from(self._map, HEADER.size + slot * self.row.size)
+                if row[0][0] != 0:
+                    items.append((row[0].rstrip(b'\0').decode('utf-8'), row[1:]))
+        return items
+
+    def clear(self):
+        """Remove every key"""
+        with self.locked():
+            self._map[HEADER.size:] = bytes(len(self._map) - HEADER.size)
+
+
+def _relocated(path):
+    """Return the path of the table file at path once relocate() ran"""
+    if _relocation is None:
+        return path
+    directory, target = _relocation
+    if os.path.commonpath([directory, os.path.abspath(path)]) != directory:
+        return path
+    return os.path.join(target, os.path.relpath(os.path.abspath(path), directory))
+
+
+def relocate(directory, target):
+    """Move the tables in directory, existing & later ones, to files in target
+
+    manage.py test & benchmark_api use their own tables this way, instead of
+    clearing & filling the ones a running server's workers share.
+    """
+    global _relocation
+    _relocation = (os.path.abspath(directory), os.path.abspath(target))
+    for table in list(_tables):
+        table._move(_relocated(table.path))
@@ -0,0 +1,105 @@
+# Signal receivers keeping caches in sync with the database (app_name/signals.py)
+# Connected in ProfileApiConfig.ready() (app_name/apps.py)
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_migrate
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from profile_api import archive
+from profile_api import changes
+from profile_api import counters
+from profile_api import db
+from profile_api import models
+from profile_api import search
+from profile_api.authentication import token_cache
+from profile_api.caching import profile_responses
+
+
+# WAL, synchronous & busy_timeout on every new SQLite connection
+connection_created.connect(db.configure_connection)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def evict_token(sender, instance, using, **kwargs):
+    """Evict a token from the auth cache of every worker when it is deleted or re-issued
+
+    Once the change commits: a worker reading the old row before that would
+    cache it again under the new generation.
+    """
+    key = instance.key
+    transaction.on_commit(lambda: token_cache.delete(key), using=using)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def evict_user_tokens(sender, instance, created, using, **kwargs):
+    """Evict the tokens of a user whose profile (is_active, password, ...) changed"""
+    if created:
+        return
+    keys = list(Token.objects.using(using).filter(user_id=instance.pk).values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: token_cache.delete(*keys), using=using)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_profile_responses(sender, instance, using, **kwargs):
+    """Invalidate the cached list pages & detail response of a changed profile, once it commits"""
+    profile_responses.bump_on_commit('list', 'obj:%s' % instance.pk, using=using)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_save, sender=models.ProfileFeedItem)
+def count_created_row(sender, instance, created, raw=False, **kwargs):
+    """Count a new profile or feed item"""
+    if created and not raw:
+        counters.add(sender, 1)
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def count_deleted_row(sender, instance, **kwargs):
+    """Count a deleted profile"""
+    counters.add(sender, -1)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def record_cascaded_items(sender, instance, using, **kwargs):
+    """Tombstone & count the feed items a profile's delete cascades to, in bulk
+
+    Deleted feed items are recorded by the code deleting them, a post_delete
+    receiver on ProfileFeedItem would make Django load & signal every item
+    of the cascade instead of running one DELETE.
+    """
+    rows = models.ProfileFeedItem.objects.using(using).filter(user_profile_id=instance.pk)
+    changes.record_deletions(list(rows.values_list('pk', 'user_profile_id')), using)
+
+
+@receiver(post_save, sender=models.ProfileFeedItem)
+def notify_created_item(sender, instance, created, raw=False, **kwargs):
+    """Wake the feed's long polls once a new item commits"""
+    if created and not raw:
+        changes.notifier.notify_on_commit(kwargs.get('using'))
+
+
+@receiver(post_migrate)
+def ensure_search_index(sender, using, **kwargs):
+    """Re-create the FTS triggers a migration may have dropped with the profile table"""
+    if sender.name == 'profile_api':
+        search.install(connections[using])
+
+
+@receiver(pre_migrate)
+def drop_feed_history_view(sender, using, **kwargs):
+    """Drop the hot/archived feed view so migrations can rebuild its tables"""
+    if sender.name == 'profile_api':
+        archive.uninstall(connections[using])
+
+
+@receiver(post_migrate)
+def create_feed_history_view(sender, using, **kwargs):
+    """Re-create the hot/archived feed view after migrating"""
+    if sender.name == 'profile_api':
+        archive.install(connections[using])
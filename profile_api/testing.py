@@ -0,0 +1,95 @@
+# Test helpers (app_name/testing.py)
+
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.runner import DiscoverRunner
+
+from profile_api import shm
+from profile_api.middleware import QueryRecorder
+
+# Max number of queries per endpoint, (HTTP method, URL name) -> queries
+# Authenticated requests include the token lookup (cold token cache), lists
+# the conditional GET validators & the maintained row count, profile search
+# the FTS index check.
+# Creates & deletes include the row counter UPDATE run on commit
+# (profile_api/counters.py), which TestCase's rolled back transactions skip
+QUERY_BUDGETS = {
+    ('GET', 'hello-view'): 0,
+    ('POST', 'login'): 2,
+    # Filtered lists add the capped count (shared by the ETag & the page)
+    ('GET', 'profile-list'): 5,
+    ('POST', 'profile-list'): 3,
+    ('GET', 'profile-detail'): 2,
+    ('PATCH', 'profile-detail'): 4,
+    # Cascades to feed items (hot & archived), tokens, groups, permissions,
+    # admin log, each a single DELETE; the feed item ids are read once for
+    # their tombstones
+    ('DELETE', 'profile-detail'): 12,
+    ('GET', 'feed-list'): 4,
+    ('POST', 'feed-list'): 3,
+    ('GET', 'feed-detail'): 2,
+    ('PATCH', 'feed-detail'): 3,
+    # Includes the tombstone INSERT, and the SAVEPOINT pair of the delete's
+    # transaction (TestCase nests it in its own)
+    ('DELETE', 'feed-detail'): 6,
+    # New items & new tombstones since the sync token
+    ('GET', 'feed-changes'): 3,
+}
+
+
+class QueryBudgetMixin:
+    """TestCase mixin asserting endpoints stay within their query budget"""
+    query_budgets = QUERY_BUDGETS
+
+    @contextmanager
+    def assertQueryBudget(self, method, url_name):
+        """Fail if the block runs more queries than the endpoint's budget"""
+        budget = self.query_budgets[(method, url_name)]
+        # execute_wrapper based, unlike CaptureQueriesContext the test
+        # client's request_started/reset_queries doesn't interfere
+        recorder = QueryRecorder()
+        with recorder.record():
+            yield recorder
+        if recorder.count > budget:
+            statements = '\n'.join(
+                '%dx %s' % (count, sql) for (sql, _), count in recorder.statements.items()
+            )
+            self.fail('%s %s ran %d queries, budget is %d:\n%s' % (
+                method, url_name, recorder.count, budget, statements,
+            ))
+
+
+@contextmanager
+def run_on_commit(using=DEFAULT_DB_ALIAS):
+    """Run the on_commit callbacks registered within the block as it exits
+
+    As if the block committed: TestCase's transaction never does (Django
+    3.2's captureOnCommitCallbacks(execute=True)).
+    """
+    connection = connections[using]
+    start = len(connection.run_on_commit)
+    yield
+    callbacks = connection.run_on_commit[start:]
+    del connection.run_on_commit[start:]
+    for _, callback in callbacks:
+        callback()
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the tests against throwaway shared tables (profile_api/shm.py)
+
+    Tests clear & fill them, the ones of a running server's workers (in
+    PROFILE_API_SHM_DIRECTORY) are left alone.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.shm_directory = tempfile.TemporaryDirectory(prefix='profiles-api-test-')
+        shm.relocate(settings.PROFILE_API_SHM_DIRECTORY, self.shm_directory.name)
+
+    def teardown_test_environment(self, **kwargs):
+        super().teardown_test_environment(**kwargs)
+        self.shm_directory.cleanup()
@@ -1,3 +1,1345 @@
-from django.test import TestCase
+import cProfile
+import json
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import time
+import zlib
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.core.wsgi import get_wsgi_application
+from django.db import close_old_connections, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from profile_api import archive
+from profile_api import benchmark
+from profile_api import changes
+from profile_api import compression
+from profile_api import counters
+from profile_api import db
+from profile_api import hashing
+from profile_api import pagination
+from profile_api import profiling
+from profile_api import search
+from profile_api import shm
+from profile_api import warmup
+from profile_api.metrics import Metrics, metrics
+from profile_api.throttling import Admission, admission
+from profile_api import models
+from profile_api.authentication import TokenCache, token_cache
+from profile_api.caching import RESPONSE_CACHE_DEFAULTS, ResponseCache, SharedGenerations, profile_responses
+from profile_api.groupcommit import GroupCommitter
+from profile_api.middleware import QueryRecorder
+from profile_api.testing import QueryBudgetMixin, run_on_commit
+
+
+class FeedPaginationTests(TestCase):
+    """next & previous cursors walk the feed without repeating or skipping an item"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+        items = [models.ProfileFeedItem.objects.create(user_profile=cls.user, status_text=str(index))
+                 for index in range(9)]
+        # Ties on created_on, the cursor offsets among them
+        models.ProfileFeedItem.objects.filter(pk__in=[item.pk for item in items[2:6]]).update(
+            created_on=items[2].created_on,
+        )
+        cls.expected = list(
+            models.ProfileFeedItem.objects.order_by('-created_on', '-id').values_list('id', flat=True)
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, link):
+        """Follow the `link` of each page from url, returns the ids of every page"""
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append([item['id'] for item in data['results']])
+            url = data[link]
+        return pages
+
+    def test_next_and_previous(self):
+        pages = self.walk('/api/feed/?page_size=2', 'next')
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual(len(pages), 5)
+        # Back from the last page
+        last = self.client.get('/api/feed/?page_size=2').json()
+        while last['next']:
+            last = self.client.get(last['next']).json()
+        backwards = self.walk(last['previous'], 'previous')
+        self.assertEqual(sum(reversed(backwards), []), self.expected[:8])
+
+
+class TokenCacheTests(TransactionTestCase):
+    """Cached tokens are evicted in every worker once the token or its user changes"""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', 'secret-pw')
+        self.token = Token.objects.create(user=self.user)
+        token_cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def get(self):
+        return self.client.get('/api/feed/').status_code
+
+    def test_token_delete(self):
+        self.assertEqual(self.get(), 200)
+        self.assertIsNotNone(token_cache.get(self.token.key))
+        self.token.delete()
+        self.assertEqual(self.get(), 401)
+
+    def test_deactivation(self):
+        self.assertEqual(self.get(), 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get(), 401)
+
+    def test_password_change(self):
+        self.assertEqual(self.get(), 200)
+        self.user.set_password('other-pw')
+        self.user.save()
+        self.assertIsNone(token_cache.get(self.token.key))
+
+    def test_eviction_reaches_other_workers(self):
+        # Two workers: their own LRU, the same shared generations file
+        path = os.path.join(tempfile.mkdtemp(), 'token_generations')
+        workers = [TokenCache(100, 300, SharedGenerations(path, 16)) for _ in range(2)]
+        for worker in workers:
+            worker.set(self.token.key, (self.user, self.token), worker.generation(self.token.key))
+        workers[0].delete(self.token.key)
+        self.assertIsNone(workers[1].get(self.token.key))
+        self.assertEqual(workers[1].stats()['stale'], 1)
+
+
+class ReadWriteRoutingTests(TestCase):
+    """Safe requests read from the replica, except right after the client wrote"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.writers = db.RecentWriters(os.path.join(self.directory.name, 'db_pins'), buckets=64)
+        patcher = mock.patch.object(db, 'recent_writers', self.writers)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def request(self, method, status=200, token='a'):
+        """Send a request through the middleware, returns whether reads used the replica"""
+        seen = []
+
+        def view(request):
+            seen.append(db._state.use_replica)
+            return HttpResponse(status=status)
+
+        request = getattr(self.factory, method)('/api/profile/', HTTP_AUTHORIZATION='Token ' + token)
+        db.ReadWriteRoutingMiddleware(view)(request)
+        return seen[0]
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        self.assertTrue(self.request('get'))
+        self.assertFalse(self.request('post', status=400))
+        self.assertTrue(self.request('get'))
+        self.assertFalse(self.request('post', status=201))
+        self.assertFalse(self.request('get'))
+        self.assertTrue(self.request('get', token='b'))
+        with mock.patch('time.time', return_value=time.time() + 6):
+            self.assertTrue(self.request('get'))
+
+    def test_pins_are_seen_by_other_workers(self):
+        other = db.RecentWriters(self.writers.table.path, buckets=64)
+        self.request('delete', status=204)
+        self.assertTrue(other.is_pinned('Token a'))
+        self.assertFalse(other.is_pinned('Token b'))
+        # A shorter pin never cuts a longer one
+        other.pin('Token a', 60)
+        self.writers.pin('Token a', 1)
+        with mock.patch('time.time', return_value=time.time() + 30):
+            self.assertTrue(self.writers.is_pinned('Token a'))
+
+    def test_concurrent_deletes_wait_for_the_write_lock(self):
+        # Two primary connections to one WAL file: the first reads then
+        # deletes in a transaction (like the delete collector) while the
+        # second deletes & commits in between
+        path = os.path.join(self.directory.name, 'db.sqlite3')
+        first = connection.copy()
+        first.settings_dict['NAME'] = path
+        self.addCleanup(first.close)
+        with first.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+            cursor.execute('INSERT INTO item (id) VALUES (1), (2)')
+
+        def delete_second():
+            # Connections belong to the thread that made them
+            second = connection.copy()
+            second.settings_dict['NAME'] = path
+            with second.cursor() as cursor:
+                cursor.execute('DELETE FROM item WHERE id = 2')
+            second.close()
+
+        thread = threading.Thread(target=delete_second)
+        first.set_autocommit(False, force_begin_transaction_with_broken_autocommit=True)
+        with first.cursor() as cursor:
+            cursor.execute('SELECT id FROM item')
+            thread.start()
+            # The second connection waits for the write lock of the first
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            cursor.execute('DELETE FROM item WHERE id = 1')
+        first.commit()
+        first.set_autocommit(True)
+        thread.join()
+        with first.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM item')
+            self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class HashingPoolTests(TestCase):
+    """A saturated hashing pool sheds API requests, other callers hash inline"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', 'secret-pw')
+
+    def saturated_pool(self):
+        """Return a pool whose only slot is taken"""
+        pool = hashing.HashingPool(workers=0, max_queue=0, acquire_timeout=0, retry_after=7)
+        pool._slots.acquire()
+        return pool
+
+    def test_saturated_api_sheds_load(self):
+        admission.clear()
+        with mock.patch.object(hashing, 'pool', self.saturated_pool()):
+            response = self.client.post('/api/login/', {'username': 'ada@example.com', 'password': 'secret-pw'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '7')
+            self.assertEqual(hashing.pool.stats()['rejected'], 1)
+
+    def test_saturated_pool_hashes_inline_outside_the_api(self):
+        with mock.patch.object(hashing, 'pool', self.saturated_pool()):
+            # Django's authentication backend, as the admin login uses it
+            self.assertTrue(self.client.login(username='ada@example.com', password='secret-pw'))
+            self.assertTrue(self.user.check_password('secret-pw'))
+            self.assertEqual(hashing.pool.stats()['inline'], 2)
+
+    def test_broken_pool_is_rebuilt(self):
+        pool = hashing.HashingPool(workers=1, max_queue=1, acquire_timeout=1, retry_after=1)
+        first = pool.run(os.getpid)
+        os.kill(first, signal.SIGKILL)
+        second = pool.run(os.getpid)
+        self.assertNotEqual(first, second)
+        self.assertEqual(pool.stats()['restarts'], 1)
+        pool._executor.shutdown()
+
+    def test_pool_processes_are_not_forked(self):
+        # Forking a threaded worker can copy a lock another thread holds
+        pool = hashing.HashingPool(workers=1, max_queue=1, acquire_timeout=1, retry_after=1)
+        self.addCleanup(lambda: pool._executor.shutdown())
+        self.assertNotEqual(pool.run(os.getpid), os.getpid())
+        self.assertIn(pool._executor._mp_context.get_start_method(), ('forkserver', 'spawn'))
+
+    def test_stuck_job_times_out(self):
+        pool = hashing.HashingPool(workers=1, max_queue=1, acquire_timeout=1, retry_after=3)
+        self.addCleanup(lambda: pool._executor.shutdown())
+        # Started (and Django set up) in its process before the short timeout
+        pool.run(os.getpid)
+        pool.result_timeout = 0.05
+        with hashing.shedding_load():
+            with self.assertRaises(hashing.HashingPoolSaturated) as raised:
+                pool.run(time.sleep, 0.5)
+        self.assertEqual(raised.exception.wait, 3)
+        # Other callers run the job themselves (the process is still asleep)
+        self.assertEqual(pool.run(os.getpid), os.getpid())
+        stats = pool.stats()
+        self.assertEqual(stats['timeouts'], 2)
+        # The waiting requests gave their queue slots back
+        self.assertEqual(stats['in_flight'], 0)
+
+
+class BulkCreateTests(TestCase):
+    """POST /api/profile/bulk/ reports every row, whatever goes wrong with the others"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = models.UserProfile.objects.create_superuser('admin@example.com', 'Admin', 'pw')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def post(self, body, content_type='application/json'):
+        return self.client.post('/api/profile/bulk/', body, content_type=content_type)
+
+    def test_body_must_be_a_list(self):
+        for body in ('5', 'true', '"ada@example.com"', '{"email": "ada@example.com"}', 'null'):
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body).status_code, 400)
+
+    def test_row_errors_and_duplicates(self):
+        rows = [
+            {'email': 'ada@example.com', 'name': 'Ada', 'password': 'pw-1'},
+            {'email': 'ada@example.com', 'name': 'Ada again', 'password': 'pw-2'},
+            {'email': 'admin@example.com', 'name': 'Admin', 'password': 'pw-3'},
+            {'email': 'not an email', 'name': 'Bob', 'password': 'pw-4'},
+            5,
+        ]
+        response = self.post(json.dumps(rows))
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 4))
+        results = response.data['results']
+        self.assertEqual(results[0]['email'], 'ada@example.com')
+        self.assertEqual([list(result['errors']) for result in results[1:]],
+                         [['email'], ['email'], ['email'], ['non_field_errors']])
+        self.assertTrue(models.UserProfile.objects.get(email='ada@example.com').check_password('pw-1'))
+
+    def test_concurrent_duplicate_fails_its_row_only(self):
+        models.UserProfile.objects.create_user('bob@example.com', 'Bob', None)
+        rows = [{'email': email, 'name': 'User', 'password': 'pw'} for email in ('bob@example.com', 'cy@example.com')]
+        # As if bob@ was created by another request after the duplicate check
+        with mock.patch('profile_api.bulk.existing_emails', return_value=set()):
+            response = self.post(json.dumps(rows))
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(list(response.data['results'][0]['errors']), ['email'])
+        self.assertEqual(response.data['results'][1]['email'], 'cy@example.com')
+
+    def test_ndjson_body(self):
+        body = '{"email": "ada@example.com", "name": "Ada", "password": "pw"}\n\n{not json}\n'
+        response = self.post(body, 'application/x-ndjson')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['results'][0]['email'], 'ada@example.com')
+        self.assertIn('Line 3', str(response.data['results'][1]['errors']['non_field_errors'][0]))
+
+
+class FeedIngestTests(TestCase):
+    """NDJSON ingest reports bad & oversized lines, inserts the others"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def ingest(self, body):
+        return self.client.post('/api/feed/ingest/', body, content_type='application/x-ndjson')
+
+    def test_bad_lines(self):
+        body = '{"status_text": "One"}\n{not json}\n\xff\n{"status_text": ""}\n{"status_text": "Two"}'
+        response = self.ingest(body.encode('latin-1'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['received'], response.data['created'], response.data['failed']), (5, 2, 3))
+        errors = response.data['errors']
+        self.assertIn('Line 2: JSON parse error', str(errors[0]['errors']['non_field_errors'][0]))
+        self.assertIn('Line 3: JSON parse error', str(errors[1]['errors']['non_field_errors'][0]))
+        self.assertIn('status_text', errors[2]['errors'])
+        self.assertEqual(sorted(models.ProfileFeedItem.objects.values_list('status_text', flat=True)), ['One', 'Two'])
+
+    @override_settings(PROFILE_API_NDJSON_MAX_LINE_BYTES=32)
+    def test_oversized_lines(self):
+        lines = [
+            '{"status_text": "%s"}' % ('x' * 100),
+            '{"status_text": "%s"}' % ('y' * 13),  # exactly 32 bytes
+            '{"status_text": "%s"}' % ('z' * 14),
+        ]
+        response = self.ingest('\n'.join(lines) + '\n')
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 2))
+        details = [str(error['errors']['non_field_errors'][0]) for error in response.data['errors']]
+        self.assertEqual(details, ['Line 1: longer than 32 bytes', 'Line 3: longer than 32 bytes'])
+        self.assertEqual(models.ProfileFeedItem.objects.get().status_text, 'y' * 13)
+
+    def test_only_bad_lines(self):
+        response = self.ingest('nope\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['failed'], 1)
+
+
+class SearchTests(TestCase):
+    """The FTS5 index returns SearchFilter's rows & follows every write"""
+
+    @classmethod
+    def setUpTestData(cls):
+        for email, name in (
+            ('ada@example.com', 'Ada Lovelace'),
+            ('grace@example.org', 'Grace Hopper'),
+            ('alan@example.com', 'Alan Turing'),
+            ('LOVE@example.net', 'Édith Ünicode'),
+        ):
+            models.UserProfile.objects.create_user(email, name, None)
+
+    def search(self, backend, terms):
+        """Return the ids a filter backend keeps for ?search=terms"""
+        request = Request(APIRequestFactory().get('/api/profile/', {'search': terms}))
+        view = mock.Mock(search_fields=('name', 'email'))
+        return sorted(backend().filter_queryset(request, models.UserProfile.objects.all(), view)
+                      .values_list('id', flat=True))
+
+    def fts_ids(self, term):
+        """Return the ids the FTS index alone matches"""
+        queryset = search.restrict_to_matches(models.UserProfile.objects.all(), search.match_expression([term]))
+        return sorted(queryset.values_list('id', flat=True))
+
+    def test_same_rows_as_search_filter(self):
+        self.assertTrue(search.is_available(connection))
+        for terms in ('love', 'LOVE', 'example.com', 'ada lovelace', 'ing', 'ünic', 'al', 'nobody', 'a"b'):
+            with self.subTest(terms=terms):
+                self.assertEqual(self.search(search.ProfileSearchFilter, terms), self.search(SearchFilter, terms))
+        self.assertEqual(len(self.search(search.ProfileSearchFilter, 'love')), 2)
+
+    def test_triggers_follow_writes(self):
+        user = models.UserProfile.objects.create_user('new@example.com', 'Zebedee', None)
+        self.assertEqual(self.fts_ids('zebedee'), [user.id])
+        user.name = 'Xavier'
+        user.save()
+        self.assertEqual(self.fts_ids('zebedee'), [])
+        self.assertEqual(self.fts_ids('xavier'), [user.id])
+        models.UserProfile.objects.filter(pk=user.pk).update(email='renamed@example.com')
+        self.assertEqual((self.fts_ids('new@'), self.fts_ids('renamed@')), ([], [user.id]))
+        user.delete()
+        self.assertEqual(self.fts_ids('xavier'), [])
+
+
+@override_settings(PROFILE_API_RESPONSE_CACHE={'ENABLED': False})
+class ConditionalGetTests(TransactionTestCase):
+    """ETag/Last-Modified validators answer with a 304 & move with every write
+
+    Commits run their on_commit callbacks, so the row counters of the
+    unfiltered lists' ETags are kept up to date.
+    """
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+        self.item = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='Hi')
+        models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='Again')
+        # Last-Modified has whole seconds, make later saves land in another one
+        models.ProfileFeedItem.objects.update(updated_on=timezone.now() - timedelta(hours=1))
+        counters.reconcile()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = '/api/feed/%d/' % self.item.pk
+
+    def test_retrieve_not_modified(self):
+        response = self.client.get(self.url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((not_modified.status_code, not_modified['ETag']), (304, etag))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+        earlier = 'Mon, 01 Jan 2001 00:00:00 GMT'
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=earlier).status_code, 200)
+        # Each representation has its own ETag
+        self.assertNotEqual(self.client.get(self.url, HTTP_ACCEPT='text/html')['ETag'], etag)
+
+    def test_retrieve_validators_move_on_update_and_delete(self):
+        response = self.client.get(self.url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.patch(self.url, {'status_text': 'Edited'}).status_code, 200)
+        for headers in ({'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_MODIFIED_SINCE': last_modified}):
+            response = self.client.get(self.url, **headers)
+            self.assertEqual(response.status_code, 200, headers)
+            self.assertEqual(response.data['status_text'], 'Edited')
+            self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+    def test_list_validators_move_on_create_update_and_delete(self):
+        # The whole feed (maintained row count) & a user's items (counted)
+        urls = ('/api/feed/', '/api/feed/?user=%d' % self.user.pk)
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        self.assertNotIn('Last-Modified', self.client.get(urls[0]))
+        for url in urls:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code, 304)
+        seen = set(etags.values())
+        for write in (
+            lambda: self.client.post('/api/feed/', {'status_text': 'New'}),
+            lambda: self.client.patch(self.url, {'status_text': 'Edited'}),
+            # Deleting an older row doesn't move the max version, the count does
+            lambda: self.client.delete(self.url),
+        ):
+            self.assertLess(write().status_code, 300)
+            for url in urls:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, 200, url)
+                etags[url] = response['ETag']
+                self.assertNotIn(etags[url], seen)
+                seen.add(etags[url])
+
+    def test_search_list_validators(self):
+        bob = models.UserProfile.objects.create_user('bob@example.com', 'Bob', None)
+        url = '/api/profile/?search=bob'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        models.UserProfile.objects.filter(pk=bob.pk).update(
+            name='Bobby', updated_on=timezone.now() + timedelta(hours=1),
+        )
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_validators_skip_table_scans(self):
+        recorder = QueryRecorder()
+        with recorder.record():
+            self.client.get('/api/feed/')
+        statements = [sql for sql, _ in recorder.statements]
+        self.assertFalse([sql for sql in statements if 'COUNT(' in sql or 'MAX(' in sql])
+        self.assertIn('profile_api_rowcount', ' '.join(statements))
+
+
+@override_settings(PROFILE_API_RESPONSE_CACHE={'ENABLED': False})
+class FastReadTests(TestCase):
+    """The values_list() read path must render exactly what the serializers do"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada Lovelace', None)
+        other = models.UserProfile.objects.create_user('bob@example.com', 'Bob Ünicode', None)
+        for index in range(5):
+            models.ProfileFeedItem.objects.create(
+                user_profile=cls.user if index % 2 else other,
+                status_text='Status "%d" ✓' % index,
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_both(self, url):
+        """Return the response bodies of the serializer & fast read paths"""
+        bodies = []
+        for fast_reads in (False, True):
+            with override_settings(PROFILE_API_FAST_READS=fast_reads):
+                response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 200)
+            bodies.append(response.content)
+        return bodies
+
+    def test_output_is_byte_identical(self):
+        """List (paginated, filtered, searched) & retrieve output match"""
+        item = models.ProfileFeedItem.objects.first()
+        urls = [
+            '/api/feed/',
+            '/api/feed/?page_size=2',
+            '/api/feed/?user=%d' % self.user.pk,
+            '/api/feed/%d/' % item.pk,
+            '/api/profile/',
+            '/api/profile/?search=example',
+            '/api/profile/%d/' % self.user.pk,
+            '/api/feed/?fields=id,status_text',
+            '/api/feed/?expand=user_profile',
+            '/api/profile/?fields=name',
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                serializer_body, fast_body = self.get_both(url)
+                self.assertEqual(serializer_body, fast_body)
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_datetimes_use_current_timezone(self):
+        """Datetimes are converted to the current timezone like DateTimeField"""
+        serializer_body, fast_body = self.get_both('/api/feed/')
+        self.assertTrue(b'-04:00' in serializer_body or b'-05:00' in serializer_body)
+        self.assertEqual(serializer_body, fast_body)
+
+    def test_next_page_cursor_matches(self):
+        """The second page (reached through the fast path's cursor) matches"""
+        with override_settings(PROFILE_API_FAST_READS=True):
+            next_url = self.client.get('/api/feed/?page_size=2').json()['next']
+        serializer_body, fast_body = self.get_both(next_url)
+        self.assertEqual(serializer_body, fast_body)
+
+
+@override_settings(PROFILE_API_RESPONSE_CACHE={'ENABLED': False})
+class SparseFieldsTests(TestCase):
+    """?fields= loads only the requested columns, ?expand= joins the author"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+        cls.item = models.ProfileFeedItem.objects.create(user_profile=cls.user, status_text='Hi')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, url):
+        """Return the response & the SQL of the query loading the rows"""
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        selects = [sql for sql, _ in recorder.statements if sql.startswith('SELECT') and '"status_text"' in sql]
+        self.assertEqual(len(selects), 1)
+        return response, selects[0]
+
+    def test_fields_load_only_their_columns(self):
+        for url in ('/api/feed/?fields=id,created_on', '/api/feed/%d/?fields=created_on' % self.item.pk):
+            with self.subTest(url=url):
+                response, sql = self.get(url.replace('created_on', 'status_text'))
+                self.assertNotIn('"user_profile_id"', sql)
+                self.assertNotIn('profile_api_userprofile', sql)
+        response = self.client.get('/api/profile/%d/?fields=name' % self.user.pk)
+        self.assertEqual(response.data, {'name': 'Ada'})
+
+    def test_expand_embeds_author_in_one_query(self):
+        response, sql = self.get('/api/feed/?fields=id,status_text,user_profile&expand=user_profile')
+        self.assertEqual(response.data['results'][0], {
+            'id': self.item.pk,
+            'user_profile': {'id': self.user.pk, 'name': 'Ada', 'email': 'ada@example.com'},
+            'status_text': 'Hi',
+        })
+        self.assertIn('JOIN "profile_api_userprofile"', sql)
+        self.assertNotIn('"password"', sql)
+
+    def test_expanded_author_change_moves_validators(self):
+        for url in ('/api/feed/?expand=user_profile', '/api/feed/%d/?expand=user_profile' % self.item.pk):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+                models.UserProfile.objects.filter(pk=self.user.pk).update(
+                    name='Ada L.', updated_on=timezone.now() + timedelta(seconds=1),
+                )
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Ada L.', response.content.decode('utf-8'))
+                self.user.refresh_from_db()
+
+    def test_unknown_fields_are_rejected(self):
+        for url in ('/api/feed/?fields=nope', '/api/profile/?fields=password', '/api/profile/?expand=user_profile'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 400)
+
+
+@override_settings(PROFILE_API_RESPONSE_CACHE={'ENABLED': False})
+class ExportTests(TestCase):
+    """Exports stream every row as NDJSON or a JSON array, ?since= filters them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+        cls.items = [models.ProfileFeedItem.objects.create(user_profile=cls.user, status_text='Status %d' % index)
+                     for index in range(5)]
+        # Two items from last year
+        models.ProfileFeedItem.objects.filter(pk__in=[item.pk for item in cls.items[:2]]).update(
+            created_on=timezone.now() - timedelta(days=365),
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, url, **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response
+
+    def test_ndjson_by_default(self):
+        response = self.export('/api/feed/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="feed.ndjson"')
+        chunks = list(response.streaming_content)
+        # One chunk per row, in pk order
+        self.assertEqual(len(chunks), 5)
+        rows = [json.loads(chunk.decode('utf-8')) for chunk in chunks]
+        self.assertEqual([row['id'] for row in rows], [item.pk for item in self.items])
+        self.assertEqual(set(rows[0]), {'id', 'user_profile', 'status_text', 'created_on'})
+
+    def test_json_array(self):
+        response = self.export('/api/feed/export/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="feed.json"')
+        rows = json.loads(response.getvalue().decode('utf-8'))
+        self.assertEqual([row['status_text'] for row in rows], ['Status %d' % index for index in range(5)])
+        empty = self.export('/api/feed/export/?since=9999-12-31', HTTP_ACCEPT='application/json')
+        self.assertEqual(empty.getvalue(), b'[]')
+
+    def test_rows_are_read_while_streaming(self):
+        def item_selects(recorder):
+            return [sql for sql, _ in recorder.statements if 'FROM "profile_api_profilefeeditem"' in sql]
+
+        before, during = QueryRecorder(), QueryRecorder()
+        with before.record():
+            response = self.export('/api/feed/export/')
+        with during.record():
+            content = response.getvalue()
+        self.assertEqual((len(item_selects(before)), len(item_selects(during))), (0, 1))
+        self.assertEqual(content.count(b'\n'), 5)
+
+    def test_since(self):
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        rows = self.export('/api/feed/export/?since=' + since).getvalue().splitlines()
+        self.assertEqual([json.loads(row)['id'] for row in rows], [item.pk for item in self.items[2:]])
+        rows = self.export('/api/feed/export/?since=2000-01-01T00:00:00').getvalue().splitlines()
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(self.client.get('/api/feed/export/?since=yesterday').status_code, 400)
+        # Profiles filter on updated_on
+        models.UserProfile.objects.create_user('bob@example.com', 'Bob', None)
+        models.UserProfile.objects.filter(email='ada@example.com').update(
+            updated_on=timezone.now() - timedelta(days=365),
+        )
+        rows = self.export('/api/profile/export/?since=' + since).getvalue().splitlines()
+        self.assertEqual([json.loads(row)['email'] for row in rows], ['bob@example.com'])
+
+
+class EncodingTests(TestCase):
+    """Columnar lists & gzip/deflate negotiated by Accept-Encoding"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+        for index in range(20):
+            models.ProfileFeedItem.objects.create(user_profile=cls.user, status_text='Status %d' % index)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_columnar_list(self):
+        plain = self.client.get('/api/feed/', HTTP_ACCEPT='application/json').json()
+        response = self.client.get('/api/feed/', HTTP_ACCEPT='application/vnd.profiles.columnar+json')
+        results = response.json()['results']
+        self.assertEqual(results['fields'], ['id', 'user_profile', 'status_text', 'created_on'])
+        self.assertEqual([dict(zip(results['fields'], row)) for row in results['rows']], plain['results'])
+
+    def test_choose_encoding(self):
+        self.assertEqual(compression.choose_encoding('gzip, deflate, br'), 'gzip')
+        self.assertEqual(compression.choose_encoding('gzip;q=0.5, deflate'), 'deflate')
+        self.assertEqual(compression.choose_encoding('*;q=0.1'), 'gzip')
+        self.assertIsNone(compression.choose_encoding('br, gzip;q=0'))
+
+    def test_compressed_responses(self):
+        plain = self.client.get('/api/feed/export/').getvalue()
+        for encoding, wbits in (('gzip', 16 + zlib.MAX_WBITS), ('deflate', zlib.MAX_WBITS)):
+            for url in ('/api/feed/', '/api/feed/export/'):
+                with self.subTest(encoding=encoding, url=url):
+                    response = self.client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+                    self.assertEqual(response['Content-Encoding'], encoding)
+                    self.assertIn('Accept-Encoding', response['Vary'])
+                    content = zlib.decompress(response.getvalue(), wbits)
+                    if response.streaming:
+                        self.assertEqual(content, plain)
+                    else:
+                        self.assertEqual(len(json.loads(content.decode('utf-8'))['results']), 20)
+
+
+class ResponseCacheTests(TestCase):
+    """Profile reads come from the response cache until a profile changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+
+    def get(self, url, **headers):
+        """GET url as JSON, returns (response, number of queries)"""
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = self.client.get(url, HTTP_ACCEPT='application/json', **headers)
+        return response, recorder.count
+
+    def test_hits_and_invalidation(self):
+        url = '/api/profile/%d/' % self.user.pk
+        for path in (url, '/api/profile/'):
+            with self.subTest(path=path):
+                first, _ = self.get(path)
+                second, queries = self.get(path)
+                self.assertEqual(queries, 0)
+                self.assertEqual(first.content, second.content)
+                not_modified, queries = self.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+                self.assertEqual((not_modified.status_code, queries), (304, 0))
+
+        self.user.name = 'Ada L.'
+        with run_on_commit():
+            self.user.save()
+            # Not before the commit: other workers would cache the old row again
+            self.assertEqual(self.get(url)[1], 0)
+        self.assertEqual(self.get(url)[0].json()['name'], 'Ada L.')
+        self.assertEqual(self.get('/api/profile/')[0].json()['results'][0]['name'], 'Ada L.')
+        self.assertGreater(profile_responses.stats()['hit_ratio'], 0)
+
+    def test_bulk_create_invalidates_lists_on_commit(self):
+        admin = models.UserProfile.objects.create_superuser('admin@example.com', 'Admin', 'pw')
+        client = APIClient()
+        client.force_authenticate(admin)
+        before = profile_responses.generation('list')
+        rows = json.dumps([{'email': 'bob@example.com', 'name': 'Bob', 'password': 'pw'}])
+        with run_on_commit():
+            response = client.post('/api/profile/bulk/', rows, content_type='application/json')
+            self.assertEqual(response.data['created'], 1)
+            self.assertEqual(profile_responses.generation('list'), before)
+        self.assertGreater(profile_responses.generation('list'), before)
+
+    def test_padded_pk_shares_the_scope(self):
+        url = '/api/profile/0%d/' % self.user.pk
+        self.assertEqual(self.get(url)[0].json()['name'], 'Ada')
+        self.assertEqual(self.get(url)[1], 0)
+        self.user.name = 'Ada L.'
+        with run_on_commit():
+            self.user.save()
+        self.assertEqual(self.get(url)[0].json()['name'], 'Ada L.')
+        # Not a pk: not cached, the lookup answers
+        self.assertEqual(self.get('/api/profile/ada/')[0].status_code, 404)
+
+    def test_bump_reaches_other_workers(self):
+        # Two workers: their own (LocMem) shared tier, the same generations file
+        config = dict(
+            RESPONSE_CACHE_DEFAULTS,
+            GENERATIONS_PATH=os.path.join(tempfile.mkdtemp(), 'response_generations'),
+            GENERATION_ROWS=16,
+        )
+        locmem = 'django.core.cache.backends.locmem.LocMemCache'
+        with override_settings(CACHES={alias: {'BACKEND': locmem, 'LOCATION': alias} for alias in ('default', 'a', 'b')}):
+            workers = [ResponseCache('profiles', dict(config, CACHE=alias)) for alias in ('a', 'b')]
+            for worker in workers:
+                worker.get_or_render(worker.make_key('obj:1', 'url'), lambda: ((b'old',), True))
+            workers[0].bump('obj:1')
+            entry = workers[1].get_or_render(workers[1].make_key('obj:1', 'url'), lambda: ((b'new',), True))
+        self.assertEqual(entry, (b'new',))
+
+
+class ArchiveTests(TestCase):
+    """Old feed items move to the archive & come back only for old ?since= reads"""
+
+    def test_archive_and_read_path(self):
+        user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+        items = [models.ProfileFeedItem.objects.create(user_profile=user, status_text=str(index)) for index in range(5)]
+        old = timezone.now() - timedelta(days=400)
+        models.ProfileFeedItem.objects.filter(pk__in=[item.pk for item in items[:3]]).update(created_on=old)
+
+        self.assertEqual(archive.archive_batch(archive.retention_cutoff(), batch_size=2), 2)
+        self.assertEqual(archive.archive_batch(archive.retention_cutoff(), batch_size=2), 1)
+        self.assertEqual(archive.archive_batch(archive.retention_cutoff(), batch_size=2), 0)
+        self.assertEqual(models.ProfileFeedItem.objects.count(), 2)
+
+        client = APIClient()
+        client.force_authenticate(user)
+        ids = lambda url: [row['id'] for row in client.get(url).json()['results']]
+        hot = [item.pk for item in reversed(items[3:])]
+        self.assertEqual(ids('/api/feed/'), hot)
+        self.assertEqual(ids('/api/feed/?since=%s' % (timezone.now() - timedelta(days=1)).date()), hot)
+        since = (old - timedelta(days=1)).date()
+        self.assertEqual(ids('/api/feed/?since=%s' % since), hot + [item.pk for item in reversed(items[:3])])
+
+
+class ProfilingTests(TestCase):
+    """Signed/sampled requests are profiled, staff can aggregate & diff them"""
+
+    def test_profile_aggregate_and_diff(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        config = {'ENABLED': True, 'SAMPLE_RATE': 0.0, 'DIRECTORY': directory.name}
+        staff = models.UserProfile.objects.create_superuser('admin@example.com', 'Admin', 'pw')
+        client = APIClient()
+        client.force_authenticate(staff)
+        with override_settings(PROFILE_API_PROFILING=config):
+            self.assertNotIn('X-Profile-Id', client.get('/api/hello-view/'))
+            self.assertNotIn('X-Profile-Id', client.get('/api/hello-view/', HTTP_X_PROFILE='forged'))
+            header = client.get('/api/profiling/').json()['header']['X-Profile']
+            ids = [client.get(url, HTTP_X_PROFILE=header)['X-Profile-Id'] for url in ('/api/profile/', '/api/feed/')]
+            self.assertTrue(ids[0].startswith('profile-list/'))
+
+            listing = client.get('/api/profiling/').json()['routes']
+            self.assertEqual(sorted(listing), ['feed-list', 'profile-list'])
+            aggregate = client.get('/api/profiling/profile-list/?limit=5').json()
+            self.assertEqual((aggregate['profiles'], len(aggregate['functions'])), (1, 5))
+            diff = client.get('/api/profiling/diff/', {'base': ids[0], 'other': 'feed-list'}).json()
+            self.assertEqual(diff['profiles'], [1, 1])
+            self.assertTrue(diff['functions'])
+
+            # The same through the admin page
+            self.assertEqual(self.client.get('/admin/profiling/').status_code, 302)
+            self.client.force_login(staff)
+            self.assertContains(self.client.get('/admin/profiling/'), 'feed-list')
+            page = self.client.get('/admin/profiling/', {'route': 'profile-list', 'limit': 5})
+            self.assertEqual(len(page.context['functions']), 5)
+            page = self.client.get('/admin/profiling/', {'route': ids[0], 'other': 'feed-list'})
+            self.assertEqual(page.context['profiles'], (1, 1))
+            self.assertTrue(page.context['diff'])
+            self.assertEqual(self.client.get('/admin/profiling/', {'route': '..'}).context['not_found'], ['..'])
+
+            store = profiling.get_store()
+            store.max_bytes = 0
+            store.rotate()
+            self.assertEqual(store.files(), [])
+
+    def test_dot_routes_are_rejected(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = profiling.ProfileStore(os.path.join(directory.name, 'profiles'), 1024 * 1024)
+        store.save('feed-list', cProfile.Profile(), 0.01, 200)
+        for reference in ('.', '..', '../profiles', './feed-list', '.hidden'):
+            self.assertEqual(store.resolve(reference), [], reference)
+        self.assertTrue(store.save('..', cProfile.Profile(), 0.01, 200).startswith(
+            os.path.join(directory.name, 'profiles', 'unnamed') + os.sep,
+        ))
+
+    def test_rotation_scans_every_n_saves_or_over_the_cap(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = profiling.ProfileStore(directory.name, 1024 * 1024, rotate_every=3)
+        with mock.patch.object(store, 'files', wraps=store.files) as files:
+            for _ in range(5):
+                store.save('feed-list', cProfile.Profile(), 0.01, 200)
+            # First save & the third one
+            self.assertEqual(files.call_count, 2)
+            store.max_bytes = 1
+            store.save('feed-list', cProfile.Profile(), 0.01, 200)
+            self.assertEqual(files.call_count, 3)
+        self.assertEqual(len(store.files()), 0)
+
+
+class MetricsTests(TestCase):
+    """Metrics from every process add up & are served in Prometheus format"""
+
+    def test_processes_share_counters(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = Metrics(os.path.join(directory.name, 'metrics'), slots=64, buckets=(0.1, 1.0))
+        shared.record('feed-list', 'GET', 200, 0.05, queries=2, db_time=0.01)
+        worker = multiprocessing.get_context('fork').Process(
+            target=shared.record, args=('feed-list', 'GET', 200, 0.5), kwargs={'queries': 3, 'db_time': 0.02},
+        )
+        worker.start()
+        worker.join()
+
+        text = shared.render()
+        self.assertIn('profile_api_requests_total{route="feed-list",method="GET",status="200"} 2', text)
+        self.assertIn('profile_api_request_duration_seconds_bucket{route="feed-list",method="GET",le="0.1"} 1', text)
+        self.assertIn('profile_api_request_duration_seconds_bucket{route="feed-list",method="GET",le="1.0"} 2', text)
+        self.assertIn('profile_api_db_queries_total{route="feed-list"} 5', text)
+
+    def test_endpoint(self):
+        staff = models.UserProfile.objects.create_superuser('admin@example.com', 'Admin', 'pw')
+        client = APIClient()
+        client.force_authenticate(staff)
+        client.get('/api/profile/', HTTP_ACCEPT='application/json')
+        response = client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertRegex(response.content.decode(), r'profile_api_render_seconds_count\{route="profile-list"\} \d+')
+        self.assertEqual(APIClient().get('/api/metrics/').status_code, 401)
+
+
+class AdmissionTests(TestCase):
+    """Rate limits & concurrency caps hold across worker processes"""
+
+    def setUp(self):
+        admission.clear()
+
+    def test_tests_leave_the_servers_tables_alone(self):
+        # manage.py test moved the shared tables (profile_api.testing.TestRunner)
+        shared = os.path.realpath(settings.PROFILE_API_SHM_DIRECTORY)
+        # Tables made later too
+        later = shm.SharedTable(os.path.join(settings.PROFILE_API_SHM_DIRECTORY, 'admission'), slots=8)
+        for table in (admission.table, metrics.table, db.recent_writers.table, later):
+            self.assertFalse(os.path.realpath(table.path).startswith(shared + os.sep), table.path)
+
+    @override_settings(PROFILE_API_THROTTLE_RATES={'login': '2/min'})
+    def test_login_throttle(self):
+        models.UserProfile.objects.create_user('ada@example.com', 'Ada', 'secret-pw')
+        client = APIClient()
+        credentials = {'username': 'ada@example.com', 'password': 'secret-pw'}
+        for _ in range(2):
+            self.assertEqual(client.post('/api/login/', credentials).status_code, 200)
+        response = client.post('/api/login/', credentials)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 29)
+
+    @override_settings(PROFILE_API_CONCURRENCY_LIMITS={'POST login': 0})
+    def test_concurrency_cap(self):
+        response = APIClient().post('/api/login/', {'username': 'x', 'password': 'y'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_in_flight_counts_are_shared_and_repaired(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        shared = Admission(os.path.join(directory.name, 'admission'), slots=64, buckets_per_scope=8, worker_slots=4)
+        self.assertTrue(shared.acquire('POST login', 2))
+        # A worker that dies with a request in flight
+        worker = multiprocessing.get_context('fork').Process(target=shared.acquire, args=('POST login', 2))
+        worker.start()
+        worker.join()
+        self.assertEqual(shared.in_flight('POST login'), 2)
+        # At the cap the dead worker's request is dropped
+        self.assertTrue(shared.acquire('POST login', 2))
+        self.assertFalse(shared.acquire('POST login', 2))
+        shared.release('POST login')
+        self.assertEqual(shared.in_flight('POST login'), 1)
+
+
+@override_settings(PROFILE_API_RESPONSE_CACHE={'ENABLED': False})
+class CountFreePaginationTests(TransactionTestCase):
+    """Profile pages read maintained totals, never COUNT(*) the whole table"""
+
+    databases = {'default', 'replica'}
+
+    def get(self, url):
+        """GET url, returns (JSON body, SQL of the queries)"""
+        recorder = QueryRecorder()
+        with recorder.record():
+            body = self.client.get(url, HTTP_ACCEPT='application/json').json()
+        return body, [sql for sql, _ in recorder.statements]
+
+    def test_counts(self):
+        for index in range(3):
+            models.UserProfile.objects.create_user('user%d@example.com' % index, 'User', None)
+        counters.reconcile()
+        user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+        self.assertEqual(counters.get(models.UserProfile), 4)
+
+        body, statements = self.get('/api/profile/?page_size=2')
+        self.assertEqual((body['count'], len(body['results'])), (4, 2))
+        self.assertFalse([sql for sql in statements if 'COUNT(' in sql])
+        body, _ = self.get(body['next'])
+        self.assertEqual((body['count'], body['next']), (4, None))
+
+        with mock.patch.object(pagination.CountFreePagination, 'count_cap', 2):
+            self.assertEqual(self.get('/api/profile/?search=example&page_size=1')[0]['count'], '2+')
+        self.assertEqual(self.get('/api/profile/?search=ada')[0]['count'], 1)
+
+        # Cascades & bulk paths keep the counters exact
+        models.ProfileFeedItem.objects.create(user_profile=user, status_text='Hi')
+        user.delete()
+        self.assertEqual(counters.reconcile(), {
+            'profile_api.userprofile': (3, 3),
+            'profile_api.profilefeeditem': (0, 0),
+        })
+
+    def test_filtered_lists_count_once_up_to_the_cap(self):
+        for index in range(4):
+            models.UserProfile.objects.create_user('user%d@example.com' % index, 'User', None)
+        with mock.patch.object(pagination.CountFreePagination, 'count_cap', 2):
+            body, statements = self.get('/api/profile/?search=example&page_size=1')
+        self.assertEqual(body['count'], '2+')
+        # One capped COUNT shared by the ETag & the page, without the search rank
+        counts = [sql for sql in statements if 'COUNT(' in sql]
+        self.assertEqual(len(counts), 1)
+        self.assertIn('LIMIT 3', counts[0])
+        self.assertNotIn('bm25', counts[0])
+
+    def test_deltas_written_once_per_transaction(self):
+        counters.reconcile()
+        recorder = QueryRecorder()
+        with recorder.record():
+            with transaction.atomic():
+                for _ in range(3):
+                    counters.add(models.UserProfile, 1)
+        updates = [sql for sql, _ in recorder.statements if sql.startswith('UPDATE "profile_api_rowcount"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(counters.get(models.UserProfile), 3)
+        # A rollback drops its deltas, the next transaction starts over
+        with self.assertRaises(ZeroDivisionError):
+            with transaction.atomic():
+                counters.add(models.UserProfile, 5)
+                1 / 0
+        with transaction.atomic():
+            counters.add(models.UserProfile, -1)
+        self.assertEqual(counters.get(models.UserProfile), 2)
+
+
+class AdminTests(TestCase):
+    """Admin changelists page by keyset & bulk actions work in chunks"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = models.UserProfile.objects.create_superuser('admin@example.com', 'Admin', 'pw')
+        cls.users = [models.UserProfile.objects.create_user('user%d@example.com' % index, 'User', None) for index in range(5)]
+        for user in cls.users:
+            models.ProfileFeedItem.objects.create(user_profile=user, status_text='Hi')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelists_skip_count(self):
+        for url in ('/admin/profile_api/userprofile/', '/admin/profile_api/profilefeeditem/?created_on__year=2020'):
+            recorder = QueryRecorder()
+            with recorder.record():
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertFalse([sql for sql, _ in recorder.statements if 'COUNT(' in sql])
+
+    def test_keyset_pages(self):
+        with mock.patch('profile_api.admin.UserProfileAdmin.list_per_page', 4):
+            first = self.client.get('/admin/profile_api/userprofile/').context['cl']
+            second = self.client.get('/admin/profile_api/userprofile/' + first.next_url).context['cl']
+        self.assertEqual([row.pk for row in first.result_list + second.result_list],
+                         sorted([self.admin.pk] + [user.pk for user in self.users], reverse=True))
+        self.assertIsNone(second.next_url)
+
+    @mock.patch('profile_api.admin.CHUNK_SIZE', 2)
+    def test_bulk_actions(self):
+        selected = [user.pk for user in self.users[:3]]
+        for action in ('deactivate_users', 'purge_feed'):
+            self.client.post('/admin/profile_api/userprofile/', {'action': action, '_selected_action': selected})
+        self.assertEqual(models.UserProfile.objects.filter(is_active=False).count(), 3)
+        self.assertEqual(models.ProfileFeedItem.objects.count(), 2)
+
+    def test_deactivation_reaches_other_workers(self):
+        user = self.users[0]
+        token = Token.objects.create(user=user)
+        # Another worker: its own caches, the shared generations files
+        generations = token_cache.generations
+        tokens = TokenCache(100, 300, SharedGenerations(generations.table.path, generations.rows))
+        tokens.set(token.key, (user, token), tokens.generation(token.key))
+        generations = profile_responses.generations
+        responses = ResponseCache('profiles', dict(
+            RESPONSE_CACHE_DEFAULTS, GENERATIONS_PATH=generations.table.path, GENERATION_ROWS=generations.rows,
+        ))
+        scopes = ('list', 'obj:%d' % user.pk)
+        before = [responses.generation(scope) for scope in scopes]
+
+        self.client.post('/admin/profile_api/userprofile/',
+                         {'action': 'deactivate_users', '_selected_action': [user.pk]})
+        self.assertIsNone(tokens.get(token.key))
+        self.assertEqual(tokens.stats()['stale'], 1)
+        after = [responses.generation(scope) for scope in scopes]
+        self.assertTrue(all(new > old for old, new in zip(before, after)))
+
+
+class GroupCommitTests(TransactionTestCase):
+    """Concurrent saves share one transaction but keep their own results"""
+
+    def test_concurrent_saves(self):
+        user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+        committer = GroupCommitter(window=0.05, max_items=100)
+        results = {}
+
+        def post(index):
+            # No author for #3, its NOT NULL failure must not affect the others
+            item = models.ProfileFeedItem(user_profile=None if index == 3 else user, status_text=str(index))
+            try:
+                results[index] = committer.save(item)
+            except Exception as error:
+                results[index] = error
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=post, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIsInstance(results.pop(3), Exception)
+        self.assertEqual(len({item.pk for item in results.values()}), 7)
+        for index, item in results.items():
+            self.assertEqual(models.ProfileFeedItem.objects.get(pk=item.pk).status_text, str(index))
+            self.assertIsNotNone(item.created_on)
+        self.assertEqual(committer.stats()['failed'], 1)
+        self.assertLess(committer.stats()['flushes'], 8)
+
+
+class FeedChangesTests(TransactionTestCase):
+    """Delta sync of new & deleted feed items, with long polls"""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', None)
+        self.items = [models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='Old')
+                      for _ in range(2)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def changes(self, query=''):
+        response = self.client.get('/api/feed/changes/' + query)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_changes_since_token(self):
+        token = self.changes()['sync_token']
+        created = models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='New')
+        deleted_pk = self.items[0].pk
+        self.assertEqual(self.client.delete('/api/feed/%d/' % deleted_pk).status_code, 204)
+        data = self.changes('?sync_token=' + token)
+        self.assertEqual([item['id'] for item in data['items']], [created.pk])
+        self.assertEqual(data['deleted'], [deleted_pk])
+        self.assertFalse(data['more'])
+        data = self.changes('?sync_token=' + data['sync_token'])
+        self.assertEqual((data['items'], data['deleted']), ([], []))
+        # A user's cascade deletes every item it wrote with one DELETE, and
+        # tombstones them with one INSERT
+        recorder = QueryRecorder()
+        with recorder.record():
+            self.user.delete()
+        statements = [sql for sql, _ in recorder.statements]
+        for table in ('profilefeeditem', 'feeditemtombstone'):
+            self.assertEqual(len([sql for sql in statements if 'profile_api_%s"' % table in sql.split('(')[0]
+                                  and sql.startswith(('DELETE', 'INSERT'))]), 1, table)
+        self.assertEqual(models.FeedItemTombstone.objects.count(), 3)
+
+    def test_long_poll_wakes_on_commit(self):
+        token = self.changes()['sync_token']
+
+        def post():
+            time.sleep(0.2)
+            models.ProfileFeedItem.objects.create(user_profile=self.user, status_text='Later')
+            connection.close()
+
+        thread = threading.Thread(target=post)
+        started = time.monotonic()
+        thread.start()
+        data = self.changes('?wait=10&sync_token=' + token)
+        thread.join()
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([item['status_text'] for item in data['items']], ['Later'])
+
+    def test_expired_and_invalid_tokens(self):
+        expired = changes.SyncToken(0, 0, int(time.time()) - 31 * 86400)
+        self.assertEqual(self.client.get('/api/feed/changes/?sync_token=' + str(expired)).status_code, 410)
+        self.assertEqual(self.client.get('/api/feed/changes/?sync_token=nope').status_code, 400)
+
+    def test_invalid_wait(self):
+        token = self.changes()['sync_token']
+        for wait in ('nan', 'inf', '-inf', '-1', 'soon'):
+            response = self.client.get('/api/feed/changes/?wait=%s&sync_token=%s' % (wait, token))
+            self.assertEqual(response.status_code, 400, wait)
+            self.assertIn('wait', response.data)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Every route must stay within its budget in profile_api/testing.py"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = models.UserProfile.objects.create_user('ada@example.com', 'Ada', 'secret-pw')
+        cls.token = Token.objects.create(user=cls.user)
+        for index in range(10):
+            # Feed rows of several users, an N+1 on the author would show
+            author = models.UserProfile.objects.create_user('user%d@example.com' % index, 'User', None)
+            models.ProfileFeedItem.objects.create(user_profile=author, status_text='Status %d' % index)
+        cls.item = models.ProfileFeedItem.objects.create(user_profile=cls.user, status_text='Mine')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def request(self, method, url_name, data=None, **kwargs):
+        """Call an endpoint within its query budget, returns the response"""
+        url = reverse(url_name, kwargs=kwargs or None)
+        token_cache.clear()
+        admission.clear()
+        with self.assertQueryBudget(method, url_name):
+            response = getattr(self.client, method.lower())(url, data, format='json')
+        self.assertLess(response.status_code, 400, response.content)
+        return response
+
+    def test_hello_view(self):
+        self.request('GET', 'hello-view')
+
+    def test_login(self):
+        self.client.credentials()
+        self.request('POST', 'login', {'username': 'ada@example.com', 'password': 'secret-pw'})
+
+    def test_profile_endpoints(self):
+        self.request('GET', 'profile-list')
+        self.request('GET', 'profile-list', {'search': 'example'})
+        self.request('GET', 'profile-detail', pk=self.user.pk)
+        self.request('PATCH', 'profile-detail', {'name': 'Ada L.'}, pk=self.user.pk)
+        self.client.credentials()
+        self.request('POST', 'profile-list', {'email': 'new@example.com', 'name': 'New', 'password': 'pw'})
+
+    def test_profile_delete(self):
+        self.request('DELETE', 'profile-detail', pk=self.user.pk)
+
+    def test_feed_endpoints(self):
+        self.request('GET', 'feed-list')
+        self.request('GET', 'feed-list', {'user': self.user.pk})
+        self.request('POST', 'feed-list', {'status_text': 'Hello'})
+        self.request('GET', 'feed-detail', pk=self.item.pk)
+        self.request('PATCH', 'feed-detail', {'status_text': 'Edited'}, pk=self.item.pk)
+        self.request('DELETE', 'feed-detail', pk=self.item.pk)
+        self.request('GET', 'feed-changes', {'sync_token': str(changes.SyncToken(0, 0, int(time.time())))})
+
+
+    def test_connection_setup_is_not_counted(self):
+        # A worker's first request opens its connections, their PRAGMAs
+        # aren't queries of the request
+        fresh = connection.copy()
+        self.addCleanup(fresh.close)
+        recorder = QueryRecorder()
+        with fresh.execute_wrapper(recorder):
+            with fresh.cursor() as cursor:
+                cursor.execute('PRAGMA busy_timeout')
+                self.assertEqual(cursor.fetchone()[0], 5000)
+        self.assertEqual([sql for sql, _ in recorder.statements], ['PRAGMA busy_timeout'])
+
+
+class BenchmarkTests(TestCase):
+    """The benchmark suite drives every route & flags regressions"""
+
+    def setUp(self):
+        # Like the test client, keep the WSGI handler from closing the
+        # test transaction's connection
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_started.connect, close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+
+    def test_every_scenario_succeeds(self):
+        dataset = benchmark.Dataset(users=3, items_per_user=2).load()
+        results = benchmark.run(dataset, requests=2, concurrency=(1,))
+        self.assertEqual(len(results), len(benchmark.SCENARIOS))
+        for key, result in results.items():
+            with self.subTest(scenario=key):
+                self.assertEqual(result['errors'], 0)
+                self.assertGreater(result['rps'], 0)
+
+    def test_warmup_requests_every_route(self):
+        paths = warmup.route_paths()
+        self.assertEqual(paths['profile-detail'], '/api/profile/1/')
+        recorded, admitted = metrics.table.items(), admission.table.items()
+        # Warmup requests pass the tightest throttles & caps without drawing from them
+        with override_settings(
+            PROFILE_API_THROTTLE_RATES={'login': '1/day', 'signup': '1/day'},
+            PROFILE_API_CONCURRENCY_LIMITS={name: 0 for name in paths},
+        ):
+            timings = warmup.request_routes(get_wsgi_application(), paths)
+        self.assertEqual(set(timings), set(paths))
+        self.assertFalse({name: status for name, (status, _) in timings.items() if status >= 500 or status == 429})
+        self.assertEqual(admission.table.items(), admitted)
+        # Warmup requests stay out of the metrics
+        self.assertEqual(metrics.table.items(), recorded)
+
+    @override_settings(PROFILE_API_WARMUP={'ENABLED': True, 'FREEZE': False})
+    def test_warmup_runs_under_uwsgi_only(self):
+        with mock.patch.object(warmup, 'request_routes', return_value={}) as request_routes, \
+                mock.patch.object(warmup, 'connections'):
+            self.assertIsNone(warmup.warm_up(None))
+            with mock.patch.dict('sys.modules', uwsgi=mock.Mock()):
+                self.assertEqual(warmup.warm_up(None), {})
+            self.assertEqual(warmup.warm_up(None, force=True), {})
+            with override_settings(PROFILE_API_WARMUP={'ENABLED': False}):
+                self.assertIsNone(warmup.warm_up(None, force=True))
+        self.assertEqual(request_routes.call_count, 2)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile([], 95), 0.0)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'feed-list GET @1': {
+            'p95_ms': 10.0, 'rps': 100.0, 'queries_per_request': 2.0, 'errors': 0,
+        }}
+        same = {'feed-list GET @1': dict(baseline['feed-list GET @1'], p95_ms=11.0)}
+        self.assertEqual(benchmark.compare(same, baseline, threshold=0.2), [])
+        slower = {'feed-list GET @1': {'p95_ms': 15.0, 'rps': 70.0, 'queries_per_request': 3.0, 'errors': 1}}
+        self.assertEqual(len(benchmark.compare(slower, baseline, threshold=0.2)), 4)
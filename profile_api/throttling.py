@@ -0,0 +1,260 @@
+# Cross-worker rate limiting & admission control (app_name/throttling.py)
+# Token buckets & per-route in-flight counters live in a SharedTable
+# (profile_api/shm.py) every worker process maps, so limits hold for the
+# whole host rather than per worker, without a network service.
+
+import errno
+import os
+import time
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.throttling import BaseThrottle
+
+from profile_api import shm
+from profile_api.middleware import get_url_name, is_warmup
+
+# Defaults, override with PROFILE_API_ADMISSION in settings.py
+ADMISSION_DEFAULTS = {
+    # Shared file & number of rows it holds (buckets & in-flight counters)
+    'PATH': os.path.join(getattr(settings, 'PROFILE_API_SHM_DIRECTORY', '/tmp/profile_api'), 'admission'),
+    'SLOTS': 8192,
+    # Clients are hashed into this many buckets per throttle scope, bounding
+    # the table size (clients sharing a bucket share its tokens)
+    'BUCKETS_PER_SCOPE': 2048,
+    # Rows per route tracking each worker's in-flight requests (>= workers)
+    'WORKER_SLOTS': 64,
+    # Retry-After (seconds) of the 503 sent when a route is at its cap
+    'RETRY_AFTER': 1,
+}
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+
+def _admission_config():
+    """Return the admission settings merged over the defaults"""
+    config = dict(ADMISSION_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_ADMISSION', {}))
+    return config
+
+
+def parse_rate(rate):
+    """Return (capacity, tokens per second) of a '<requests>/<period>' rate"""
+    count, _, period = rate.partition('/')
+    return int(count), int(count) / PERIODS[period]
+
+
+def pid_alive(pid):
+    """Return True if a process with this pid exists"""
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno == errno.EPERM
+    return True
+
+
+class Admission:
+    """Token buckets & per-route in-flight counts shared by the host's workers
+
+    Rows hold two floats. Buckets: (tokens, last refill time). In-flight
+    counts: a route total, plus (pid, count) rows per worker used to repair
+    the total when a worker died mid-request.
+    """
+
+    def __init__(self, path, slots, buckets_per_scope, worker_slots):
+        self.table = shm.SharedTable(path, slots=slots, width=2)
+        self.buckets_per_scope = buckets_per_scope
+        self.worker_slots = worker_slots
+        # route -> this process' worker row, claimed on first use
+        self._worker_rows = {}
+        self._pid = None
+
+    def bucket_key(self, scope, ident):
+        """Return the bucket row of a client in a throttle scope"""
+        return 'bucket|%s|%d' % (scope, zlib.crc32(ident.encode('utf-8')) % self.buckets_per_scope)
+
+    def consume(self, scope, ident, capacity, refill_rate, now=None):
+        """Take a token from a client's bucket, returns 0 or the seconds to wait for one"""
+        now = time.time() if now is None else now
+        key = self.bucket_key(scope, ident)
+        with self.table.locked():
+            row = self.table.get_locked(key)
+            if row is None:
+                tokens = float(capacity)
+            else:
+                tokens, updated = row
+                tokens = min(float(capacity), tokens + max(0.0, now - updated) * refill_rate)
+            if tokens >= 1:
+                self.table.set_locked(key, (tokens - 1, now))
+                return 0
+            self.table.set_locked(key, (tokens, now))
+        return (1 - tokens) / refill_rate
+
+    def _worker_row_locked(self, route):
+        """Return this process' in-flight row for a route, claiming a free one"""
+        pid = os.getpid()
+        if self._pid != pid:
+            # Forked, the parent's rows aren't ours
+            self._worker_rows = {}
+            self._pid = pid
+        key = self._worker_rows.get(route)
+        if key is not None:
+            return key
+        free = None
+        for index in range(self.worker_slots):
+            key = 'inflight|%s|%d' % (route, index)
+            row = self.table.get_locked(key)
+            if row is not None and int(row[0]) == pid:
+                free = key
+                break
+            if free is None and (row is None or not row[0] or not pid_alive(int(row[0]))):
+                free = key
+        if free is None:
+            return None
+        row = self.table.get_locked(free)
+        if row is not None and row[0] and int(row[0]) != pid:
+            # A dead worker's requests never finished, take them off the total
+            self.table.add_locked('inflight|%s' % route, (-row[1],))
+        self.table.set_locked(free, (pid, 0))
+        self._worker_rows[route] = free
+        return free
+
+    def _repair_locked(self, route):
+        """Drop the in-flight requests of dead workers from a route's total"""
+        total = 0
+        for index in range(self.worker_slots):
+            key = 'inflight|%s|%d' % (route, index)
+            row = self.table.get_locked(key)
+            if row is None or not row[0]:
+                continue
+            if pid_alive(int(row[0])):
+                total += row[1]
+            else:
+                self.table.set_locked(key, (0, 0))
+        self.table.set_locked('inflight|%s' % route, (total, 0))
+        return total
+
+    def acquire(self, route, limit):
+        """Count a request in flight on a route, returns False if it's at the limit"""
+        with self.table.locked():
+            total_key = 'inflight|%s' % route
+            row = self.table.get_locked(total_key)
+            in_flight = row[0] if row else 0
+            if in_flight >= limit:
+                # Checked only at the limit: a crashed worker may have leaked requests
+                in_flight = self._repair_locked(route)
+                if in_flight >= limit:
+                    return False
+            worker_key = self._worker_row_locked(route)
+            self.table.add_locked(total_key, (1,))
+            if worker_key is not None:
+                self.table.add_locked(worker_key, {1: 1})
+        return True
+
+    def release(self, route):
+        """Count a request on a route as finished"""
+        with self.table.locked():
+            self.table.add_locked('inflight|%s' % route, (-1,))
+            worker_key = self._worker_rows.get(route)
+            if worker_key is not None and self._pid == os.getpid():
+                self.table.add_locked(worker_key, {1: -1})
+
+    def in_flight(self, route):
+        """Return the number of requests in flight on a route"""
+        row = self.table.get('inflight|%s' % route)
+        return int(row[0]) if row else 0
+
+    def clear(self):
+        """Forget every bucket & counter"""
+        self.table.clear()
+        self._worker_rows = {}
+
+
+def _build_admission():
+    """Create the process wide admission state from settings"""
+    config = _admission_config()
+    return Admission(config['PATH'], config['SLOTS'], config['BUCKETS_PER_SCOPE'], config['WORKER_SLOTS'])
+
+
+admission = _build_admission()
+
+
+class SharedTokenBucketThrottle(BaseThrottle):
+    """DRF throttle backed by the shared token buckets, keyed by user or IP
+
+    The rate of a scope comes from PROFILE_API_THROTTLE_RATES
+    ('<requests>/<s|min|hour|day>', None or missing to disable).
+    A bucket holds up to <requests> tokens & refills continuously.
+    Warmup requests (profile_api/warmup.py) draw no token.
+    """
+    scope = None
+
+    def allow_request(self, request, view):
+        rate = getattr(settings, 'PROFILE_API_THROTTLE_RATES', {}).get(self.scope)
+        if not rate or is_warmup(request):
+            return True
+        capacity, refill_rate = parse_rate(rate)
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            ident = 'user:%s' % user.pk
+        else:
+            ident = 'ip:%s' % self.get_ident(request)
+        self._wait = admission.consume(self.scope, ident, capacity, refill_rate)
+        return not self._wait
+
+    def wait(self):
+        return self._wait
+
+
+class LoginRateThrottle(SharedTokenBucketThrottle):
+    """Throttles UserLoginAPIView"""
+    scope = 'login'
+
+
+class SignupRateThrottle(SharedTokenBucketThrottle):
+    """Throttles UserProfileViewSet.create"""
+    scope = 'signup'
+
+
+class ConcurrencyLimitMiddleware:
+    """Sheds requests with a 503 (+ Retry-After) when a route is at its cap
+
+    Caps come from PROFILE_API_CONCURRENCY_LIMITS, keyed by
+    '<METHOD> <URL name>' or '<URL name>', and count the requests in flight
+    on the route across every worker. Checked in process_view, before the
+    view runs. Warmup requests (profile_api/warmup.py) aren't counted.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILE_API_CONCURRENCY_LIMITS', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.retry_after = _admission_config()['RETRY_AFTER']
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            route = getattr(request, '_admitted_route', None)
+            if route is not None:
+                admission.release(route)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        limits = getattr(settings, 'PROFILE_API_CONCURRENCY_LIMITS', {})
+        route = get_url_name(request)
+        key = '%s %s' % (request.method, route)
+        limit = limits.get(key, limits.get(route))
+        if limit is None or is_warmup(request):
+            return None
+        if not admission.acquire(key, limit):
+            response = JsonResponse(
+                {'detail': 'Server is busy, please retry shortly.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            )
+            response['Retry-After'] = str(self.retry_after)
+            return response
+        request._admitted_route = key
+        return None
@@ -6,15 +6,24 @@ from rest_framework.routers import DefaultRouter
 
 router = DefaultRouter()
 router.register('hello-viewset', views.HelloViewSet, base_name='hello-viewset')
-router.register('profile', views.UserProfileViewSet) # No need to specify base_name, queryset defined
-router.register('feed', views.UserProfileFeedViewSet)
+# base_name sets the URL names (profile-list, feed-detail, ...) used by metrics & query budgets
+router.register('profile', views.UserProfileViewSet, base_name='profile')
+router.register('feed', views.UserProfileFeedViewSet, base_name='feed')
 
 # Define API paths for each view (user as_view() method)
 urlpatterns = [
     # APIView
-    path('hello-view/', views.HelloApiView.as_view()),
+    path('hello-view/', views.HelloApiView.as_view(), name='hello-view'),
     # Login API
-    path('login/', views.UserLoginAPIView.as_view()),
+    path('login/', views.UserLoginAPIView.as_view(), name='login'),
+    # Worker metrics (staff only)
+    path('stats/', views.RuntimeStatsApiView.as_view(), name='stats'),
+    # Prometheus metrics of every worker (staff only)
+    path('metrics/', views.MetricsApiView.as_view(), name='metrics'),
+    # Stored request profiles (staff only)
+    path('profiling/', views.ProfilingApiView.as_view(), name='profiling'),
+    path('profiling/diff/', views.ProfilingDiffApiView.as_view(), name='profiling-diff'),
+    path('profiling/<str:route>/', views.ProfilingApiView.as_view(), name='profiling-route'),
     # Use Router for ViewSets
     path('', include(router.urls)),
 ]
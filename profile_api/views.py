@@ -8,8 +8,18 @@
 # Good to use when: need full control over the logic(complex algo, updating multiple datasources in a single API call), 
 # processing files and rendering a synchronous response, calling other APIs/services, accessing local files or data
 
+import math
+import os
+import time
+from types import GeneratorType
+
+from django.conf import settings
+from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import status
 
@@ -17,18 +27,50 @@ from rest_framework import status
 from profile_api import serializers
 from profile_api import models
 
-# Get Auth Token (For user authentication for every request)
-from rest_framework.authentication import TokenAuthentication
+# Get Auth Token (For user authentication for every request), cached per worker
+from profile_api.authentication import CachedTokenAuthentication, token_cache
+from profile_api.caching import profile_responses
 # Get View Auth Token (for login, etc)
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 
 # Import permissions 
 from profile_api import permissions
 
-# Import filters for filtering of data
-from rest_framework import filters
+# Import filters for filtering of data (FTS5 backed on SQLite)
+from profile_api.search import ProfileSearchFilter
+
+# Import pagination classes
+from profile_api import pagination
+
+# Password hashing pool & query stats (for their metrics)
+from profile_api import hashing
+from profile_api.groupcommit import feed_commits
+from profile_api.middleware import query_stats
+
+# Shared ViewSet behaviour (streaming export, ...)
+from profile_api import mixins
+
+# Archived feed items (hot/cold partitioning)
+from profile_api import archive
+
+# Feed delta sync & long polls
+from profile_api import changes
+
+# Stored request profiles
+from profile_api import profiling
+
+# Cross-worker rate limits of the password hashing routes
+from profile_api.throttling import LoginRateThrottle, SignupRateThrottle
+
+# Cross-worker request metrics (Prometheus)
+from profile_api.metrics import metrics
+from profile_api.renderers import ColumnarRenderer, PrometheusRenderer
+
+# Batched bulk writes & streamed request bodies
+from profile_api import bulk
+from profile_api.parsers import NDJSONParser
 
 
 class HelloApiView(APIView):
@@ -121,29 +163,101 @@ class HelloViewSet(viewsets.ViewSet):
         return Response({'http_method':'DELETE'})
 
 # Viewset to manage user profiles API
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(
+    mixins.HashingLoadSheddingMixin,
+    mixins.CachedResponseMixin,
+    mixins.SparseFieldsMixin,
+    mixins.ConditionalGetMixin,
+    mixins.FastReadMixin,
+    mixins.ExportMixin,
+    viewsets.ModelViewSet,
+):
     """Handle creating and updating user profiles"""
     serializer_class = serializers.UserProfileSerializer
     # ModelViewSet- provide possible functions for model
     queryset = models.UserProfile.objects.all()
     # Define authentication(authentication_classes) classes (more types can be added for particular viewset)
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     # Define permission(permission_classes), how users will authenticate & can do
     permission_classes = (permissions.UpdateOwnProfile,)
     # Define filters & searchable fields
-    filter_backends = (filters.SearchFilter,)
+    filter_backends = (ProfileSearchFilter,)
     search_fields = ('name', 'email',)
+    # Pages without COUNT(*): maintained totals or a capped estimate
+    pagination_class = pagination.CountFreePagination
+    # Accept: application/vnd.profiles.columnar+json for keys once per page
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (ColumnarRenderer,)
+    # /api/profile/export/?since= filters on updated_on
+    export_since_field = 'updated_on'
+
+    def get_throttles(self):
+        """Throttle signups (password hashing) per client, other actions aren't"""
+        if self.action == 'create':
+            return [SignupRateThrottle()]
+        return super().get_throttles()
+
+    @action(
+        detail=False,
+        methods=['post'],
+        parser_classes=(JSONParser, NDJSONParser),
+        permission_classes=(IsAdminUser,),
+    )
+    def bulk(self, request):
+        """Create many user profiles at once (staff only)
 
-class UserLoginAPIView(ObtainAuthToken):
+        Accepts a JSON list or an NDJSON stream (Content-Type:
+        application/x-ndjson) of {"email", "name", "password"} objects.
+        Rows are validated, checked for duplicate emails, hashed in parallel
+        and inserted in batches of ?batch_size= rows, all in one transaction.
+        Returns one result per row: the created profile or its errors.
+        """
+        rows = request.data
+        # A JSON list, or the lines of an NDJSON body (a generator)
+        if not isinstance(rows, (list, GeneratorType)):
+            raise ValidationError({'non_field_errors': ['Expected a list of profiles.']})
+        batch_size = bulk.get_batch_size(
+            request,
+            'PROFILE_API_BULK_BATCH_SIZE', 500,
+            'PROFILE_API_BULK_MAX_BATCH_SIZE', 5000,
+        )
+
+        results = []
+        seen_emails = set()
+        with transaction.atomic():
+            for batch in bulk.iter_batches(rows, batch_size):
+                results.extend(bulk.create_profiles(batch, seen_emails))
+
+        created = sum(1 for result in results if 'id' in result)
+        failed = len(results) - created
+        if not failed:
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {'created': created, 'failed': failed, 'results': results},
+            status=response_status,
+        )
+
+class UserLoginAPIView(mixins.HashingLoadSheddingMixin, ObtainAuthToken):
     """Handle creating user authentication token"""
     # Enable browsable API for testing 
     renderer_classes = (api_settings.DEFAULT_RENDERER_CLASSES)
+    # Token bucket per client shared by every worker (PROFILE_API_THROTTLE_RATES['login'])
+    throttle_classes = (LoginRateThrottle,)
     
-class UserProfileFeedViewSet(viewsets.ModelViewSet):
+class UserProfileFeedViewSet(
+    mixins.SparseFieldsMixin,
+    mixins.ConditionalGetMixin,
+    mixins.FastReadMixin,
+    mixins.ExportMixin,
+    viewsets.ModelViewSet,
+):
     """Handles creating, reading, and updating profile feed items"""
     
     # Define AUTH
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     # Define serializer
     serializer_class = serializers.ProfileFeedItemSerializer
     # Define possible model functions to manage
@@ -153,8 +267,253 @@ class UserProfileFeedViewSet(viewsets.ModelViewSet):
         permissions.UpdateOwnStatus,
         IsAuthenticated,
     )
+    # Keyset pagination on created_on (ties ordered by id), see FeedCursorPagination
+    pagination_class = pagination.FeedCursorPagination
+    # Accept: application/vnd.profiles.columnar+json for keys once per page
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + (ColumnarRenderer,)
+    # /api/feed/export/?since= filters on created_on
+    export_since_field = 'created_on'
+
+    def get_queryset(self):
+        """Optionally restrict feed items to a single user (?user=<id>)
+
+        Lists & exports with ?since= older than the retention window
+        (PROFILE_API_FEED_RETENTION_DAYS) read hot & archived items.
+        """
+        queryset = super().get_queryset()
+        since = self.request.query_params.get('since')
+        if since is not None and self.action in ('list', 'export'):
+            since = mixins.parse_since(since)
+            cutoff = archive.retention_cutoff()
+            if cutoff is not None and since < cutoff:
+                queryset = models.FeedItemHistory.objects.all()
+            if self.action == 'list':
+                # export applies ?since= itself
+                queryset = queryset.filter(created_on__gte=since)
+        user_id = self.request.query_params.get('user')
+        if user_id is not None:
+            if not user_id.isdigit():
+                raise ValidationError({'user': 'A valid user id is required.'})
+            # Served by the (user_profile, created_on, id) index
+            queryset = queryset.filter(user_profile_id=int(user_id))
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """Feed items created & deleted since ?sync_token= (delta sync)
+
+        Without a token, returns a token positioned at the current end of the
+        feed (load the feed with the list first). With ?wait=<seconds> and
+        nothing new, holds the request until something changes or the time
+        is up (long poll). Supports ?user=. Returns the new items, the ids
+        of deleted items, the next sync_token & whether `more` are waiting.
+        A token older than the tombstone retention gets a 410: reload the feed.
+        """
+        config = changes.get_config()
+        try:
+            wait = float(request.query_params.get('wait', '0'))
+        except ValueError:
+            wait = -1
+        # nan would never reach the deadline, inf would hold the worker
+        if not math.isfinite(wait) or wait < 0:
+            raise ValidationError({'wait': 'Expected a non-negative number of seconds.'})
+        wait = min(wait, config['MAX_WAIT'])
+        value = request.query_params.get('sync_token')
+        if value is None:
+            return Response({'items': [], 'deleted': [], 'sync_token': str(changes.current_token()), 'more': False})
+        token = changes.SyncToken.parse(value)
+        if token is None:
+            raise ValidationError({'sync_token': 'Invalid sync token.'})
+        if token.is_expired():
+            return Response(
+                {'detail': 'Sync token expired, reload the feed.'},
+                status=status.HTTP_410_GONE,
+            )
+
+        # Validates ?user= too
+        queryset = self.get_queryset()
+        user_id = request.query_params.get('user')
+        user_id = int(user_id) if user_id is not None else None
+        deadline = time.monotonic() + wait
+        # Read before querying, a change committed meanwhile moves it
+        sequence = changes.notifier.sequence()
+        items, deleted, next_token, more = changes.get_changes(queryset, token, config['PAGE_SIZE'], user_id)
+        while not items and not deleted:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            current = changes.notifier.wait(sequence, remaining)
+            if current == sequence:
+                break
+            # Something changed (maybe not in this user's feed), look again
+            sequence = current
+            items, deleted, next_token, more = changes.get_changes(queryset, token, config['PAGE_SIZE'], user_id)
+        return Response({
+            'items': self.get_serializer(items, many=True).data,
+            'deleted': deleted,
+            'sync_token': str(next_token),
+            'more': more,
+        })
+
+    @action(detail=False, methods=['post'], parser_classes=(NDJSONParser,))
+    def ingest(self, request):
+        """Stream many status updates for the logged in user
+
+        Reads an NDJSON body (Content-Type: application/x-ndjson) line by line,
+        one {"status_text": ...} object per line, and inserts the valid lines
+        in batches of ?batch_size= rows, each batch in its own transaction.
+        Returns the totals and the errors of the invalid lines.
+        """
+        batch_size = bulk.get_batch_size(
+            request,
+            'PROFILE_API_INGEST_BATCH_SIZE', 1000,
+            'PROFILE_API_INGEST_MAX_BATCH_SIZE', 10000,
+        )
+        max_errors = getattr(settings, 'PROFILE_API_INGEST_MAX_ERRORS', 1000)
+
+        received = created = failed = batches = 0
+        errors = []
+        for batch in bulk.iter_batches(request.data, batch_size):
+            with transaction.atomic():
+                batch_created, batch_errors = bulk.create_feed_items(batch, request.user)
+            batches += 1
+            received += len(batch)
+            created += batch_created
+            failed += len(batch_errors)
+            # Keep memory flat on huge uploads by capping the reported errors
+            errors.extend(batch_errors[:max(max_errors - len(errors), 0)])
+            bulk.logger.info(
+                'Feed ingest for user %s: batch %d, %d lines received, %d created, %d failed',
+                request.user.pk, batches, received, created, failed,
+            )
+
+        return Response(
+            {
+                'received': received,
+                'created': created,
+                'failed': failed,
+                'batches': batches,
+                'errors': errors,
+                'errors_truncated': failed > len(errors),
+            },
+            status=status.HTTP_400_BAD_REQUEST if failed and not created else status.HTTP_200_OK,
+        )
+
+    def perform_destroy(self, instance):
+        """Delete the item, its tombstone & row count are written here
+
+        (feed items have no post_delete receiver, see changes.delete_items)
+        """
+        rows = [(instance.pk, instance.user_profile_id)]
+        with transaction.atomic():
+            instance.delete()
+            changes.record_deletions(rows, instance._state.db)
 
     # DRF override perform_create
     def perform_create(self, serializer):
-        """Sets the user profile to the logged in user"""
-        serializer.save(user_profile=self.request.user)
\ No newline at end of file
+        """Sets the user profile to the logged in user
+
+        In group-commit mode (PROFILE_API_GROUP_COMMIT) the row is written in
+        a transaction shared with the concurrent creates of this worker.
+        """
+        if not feed_commits.enabled:
+            serializer.save(user_profile=self.request.user)
+            return
+        instance = models.ProfileFeedItem(user_profile=self.request.user, **serializer.validated_data)
+        serializer.instance = feed_commits.save(instance)
+
+
+class RuntimeStatsApiView(APIView):
+    """Report in-process cache & worker pool metrics of this worker (staff only)"""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, format=None):
+        """Return the metrics of each subsystem"""
+        return Response({
+            'pid': os.getpid(),
+            'token_cache': token_cache.stats(),
+            'hashing_pool': hashing.pool.stats(),
+            'response_cache': profile_responses.stats(),
+            'feed_group_commit': feed_commits.stats(),
+            'queries': query_stats.summary(),
+        })
+
+
+class MetricsApiView(APIView):
+    """Prometheus metrics of every worker on this host (staff only)"""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAdminUser,)
+    renderer_classes = (PrometheusRenderer,)
+
+    def get(self, request, format=None):
+        """Return the request, latency, DB & render metrics"""
+        return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class ProfilingApiView(APIView):
+    """List the stored request profiles, or aggregate one route's (staff only)"""
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, route=None, format=None):
+        """Without a route: profiles per URL name & a signed X-Profile header value.
+        With a route: its top functions over every (or ?file=) profile.
+        """
+        store = profiling.get_store()
+        if route is None:
+            routes = {}
+            for route_name, name, _, size, metadata in store.files():
+                routes.setdefault(route_name, []).append(dict(metadata, file=name, bytes=size))
+            return Response({
+                'header': {'X-Profile': profiling.make_header_value()},
+                'routes': routes,
+            })
+        sort = self.get_sort(request)
+        reference = route + ('/' + request.query_params['file'] if 'file' in request.query_params else '')
+        paths = store.resolve(reference)
+        if not paths:
+            return Response({'detail': 'No profiles found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'route': route,
+            'profiles': len(paths),
+            'sort': sort,
+            'functions': profiling.top_functions(profiling.load_stats(paths), sort, self.get_limit(request)),
+        })
+
+    def get_sort(self, request):
+        """Return the ?sort= column (calls, tottime or cumulative)"""
+        sort = request.query_params.get('sort', 'cumulative')
+        if sort not in ('calls', 'tottime', 'cumulative'):
+            raise ValidationError({'sort': 'Expected calls, tottime or cumulative.'})
+        return sort
+
+    def get_limit(self, request):
+        """Return the ?limit= number of functions"""
+        limit = request.query_params.get('limit', '30')
+        if not limit.isdigit():
+            raise ValidationError({'limit': 'A positive integer is required.'})
+        return int(limit)
+
+
+class ProfilingDiffApiView(ProfilingApiView):
+    """Compare two profile sets, ?base= & ?other= name '<route>' or '<route>/<file>' (staff only)"""
+
+    def get(self, request, format=None):
+        """Return the functions whose time per profile changed most"""
+        store = profiling.get_store()
+        sets = []
+        for param in ('base', 'other'):
+            paths = store.resolve(request.query_params.get(param, ''))
+            if not paths:
+                raise ValidationError({param: 'No profiles found.'})
+            sets.append((profiling.load_stats(paths), len(paths)))
+        sort = self.get_sort(request)
+        return Response({
+            'base': request.query_params['base'],
+            'other': request.query_params['other'],
+            'profiles': [sets[0][1], sets[1][1]],
+            'sort': sort,
+            'functions': profiling.diff_functions(sets[0], sets[1], sort, self.get_limit(request)),
+        })
+
@@ -0,0 +1,155 @@
+# Pre-fork warmup of the WSGI application (app_name/warmup.py)
+# uWSGI loads profiles_project/wsgi.py once in its master and forks the
+# workers from it. warm_up() runs there (only under uWSGI, other servers may
+# load the module in every worker, where it would only delay them): it builds every serializer's fields
+# & sends one GET to every route of profile_api/urls.py, so URL resolvers,
+# router patterns, model metadata, renderers & lazily imported modules are
+# ready before the fork instead of on each worker's first requests. Then
+# gc.freeze() moves everything loaded so far out of the collector's reach:
+# collections in the workers no longer touch (and copy) the shared pages.
+
+import gc
+import io
+import logging
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.db import connections
+from django.urls import NoReverseMatch, URLPattern, URLResolver, reverse
+
+from profile_api import serializers
+from profile_api import urls
+from profile_api.middleware import WARMUP_ENVIRON_KEY
+
+logger = logging.getLogger(__name__)
+
+# Defaults, override with PROFILE_API_WARMUP in settings.py
+WARMUP_DEFAULTS = {
+    'ENABLED': True,
+    # gc.freeze() after warming up (Python 3.7+)
+    'FREEZE': True,
+}
+
+# Values of the URL kwargs when reversing the routes
+SAMPLE_KWARGS = {'pk': '1', 'route': 'feed-list'}
+
+# Query strings of routes that would otherwise read whole tables
+SAMPLE_QUERIES = {
+    'profile-export': 'since=9999-12-31',
+    'feed-export': 'since=9999-12-31',
+}
+
+
+def _warmup_config():
+    """Return the warmup settings merged over the defaults"""
+    config = dict(WARMUP_DEFAULTS)
+    config.update(getattr(settings, 'PROFILE_API_WARMUP', {}))
+    return config
+
+
+def _iter_patterns(patterns):
+    """Yield every URLPattern of a (nested) urlpatterns list"""
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _iter_patterns(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern):
+            yield pattern
+
+
+def route_paths():
+    """Return {URL name: path} of every named route of profile_api/urls.py
+
+    Format suffix variants (.json, ...) are left out, they share the view.
+    """
+    paths = {}
+    for pattern in _iter_patterns(urls.urlpatterns):
+        kwargs = set(pattern.pattern.regex.groupindex)
+        if not pattern.name or pattern.name in paths or 'format' in kwargs:
+            continue
+        try:
+            path = reverse(pattern.name, kwargs={name: SAMPLE_KWARGS.get(name, '1') for name in kwargs})
+        except NoReverseMatch:
+            continue
+        query = SAMPLE_QUERIES.get(pattern.name)
+        paths[pattern.name] = path + '?' + query if query else path
+    return paths
+
+
+def build_serializers():
+    """Build the fields of every ModelSerializer (model metadata, field mapping)"""
+    for serializer_class in (
+        serializers.UserProfileSerializer,
+        serializers.UserProfileBulkSerializer,
+        serializers.ProfileFeedItemSerializer,
+        serializers.ProfileAuthorSerializer,
+    ):
+        serializer_class().fields
+
+
+def call_route(application, path):
+    """Send an anonymous warmup GET through the WSGI application, returns the status"""
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'HTTP_ACCEPT': '*/*',
+        'wsgi.input': io.BytesIO(),
+        WARMUP_ENVIRON_KEY: True,
+    }
+    setup_testing_defaults(environ)
+    statuses = []
+    result = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return int(statuses[0].split(' ', 1)[0])
+
+
+def request_routes(application, paths):
+    """GET every path once through the application, returns {name: (status, ms)}
+
+    Anonymous GETs only: nothing is written, and throttles & concurrency
+    caps let warmup requests through without drawing from them.
+    """
+    timings = {}
+    # The 401/404/405 answers aren't worth a warning each
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.ERROR)
+    try:
+        for name, path in paths.items():
+            started = time.perf_counter()
+            status = call_route(application, path)
+            timings[name] = (status, (time.perf_counter() - started) * 1000)
+    finally:
+        request_logger.setLevel(level)
+    return timings
+
+
+def warm_up(application, force=False):
+    """Exercise the application before the workers are forked
+
+    Only runs under uWSGI, unless force is set (e.g. measure_startup).
+    Database connections opened meanwhile are closed, every worker must
+    open its own.
+    """
+    config = _warmup_config()
+    if not config['ENABLED'] or not (force or 'uwsgi' in sys.modules):
+        return None
+    started = time.perf_counter()
+    try:
+        build_serializers()
+        timings = request_routes(application, route_paths())
+    finally:
+        connections.close_all()
+    if config['FREEZE'] and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+    logger.info('Warmed up %d routes in %.0fms', len(timings), (time.perf_counter() - started) * 1000)
+    return timings
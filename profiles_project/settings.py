@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -46,13 +47,28 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # cProfile a sample of requests (PROFILE_API_PROFILING), first so the
+    # profile covers every middleware
+    'profile_api.profiling.ProfilingMiddleware',
+    # Cross-worker request metrics served by /api/metrics/, before
+    # QueryCountMiddleware whose query counts it reports
+    'profile_api.metrics.MetricsMiddleware',
+    # Per route caps on requests in flight across workers (503 + Retry-After)
+    'profile_api.throttling.ConcurrencyLimitMiddleware',
+    # gzip/deflate per Accept-Encoding, streams included, before the
+    # middleware that could still change the body
+    'profile_api.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Send reads of safe-method requests to the read database alias
+    'profile_api.db.ReadWriteRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Per request query count/time, keyed by URL name
+    'profile_api.middleware.QueryCountMiddleware',
 ]
 
 ROOT_URLCONF = 'profiles_project.urls'
@@ -83,9 +99,21 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # Keep connections open between requests (seconds)
+        'CONN_MAX_AGE': 60,
+    },
+    # Read alias for safe-method API requests (profile_api.db.ReadWriteRouter),
+    # a second connection to the same file since WAL lets readers run alongside the writer
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'TEST': {'MIRROR': 'default'},
+    },
 }
 
+DATABASE_ROUTERS = ['profile_api.db.ReadWriteRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -128,4 +156,200 @@ STATIC_URL = '/static/'
 # Configure django to use these custom models instead (app_name.model_class_name)
 AUTH_USER_MODEL = 'profile_api.UserProfile'
 
-STATIC_ROOT = 'static/'
\ No newline at end of file
+STATIC_ROOT = 'static/'
+
+# Profile API tuning
+
+# Feed list page size & the max page size clients can request (?page_size=)
+PROFILE_API_FEED_PAGE_SIZE = 50
+PROFILE_API_FEED_MAX_PAGE_SIZE = 200
+
+# Directory of the mmap'd files worker processes share (metrics, ...),
+# every worker of a deployment must use the same one
+PROFILE_API_SHM_DIRECTORY = os.path.join(tempfile.gettempdir(), 'profiles_api')
+
+# Tests use throwaway shared files instead (manage.py test)
+TEST_RUNNER = 'profile_api.testing.TestRunner'
+
+# Token authentication cache (profile_api.authentication.CachedTokenAuthentication)
+# SHARED_CACHE: alias from CACHES used as a second tier shared by all workers.
+# Evictions reach every worker through the generations in GENERATIONS_PATH
+PROFILE_API_TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TTL': 300,
+    'SHARED_CACHE': None,
+    'GENERATIONS_PATH': os.path.join(PROFILE_API_SHM_DIRECTORY, 'token_generations'),
+    'GENERATION_ROWS': 4096,
+}
+
+# Password hashing process pool (profile_api.hashing), sized separately from
+# the request workers. Requests get a 503 when MAX_QUEUE hashes are waiting
+# or theirs isn't done within RESULT_TIMEOUT seconds.
+PROFILE_API_HASHING_POOL = {
+    'WORKERS': 2,
+    'MAX_QUEUE': 16,
+    'ACQUIRE_TIMEOUT': 0.1,
+    'RESULT_TIMEOUT': 10,
+    'RETRY_AFTER': 1,
+}
+
+# Rows per INSERT batch for POST /api/profile/bulk/ & the max ?batch_size=
+PROFILE_API_BULK_BATCH_SIZE = 500
+PROFILE_API_BULK_MAX_BATCH_SIZE = 5000
+
+# Lines per INSERT batch (and transaction) for POST /api/feed/ingest/, the max
+# ?batch_size= and how many per-line errors are reported back
+PROFILE_API_INGEST_BATCH_SIZE = 1000
+PROFILE_API_INGEST_MAX_BATCH_SIZE = 10000
+PROFILE_API_INGEST_MAX_ERRORS = 1000
+
+# Longest line (bytes) of an NDJSON body, longer lines are reported as errors
+PROFILE_API_NDJSON_MAX_LINE_BYTES = 1024 * 1024
+
+# Order profile search results by relevance when the FTS5 index is used
+PROFILE_API_SEARCH_RANKED = True
+
+# Rows fetched per database round trip by the streaming /export/ actions
+PROFILE_API_EXPORT_CHUNK_SIZE = 2000
+
+# Serve profile/feed list & retrieve from values_list() rows instead of
+# serializer instances (same output, see profile_api/readers.py)
+PROFILE_API_FAST_READS = False
+
+# Add X-DB-Queries/X-DB-Time-Ms/... headers even when DEBUG is off & how many
+# requests per URL name the rolling query summary (/api/stats/) keeps
+PROFILE_API_QUERY_HEADERS = False
+PROFILE_API_QUERY_STATS_WINDOW = 500
+
+# Read/write splitting (profile_api.db): read alias & how long (seconds) a
+# client reads from the primary after writing, remembered for every worker in
+# a shared file
+PROFILE_API_DB_ROUTING = {
+    'READ_ALIAS': 'replica',
+    'STICKY_SECONDS': 5,
+    'STICKY_PATH': os.path.join(PROFILE_API_SHM_DIRECTORY, 'db_pins'),
+    'STICKY_BUCKETS': 4096,
+}
+
+# Run on every new SQLite connection
+PROFILE_API_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+}
+
+# Rendered profile list/retrieve responses (profile_api.caching.ResponseCache),
+# invalidated by signals through generations every worker reads from
+# GENERATIONS_PATH; the local tier is bounded by entries & bytes
+PROFILE_API_RESPONSE_CACHE = {
+    'ENABLED': True,
+    'CACHE': 'default',
+    'GENERATIONS_PATH': os.path.join(PROFILE_API_SHM_DIRECTORY, 'response_generations'),
+    'GENERATION_ROWS': 4096,
+    'TTL': 60,
+    'LOCAL_MAX_ENTRIES': 1000,
+    'LOCAL_MAX_BYTES': 16 * 1024 * 1024,
+    'LOCK_TIMEOUT': 5,
+}
+
+# Write concurrent feed posts of a worker in shared transactions: the first
+# post waits WINDOW_MS (or until MAX_ITEMS are queued) for others to join
+PROFILE_API_GROUP_COMMIT = {
+    'ENABLED': False,
+    'WINDOW_MS': 5,
+    'MAX_ITEMS': 100,
+}
+
+# Feed items older than this many days are moved to the archive table by
+# `manage.py archive_feed` (None keeps every item in the hot table); feed
+# lists with an older ?since= read hot & archived items
+PROFILE_API_FEED_RETENTION_DAYS = 365
+PROFILE_API_ARCHIVE_BATCH_SIZE = 1000
+
+# Profile SAMPLE_RATE of requests, and requests with the signed X-Profile
+# header shown by /api/profiling/, into DIRECTORY (capped at MAX_BYTES,
+# checked against the directory every ROTATE_EVERY saves)
+PROFILE_API_PROFILING = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.0,
+    'DIRECTORY': os.path.join(BASE_DIR, 'var', 'profiles'),
+    'MAX_BYTES': 50 * 1024 * 1024,
+    'ROTATE_EVERY': 100,
+    'HEADER_MAX_AGE': 3600,
+}
+
+# Request metrics aggregated across workers (/api/metrics/): SLOTS series
+# at most, BUCKETS are the latency histogram bounds in seconds
+PROFILE_API_METRICS = {
+    'ENABLED': True,
+    'PATH': os.path.join(PROFILE_API_SHM_DIRECTORY, 'metrics'),
+    'SLOTS': 4096,
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+}
+
+# Token buckets per client (user or IP) shared by every worker, as
+# '<requests>/<s|min|hour|day>': login (UserLoginAPIView) & signup
+# (UserProfileViewSet.create) answer 429 + Retry-After when empty
+PROFILE_API_THROTTLE_RATES = {
+    'login': '10/min',
+    'signup': '5/min',
+}
+
+# Max requests in flight across workers per '<METHOD> <URL name>' (or
+# '<URL name>'), over it requests get a 503 + Retry-After before the view runs
+PROFILE_API_CONCURRENCY_LIMITS = {
+    'POST login': 8,
+    'POST profile-list': 8,
+    # Long polls hold a worker thread for up to MAX_WAIT seconds
+    'GET feed-changes': 16,
+}
+
+# Shared table of the buckets & in-flight counters (profile_api.throttling)
+PROFILE_API_ADMISSION = {
+    'PATH': os.path.join(PROFILE_API_SHM_DIRECTORY, 'admission'),
+    'SLOTS': 8192,
+    'BUCKETS_PER_SCOPE': 2048,
+    'WORKER_SLOTS': 64,
+    'RETRY_AFTER': 1,
+}
+
+# Profile list pages (?page=, ?page_size=) and the cap of the estimated
+# count of filtered/searched lists (reported as "1000+" above it)
+PROFILE_API_PROFILE_PAGE_SIZE = 50
+PROFILE_API_PROFILE_MAX_PAGE_SIZE = 200
+PROFILE_API_COUNT_ESTIMATE_CAP = 1000
+
+
+# Rows per query/transaction of the admin's bulk actions (deactivate users,
+# purge feed), the changelists page by id & never COUNT(*) the table
+PROFILE_API_ADMIN_CHUNK_SIZE = 500
+
+# Response compression (profile_api.compression): JSON, columnar, NDJSON &
+# text responses of MIN_LENGTH bytes or more, streams flushed every
+# FLUSH_BYTES of input
+PROFILE_API_COMPRESSION = {
+    'ENABLED': True,
+    'LEVEL': 6,
+    'MIN_LENGTH': 200,
+    'FLUSH_BYTES': 16 * 1024,
+}
+
+# Feed delta sync (/api/feed/changes/): longest ?wait= of a long poll, how
+# often waiters check for other workers' commits, items per response & days
+# tombstones of deleted items are kept (archive_feed prunes them)
+PROFILE_API_FEED_CHANGES = {
+    'PATH': os.path.join(PROFILE_API_SHM_DIRECTORY, 'changes'),
+    'MAX_WAIT': 30,
+    'POLL_INTERVAL': 0.25,
+    'PAGE_SIZE': 200,
+    'TOMBSTONE_DAYS': 30,
+}
+
+# Pre-fork warmup run by profiles_project/wsgi.py under uWSGI: one GET per
+# route, then gc.freeze() so the workers share the preloaded pages
+# (PROFILE_API_WARMUP=0 in the environment turns it off, e.g. to measure a
+# cold start)
+PROFILE_API_WARMUP = {
+    'ENABLED': bool(int(os.environ.get('PROFILE_API_WARMUP', 1))),
+    'FREEZE': True,
+}
@@ -1,9 +1,12 @@
 # Define the API path for profile_api app/service (aka the app_name/urls.py)
 from django.contrib import admin
 from profile_api import views
+from profile_api.admin import profiling_view
 from django.urls import path, include
 
 urlpatterns = [
+    # Stored request profiles (staff only), before the admin's catch-all
+    path('admin/profiling/', profiling_view, name='admin-profiling'),
     path('admin/', admin.site.urls),
     path('api/', include('profile_api.urls')),
 ]
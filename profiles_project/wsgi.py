@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
 
 application = get_wsgi_application()
+
+# Exercise every route & freeze the loaded objects before uWSGI forks its
+# workers from this process (PROFILE_API_WARMUP, profile_api/warmup.py)
+from profile_api import warmup  # noqa: E402
+
+warmup.warm_up(application)